@@ -0,0 +1,43 @@
+"""unique task trace
+
+Revision ID: 52255cb6b79b
+Revises: 758132bb636f
+Create Date: 2026-10-18 09:12:41.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '52255cb6b79b'
+down_revision = '758132bb636f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # remove duplicates which slipped through the old select-delete-insert persistence:
+    # keep the newest state per task, on equal states keep the first persisted row
+    op.execute(
+        """
+        DELETE FROM run_metric
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY token, run_id, task_id
+                    ORDER BY coalesce(array_position(ARRAY['SUBMITTED', 'RUNNING', 'ABORTED', 'FAILED', 'COMPLETED']::varchar[], status), 0) DESC, id
+                ) AS position
+                FROM run_metric
+            ) ranked
+            WHERE ranked.position > 1
+        )
+        """
+    )
+    op.create_unique_constraint(
+        'uq_run_metric_task', 'run_metric', ['token', 'run_id', 'task_id'], postgresql_nulls_not_distinct=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_run_metric_task', 'run_metric', type_='unique')
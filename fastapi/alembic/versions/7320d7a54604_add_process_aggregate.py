@@ -0,0 +1,94 @@
+"""add process aggregate
+
+Revision ID: 7320d7a54604
+Revises: ec033e4491f1
+Create Date: 2026-10-18 11:24:52.113907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7320d7a54604'
+down_revision = 'ec033e4491f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "process_aggregate",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("token", sa.String(), nullable=False),
+        sa.Column("run_name", sa.String(), nullable=True),
+        sa.Column("process", sa.String(), nullable=True),
+        sa.Column("task_count", sa.Integer(), nullable=True),
+        sa.Column("terminal_count", sa.Integer(), nullable=True),
+        sa.Column("realtime_sum", sa.BigInteger(), nullable=True),
+        sa.Column("realtime_count", sa.Integer(), nullable=True),
+        sa.Column("cpu_penalty_sum", sa.Float(), nullable=True),
+        sa.Column("cpu_penalty_count", sa.Integer(), nullable=True),
+        sa.Column("memory_penalty_sum", sa.Float(), nullable=True),
+        sa.Column("memory_penalty_count", sa.Integer(), nullable=True),
+        sa.Column("rss_ratio_sum", sa.Float(), nullable=True),
+        sa.Column("rss_ratio_count", sa.Integer(), nullable=True),
+        sa.Column("relation_count", sa.Integer(), nullable=True),
+        sa.Column("cpu_allocation_sum", sa.Float(), nullable=True),
+        sa.Column("cpu_allocation_min", sa.Float(), nullable=True),
+        sa.Column("cpu_allocation_max", sa.Float(), nullable=True),
+        sa.Column("memory_allocation_sum", sa.Float(), nullable=True),
+        sa.Column("memory_allocation_min", sa.Float(), nullable=True),
+        sa.Column("memory_allocation_max", sa.Float(), nullable=True),
+        sa.Column("max_cpus", sa.Integer(), nullable=True),
+        sa.Column("max_memory", sa.BigInteger(), nullable=True),
+        sa.UniqueConstraint("token", "run_name", "process", name="uq_process_aggregate_process", postgresql_nulls_not_distinct=True),
+    )
+
+    # backfill from the persisted traces, same rules as helpers.get_process_aggregate_deltas
+    op.execute(
+        """
+        INSERT INTO process_aggregate (
+            token, run_name, process, task_count, terminal_count, realtime_sum, realtime_count,
+            cpu_penalty_sum, cpu_penalty_count, memory_penalty_sum, memory_penalty_count, rss_ratio_sum, rss_ratio_count,
+            relation_count, cpu_allocation_sum, cpu_allocation_min, cpu_allocation_max,
+            memory_allocation_sum, memory_allocation_min, memory_allocation_max, max_cpus, max_memory
+        )
+        SELECT
+            token, run_name, process,
+            count(*),
+            count(*) FILTER (WHERE terminal),
+            coalesce(sum(realtime) FILTER (WHERE terminal), 0),
+            count(realtime) FILTER (WHERE terminal),
+            coalesce(sum(abs(1 - cpu_allocation / 100)) FILTER (WHERE terminal AND cpu_scored), 0),
+            count(*) FILTER (WHERE terminal AND cpu_scored),
+            coalesce(sum(abs(1 - rss::float8 / memory)) FILTER (WHERE terminal AND memory_scored), 0),
+            count(*) FILTER (WHERE terminal AND memory_scored),
+            coalesce(sum(rss::float8 / vmem) FILTER (WHERE terminal AND rss <> 0 AND vmem <> 0), 0),
+            count(*) FILTER (WHERE terminal AND rss <> 0 AND vmem <> 0),
+            count(*) FILTER (WHERE terminal AND cpu_scored AND memory_scored),
+            coalesce(sum(cpu_allocation) FILTER (WHERE terminal AND cpu_scored AND memory_scored), 0),
+            min(cpu_allocation) FILTER (WHERE terminal AND cpu_scored AND memory_scored),
+            max(cpu_allocation) FILTER (WHERE terminal AND cpu_scored AND memory_scored),
+            coalesce(sum(memory_allocation) FILTER (WHERE terminal AND cpu_scored AND memory_scored), 0),
+            min(memory_allocation) FILTER (WHERE terminal AND cpu_scored AND memory_scored),
+            max(memory_allocation) FILTER (WHERE terminal AND cpu_scored AND memory_scored),
+            max(cpus) FILTER (WHERE terminal AND cpus <> 0),
+            max(memory) FILTER (WHERE terminal AND memory <> 0)
+        FROM (
+            SELECT
+                token, run_name, process, realtime, rss, vmem, cpus, memory,
+                status IN ('ABORTED', 'FAILED', 'COMPLETED') AS terminal,
+                coalesce(status <> 'FAILED' AND cpus > 0 AND cpu_percentage <> 0, false) AS cpu_scored,
+                coalesce(status <> 'FAILED' AND memory > 0 AND rss <> 0, false) AS memory_scored,
+                cpu_percentage::float8 / nullif(cpus, 0) AS cpu_allocation,
+                rss::float8 / nullif(memory, 0) * 100 AS memory_allocation
+            FROM run_metric
+        ) traces
+        GROUP BY token, run_name, process
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("process_aggregate")
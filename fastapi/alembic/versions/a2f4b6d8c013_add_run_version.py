@@ -0,0 +1,35 @@
+"""add run version
+
+Revision ID: a2f4b6d8c013
+Revises: d4a6c8e2f175
+Create Date: 2026-10-19 09:14:52.603817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2f4b6d8c013'
+down_revision = 'd4a6c8e2f175'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "run_version",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("token", sa.String(), nullable=False),
+        sa.Column("run_name", sa.String(), nullable=True),
+        sa.Column("version", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("summarized_version", sa.BigInteger(), nullable=True),
+        sa.UniqueConstraint("token", "run_name", name="uq_run_version_run", postgresql_nulls_not_distinct=True),
+    )
+    # the existing summaries carry versions of the former Redis counters, the completed runs are summarized again
+    # at api startup (see crud.restore_run_completion_flags)
+    op.execute("DELETE FROM process_summary")
+
+
+def downgrade() -> None:
+    op.drop_table("run_version")
@@ -0,0 +1,28 @@
+"""add trace keyset index
+
+Revision ID: a9c41e07d2b5
+Revises: 7320d7a54604
+Create Date: 2026-10-18 13:05:41.226871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9c41e07d2b5'
+down_revision = '7320d7a54604'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # keyset pagination of traces orders by (run_name, task_id, id), see crud.get_trace_page
+    op.create_index(
+        'ix_run_metric_token_run_name_task', 'run_metric',
+        ['token', sa.text("coalesce(run_name, '')"), sa.text('coalesce(task_id, -1)'), 'id'],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_run_metric_token_run_name_task', table_name='run_metric')
@@ -0,0 +1,127 @@
+"""process aggregate analysis
+
+Revision ID: b3e7f1c9d042
+Revises: a2f4b6d8c013
+Create Date: 2026-10-20 10:41:07.215384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e7f1c9d042'
+down_revision = 'a2f4b6d8c013'
+branch_labels = None
+depends_on = None
+
+SUM_COLUMNS = [
+    ("scored_cpu_allocation_sum", sa.Float()), ("scored_memory_allocation_sum", sa.Float()),
+    ("cpus_requested_sum", sa.BigInteger()), ("cpus_requested_count", sa.Integer()),
+    ("memory_requested_sum", sa.BigInteger()), ("memory_requested_count", sa.Integer()),
+    ("cpus_used_sum", sa.Float()), ("cpus_used_count", sa.Integer()),
+    ("rss_sum", sa.BigInteger()), ("rss_count", sa.Integer()),
+    ("score_count", sa.Integer()), ("cpu_score_sum", sa.Float()), ("memory_score_sum", sa.Float()),
+    ("cpu_score_weight_sum", sa.Float()), ("memory_score_weight_sum", sa.Float()),
+]
+
+# same expressions as models.TOP_TASK_KEYS, as compiled by SQLAlchemy - the planner only uses the indexes for
+# queries with identical expressions
+TOP_TASK_INDEXES = {
+    "ix_run_metric_token_run_name_top_realtime": "coalesce(nullif(realtime, 0), -1)",
+    "ix_run_metric_token_run_name_top_raw_cpu_penalty": (
+        "coalesce(nullif(CASE WHEN (status IS DISTINCT FROM 'FAILED' AND cpus > 0 AND cpu_percentage != 0) "
+        "THEN abs(1 - (CAST(cpu_percentage AS FLOAT(53)) / CAST(CAST(cpus AS FLOAT(53)) AS FLOAT(53))) / CAST(100.0 AS FLOAT)) END, 0), -1)"
+    ),
+    "ix_run_metric_token_run_name_top_raw_memory_penalty": (
+        "coalesce(nullif(CASE WHEN (status IS DISTINCT FROM 'FAILED' AND memory > 0 AND rss != 0) "
+        "THEN abs(1 - CAST(rss AS FLOAT(53)) / CAST(CAST(memory AS FLOAT(53)) AS FLOAT(53))) END, 0), -1)"
+    ),
+}
+
+
+def upgrade() -> None:
+    for name, column_type in SUM_COLUMNS:
+        op.add_column("process_aggregate", sa.Column(name, column_type, nullable=True, server_default="0"))
+    op.add_column("process_aggregate", sa.Column("max_available_memory", sa.Float(), nullable=True))
+    # the analysis has no use for the largest requested memory
+    op.drop_column("process_aggregate", "max_memory")
+
+    # backfill from the persisted traces, same rules as helpers.add_task_to_process_aggregate
+    op.execute(
+        """
+        UPDATE process_aggregate SET
+            scored_cpu_allocation_sum = sums.scored_cpu_allocation_sum,
+            scored_memory_allocation_sum = sums.scored_memory_allocation_sum,
+            cpus_requested_sum = sums.cpus_requested_sum, cpus_requested_count = sums.cpus_requested_count,
+            memory_requested_sum = sums.memory_requested_sum, memory_requested_count = sums.memory_requested_count,
+            cpus_used_sum = sums.cpus_used_sum, cpus_used_count = sums.cpus_used_count,
+            rss_sum = sums.rss_sum, rss_count = sums.rss_count,
+            score_count = sums.score_count, cpu_score_sum = sums.cpu_score_sum, memory_score_sum = sums.memory_score_sum,
+            cpu_score_weight_sum = sums.cpu_score_weight_sum, memory_score_weight_sum = sums.memory_score_weight_sum,
+            max_available_memory = sums.max_available_memory
+        FROM (
+            SELECT
+                token, run_name, process,
+                coalesce(sum(cpu_allocation) FILTER (WHERE cpu_scored), 0) AS scored_cpu_allocation_sum,
+                coalesce(sum(memory_allocation) FILTER (WHERE memory_scored), 0) AS scored_memory_allocation_sum,
+                coalesce(sum(cpus) FILTER (WHERE cpus <> 0), 0) AS cpus_requested_sum,
+                count(*) FILTER (WHERE cpus <> 0) AS cpus_requested_count,
+                coalesce(sum(memory) FILTER (WHERE memory <> 0), 0) AS memory_requested_sum,
+                count(*) FILTER (WHERE memory <> 0) AS memory_requested_count,
+                coalesce(sum(cpu_percentage::float8 / 100) FILTER (WHERE cpu_percentage <> 0), 0) AS cpus_used_sum,
+                count(*) FILTER (WHERE cpu_percentage <> 0) AS cpus_used_count,
+                coalesce(sum(rss) FILTER (WHERE rss <> 0), 0) AS rss_sum,
+                count(*) FILTER (WHERE rss <> 0) AS rss_count,
+                count(*) FILTER (WHERE scored) AS score_count,
+                coalesce(sum(cpu_score * cpu_percentage::float8 / 100 * realtime) FILTER (WHERE scored), 0) AS cpu_score_sum,
+                coalesce(sum(memory_score * rss::float8 / 1073741824 / 8 * realtime) FILTER (WHERE scored), 0) AS memory_score_sum,
+                coalesce(sum(cpu_percentage::float8 / 100 * realtime) FILTER (WHERE scored), 0) AS cpu_score_weight_sum,
+                coalesce(sum(rss::float8 / 1073741824 / 8 * realtime) FILTER (WHERE scored), 0) AS memory_score_weight_sum,
+                max(greatest(rss, CASE WHEN memory_percentage > 0 THEN 100 / memory_percentage::float8 * rss END)) FILTER (WHERE rss > 0) AS max_available_memory
+            FROM (
+                SELECT
+                    *,
+                    cpu_scored AND memory_scored AND coalesce(realtime <> 0, false)
+                        AND cpu_score <> 0 AND memory_score <> 0 AS scored
+                FROM (
+                    SELECT
+                        *,
+                        CASE WHEN cpu_allocation > 100 THEN exp(-4 * abs(1 - cpu_allocation / 100)) ELSE cpu_allocation / 100 END AS cpu_score,
+                        CASE WHEN memory_allocation > 100 THEN exp(-4 * abs(1 - memory_allocation / 100)) ELSE memory_allocation / 100 END AS memory_score
+                    FROM (
+                        SELECT
+                            token, run_name, process, realtime, rss, cpus, memory, cpu_percentage, memory_percentage,
+                            coalesce(status <> 'FAILED' AND cpus > 0 AND cpu_percentage <> 0, false) AS cpu_scored,
+                            coalesce(status <> 'FAILED' AND memory > 0 AND rss <> 0, false) AS memory_scored,
+                            cpu_percentage::float8 / nullif(cpus, 0) AS cpu_allocation,
+                            rss::float8 / nullif(memory, 0) * 100 AS memory_allocation
+                        FROM run_metric
+                        WHERE status IN ('ABORTED', 'FAILED', 'COMPLETED')
+                    ) traces
+                ) scored_traces
+            ) terminal_traces
+            GROUP BY token, run_name, process
+        ) sums
+        WHERE process_aggregate.token = sums.token
+            AND process_aggregate.run_name IS NOT DISTINCT FROM sums.run_name
+            AND process_aggregate.process IS NOT DISTINCT FROM sums.process
+        """
+    )
+
+    op.execute(
+        "CREATE INDEX ix_run_metric_token_run_name_unfinished ON run_metric (token, run_name) "
+        "WHERE status IS NULL OR (status NOT IN ('ABORTED', 'FAILED', 'COMPLETED'))"
+    )
+    for name, expression in TOP_TASK_INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON run_metric (token, run_name, {expression})")
+
+
+def downgrade() -> None:
+    for name in TOP_TASK_INDEXES:
+        op.drop_index(name, table_name="run_metric")
+    op.drop_index("ix_run_metric_token_run_name_unfinished", table_name="run_metric")
+    op.add_column("process_aggregate", sa.Column("max_memory", sa.BigInteger(), nullable=True))
+    op.drop_column("process_aggregate", "max_available_memory")
+    for name, _ in reversed(SUM_COLUMNS):
+        op.drop_column("process_aggregate", name)
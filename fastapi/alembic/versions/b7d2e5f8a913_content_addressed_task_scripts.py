@@ -0,0 +1,55 @@
+"""content addressed task scripts
+
+Revision ID: b7d2e5f8a913
+Revises: f3a9c6d51e27
+Create Date: 2026-10-18 17:21:44.530918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e5f8a913'
+down_revision = 'f3a9c6d51e27'
+branch_labels = None
+depends_on = None
+
+# same as helpers.get_script_hash
+SCRIPT_HASH = "encode(sha256(convert_to(script, 'UTF8')), 'hex')"
+
+
+def upgrade() -> None:
+    op.create_table(
+        "task_script",
+        sa.Column("hash", sa.String(), primary_key=True),
+        sa.Column("script", sa.String(), nullable=False),
+    )
+    op.add_column("run_metric", sa.Column("script_hash", sa.String(), nullable=True))
+
+    # rewriting every row of a compressed chunk is far slower than decompressing it once, the compression policy
+    # compresses the chunks again on its next run
+    op.execute("SELECT decompress_chunk(chunk, if_compressed => true) FROM show_chunks('run_metric') chunk")
+    op.execute(
+        f"""
+        INSERT INTO task_script (hash, script)
+        SELECT DISTINCT ON (script_hash) script_hash, script
+        FROM (SELECT {SCRIPT_HASH} AS script_hash, script FROM run_metric WHERE script IS NOT NULL) scripts
+        ON CONFLICT DO NOTHING
+        """
+    )
+    op.execute(f"UPDATE run_metric SET script_hash = {SCRIPT_HASH} WHERE script IS NOT NULL")
+    op.drop_column("run_metric", "script")
+
+
+def downgrade() -> None:
+    op.add_column("run_metric", sa.Column("script", sa.String(), nullable=True))
+    op.execute("SELECT decompress_chunk(chunk, if_compressed => true) FROM show_chunks('run_metric') chunk")
+    op.execute(
+        """
+        UPDATE run_metric SET script = task_script.script
+        FROM task_script WHERE task_script.hash = run_metric.script_hash
+        """
+    )
+    op.drop_column("run_metric", "script_hash")
+    op.drop_table("task_script")
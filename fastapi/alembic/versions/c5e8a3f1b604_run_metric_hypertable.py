@@ -0,0 +1,78 @@
+"""run metric hypertable
+
+Revision ID: c5e8a3f1b604
+Revises: a9c41e07d2b5
+Create Date: 2026-10-18 15:12:09.418263
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8a3f1b604'
+down_revision = 'a9c41e07d2b5'
+branch_labels = None
+depends_on = None
+
+# time partitioning of run_metric on submit
+CHUNK_TIME_INTERVAL = os.environ.get('TIMESCALE_CHUNK_TIME_INTERVAL', '7 days')
+# additional hash partitioning on token, 0 to disable
+TOKEN_PARTITIONS = int(os.environ.get('TIMESCALE_TOKEN_PARTITIONS', '4'))
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS timescaledb")
+
+    # the time dimension must not be NULL, tasks without submit time are filed under their first known time
+    op.execute("UPDATE run_metric SET submit = coalesce(start, complete, now() AT TIME ZONE 'utc') WHERE submit IS NULL")
+    op.alter_column('run_metric', 'submit', existing_type=sa.DateTime(), nullable=False)
+
+    # unique constraints of a hypertable have to contain all partitioning columns
+    op.drop_constraint('run_metric_pkey', 'run_metric', type_='primary')
+    op.create_primary_key('run_metric_pkey', 'run_metric', ['id', 'token', 'submit'])
+    op.drop_constraint('uq_run_metric_task', 'run_metric', type_='unique')
+    op.create_unique_constraint(
+        'uq_run_metric_task', 'run_metric', ['token', 'run_id', 'task_id', 'submit'], postgresql_nulls_not_distinct=True,
+    )
+
+    if TOKEN_PARTITIONS > 0:
+        op.execute(
+            f"""
+            SELECT create_hypertable(
+                'run_metric', 'submit',
+                partitioning_column => 'token', number_partitions => {TOKEN_PARTITIONS},
+                chunk_time_interval => INTERVAL '{CHUNK_TIME_INTERVAL}', migrate_data => true
+            )
+            """
+        )
+    else:
+        op.execute(
+            f"""
+            SELECT create_hypertable(
+                'run_metric', 'submit', chunk_time_interval => INTERVAL '{CHUNK_TIME_INTERVAL}', migrate_data => true
+            )
+            """
+        )
+
+
+def downgrade() -> None:
+    # a hypertable cannot be converted back in place, copy the rows into a plain table
+    op.execute("CREATE TABLE run_metric_plain (LIKE run_metric INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO run_metric_plain SELECT * FROM run_metric")
+    op.execute("ALTER SEQUENCE run_metric_id_seq OWNED BY run_metric_plain.id")
+    op.drop_table('run_metric')
+    op.rename_table('run_metric_plain', 'run_metric')
+
+    op.create_primary_key('run_metric_pkey', 'run_metric', ['id'])
+    op.alter_column('run_metric', 'submit', existing_type=sa.DateTime(), nullable=True)
+    op.create_unique_constraint(
+        'uq_run_metric_task', 'run_metric', ['token', 'run_id', 'task_id'], postgresql_nulls_not_distinct=True,
+    )
+    op.create_index('ix_run_metric_token_run_name_process', 'run_metric', ['token', 'run_name', 'process'])
+    op.create_index(
+        'ix_run_metric_token_run_name_task', 'run_metric',
+        ['token', sa.text("coalesce(run_name, '')"), sa.text('coalesce(task_id, -1)'), 'id'],
+    )
@@ -0,0 +1,100 @@
+"""run stat snapshots
+
+Revision ID: d4a6c8e2f175
+Revises: b7d2e5f8a913
+Create Date: 2026-10-18 18:02:37.184562
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a6c8e2f175'
+down_revision = 'b7d2e5f8a913'
+branch_labels = None
+depends_on = None
+
+# same as crud.STAT_HISTORY_INTERVAL, the existing stat copies are downsampled into the history with it
+STAT_HISTORY_INTERVAL = int(os.environ.get('STAT_HISTORY_INTERVAL', '60'))
+
+HISTORY_COLUMNS = [
+    'submitted_count', 'pending_count', 'running_count', 'succeeded_count', 'failed_count', 'cached_count',
+    'aborted_count', 'ignored_count', 'retries_count', 'load_cpus', 'load_memory', 'peak_running',
+]
+
+
+def upgrade() -> None:
+    op.add_column("stat", sa.Column("token", sa.String(), nullable=True))
+    op.add_column("stat", sa.Column("run_id", sa.String(), nullable=True))
+    op.execute(
+        """
+        UPDATE stat SET token = run_metadata.token, run_id = run_metadata.run_id
+        FROM run_metadata WHERE run_metadata.id = stat.parent_id
+        """
+    )
+
+    op.create_table(
+        "stat_history",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("token", sa.String(), nullable=False),
+        sa.Column("run_id", sa.String(), nullable=True),
+        sa.Column("run_name", sa.String(), nullable=True),
+        sa.Column("event", sa.String(), nullable=True),
+        sa.Column("recorded_at", sa.DateTime(), nullable=False),
+        *[sa.Column(column, sa.BigInteger() if column == 'load_memory' else sa.Integer(), nullable=True) for column in HISTORY_COLUMNS],
+    )
+    op.create_index("ix_stat_history_token_run_id_recorded_at", "stat_history", ["token", "run_id", "recorded_at"])
+
+    if STAT_HISTORY_INTERVAL > 0:
+        # newest copy per run and interval
+        columns = ", ".join(HISTORY_COLUMNS)
+        stat_columns = ", ".join(f"stat.{column}" for column in HISTORY_COLUMNS)
+        bucket = f"date_bin(INTERVAL '{STAT_HISTORY_INTERVAL} seconds', run_metadata.timestamp, TIMESTAMP '2000-01-01')"
+        op.execute(
+            f"""
+            INSERT INTO stat_history (token, run_id, run_name, event, recorded_at, {columns})
+            SELECT DISTINCT ON (run_metadata.token, run_metadata.run_id, {bucket})
+                run_metadata.token, run_metadata.run_id, run_metadata.run_name, run_metadata.event, run_metadata.timestamp, {stat_columns}
+            FROM stat JOIN run_metadata ON run_metadata.id = stat.parent_id
+            WHERE run_metadata.token IS NOT NULL AND run_metadata.timestamp IS NOT NULL
+            ORDER BY run_metadata.token, run_metadata.run_id, {bucket}, run_metadata.timestamp DESC, stat.id DESC
+            """
+        )
+
+    # keep the newest stat of every run together with its processes
+    op.execute(
+        """
+        CREATE TEMPORARY TABLE outdated_stat AS
+        SELECT id FROM (
+            SELECT id, row_number() OVER (PARTITION BY token, run_id ORDER BY parent_id DESC, id DESC) AS position FROM stat
+        ) ranked WHERE position > 1
+        """
+    )
+    op.execute("DELETE FROM process WHERE parent_id IN (SELECT id FROM outdated_stat)")
+    op.execute("DELETE FROM stat WHERE id IN (SELECT id FROM outdated_stat)")
+    op.execute("DROP TABLE outdated_stat")
+    op.execute(
+        """
+        DELETE FROM process WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY parent_id, name ORDER BY id DESC) AS position FROM process
+            ) ranked WHERE position > 1
+        )
+        """
+    )
+
+    op.create_unique_constraint("uq_stat_run", "stat", ["token", "run_id"], postgresql_nulls_not_distinct=True)
+    op.create_unique_constraint("uq_process_stat_name", "process", ["parent_id", "name"], postgresql_nulls_not_distinct=True)
+
+
+def downgrade() -> None:
+    # the dropped stat copies cannot be restored, every run keeps its snapshot
+    op.drop_constraint("uq_process_stat_name", "process", type_="unique")
+    op.drop_constraint("uq_stat_run", "stat", type_="unique")
+    op.drop_index("ix_stat_history_token_run_id_recorded_at", table_name="stat_history")
+    op.drop_table("stat_history")
+    op.drop_column("stat", "run_id")
+    op.drop_column("stat", "token")
@@ -0,0 +1,41 @@
+"""add process summary
+
+Revision ID: e1b7d94c2a38
+Revises: c5e8a3f1b604
+Create Date: 2026-10-18 16:03:51.772014
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1b7d94c2a38'
+down_revision = 'c5e8a3f1b604'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # filled by crud.refresh_process_summaries once a run completed, already completed runs are enqueued at api startup
+    op.create_table(
+        "process_summary",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("token", sa.String(), nullable=False),
+        sa.Column("run_name", sa.String(), nullable=True),
+        sa.Column("metric", sa.String(), nullable=False),
+        sa.Column("process", sa.String(), nullable=True),
+        sa.Column("count", sa.Integer(), nullable=True),
+        sa.Column("sum", sa.Float(), nullable=True),
+        sa.Column("min", sa.Float(), nullable=True),
+        sa.Column("quartiles", postgresql.ARRAY(sa.Float()), nullable=True),
+        sa.Column("max", sa.Float(), nullable=True),
+        sa.Column("source_version", sa.BigInteger(), nullable=False),
+        sa.Column("refreshed_at", sa.DateTime(), nullable=True),
+        sa.UniqueConstraint("token", "run_name", "metric", "process", name="uq_process_summary_process", postgresql_nulls_not_distinct=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("process_summary")
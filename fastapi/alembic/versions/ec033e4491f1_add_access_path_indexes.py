@@ -0,0 +1,34 @@
+"""add access path indexes
+
+Revision ID: ec033e4491f1
+Revises: 52255cb6b79b
+Create Date: 2026-10-18 10:02:17.880412
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ec033e4491f1'
+down_revision = '52255cb6b79b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # run_metric by token is covered by uq_run_metric_task (token, run_id, task_id)
+    op.create_index('ix_run_metric_token_run_name_process', 'run_metric', ['token', 'run_name', 'process'])
+    op.create_index('ix_run_metadata_token_run_id', 'run_metadata', ['token', 'run_id'])
+    op.create_index('ix_stat_parent_id', 'stat', ['parent_id'])
+    op.create_index('ix_process_parent_id', 'process', ['parent_id'])
+    # crud.remove_token looks up the owning user with run_tokens @> ARRAY[token]
+    op.create_index('ix_user_run_tokens', 'user', ['run_tokens'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_run_tokens', table_name='user')
+    op.drop_index('ix_process_parent_id', table_name='process')
+    op.drop_index('ix_stat_parent_id', table_name='stat')
+    op.drop_index('ix_run_metadata_token_run_id', table_name='run_metadata')
+    op.drop_index('ix_run_metric_token_run_name_process', table_name='run_metric')
@@ -0,0 +1,47 @@
+"""run metric compression
+
+Revision ID: f3a9c6d51e27
+Revises: e1b7d94c2a38
+Create Date: 2026-10-18 16:48:30.095127
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c6d51e27'
+down_revision = 'e1b7d94c2a38'
+branch_labels = None
+depends_on = None
+
+# chunks whose submit range is older than this get compressed
+COMPRESS_AFTER = os.environ.get('TIMESCALE_COMPRESS_AFTER', '14 days')
+# chunks older than this get dropped, empty for no retention policy - see archive.py for archiving before dropping
+DROP_AFTER = os.environ.get('TIMESCALE_DROP_AFTER', '')
+
+
+def upgrade() -> None:
+    # all columns of the unique keys (token, run_id, task_id, submit) and (id, token, submit) have to be used for
+    # segmenting or ordering, so upserts and deletes keep working on compressed chunks
+    op.execute(
+        """
+        ALTER TABLE run_metric SET (
+            timescaledb.compress,
+            timescaledb.compress_segmentby = 'token, run_name',
+            timescaledb.compress_orderby = 'run_id, task_id, submit DESC, id'
+        )
+        """
+    )
+    op.execute(f"SELECT add_compression_policy('run_metric', compress_after => INTERVAL '{COMPRESS_AFTER}')")
+    if DROP_AFTER:
+        op.execute(f"SELECT add_retention_policy('run_metric', drop_after => INTERVAL '{DROP_AFTER}')")
+
+
+def downgrade() -> None:
+    op.execute("SELECT remove_retention_policy('run_metric', if_exists => true)")
+    op.execute("SELECT remove_compression_policy('run_metric', if_exists => true)")
+    op.execute("SELECT decompress_chunk(chunk, if_compressed => true) FROM show_chunks('run_metric') chunk")
+    op.execute("ALTER TABLE run_metric SET (timescaledb.compress = false)")
@@ -0,0 +1,76 @@
+import os
+import logging
+
+from sqlalchemy import text
+
+import export
+from database import get_session
+
+TRACE_ARCHIVE_AFTER = os.environ.get('TRACE_ARCHIVE_AFTER', '180 days')
+TRACE_ARCHIVE_DIR = os.environ.get('TRACE_ARCHIVE_DIR', 'archive')
+TRACE_ARCHIVE_CHUNK_SIZE = 10000
+
+logger = logging.getLogger('archive')
+
+"""
+Archive-then-drop job for old trace data.
+Every run_metric chunk whose submit range ends before the cutoff is written to TRACE_ARCHIVE_DIR as Parquet file
+(same format as the columnar export) and only dropped once all of them were archived. Metadata, stats, processes,
+process aggregates and process summaries are kept: the default run analysis (scores and per process results, computed
+from the aggregates) and the boxplots without tag filter stay available for archived runs. Everything read from the
+traces themselves only covers the tasks still in the database - the worst task lists and the task information of the
+analysis, the trace lists and pages, tag filtered boxplots and the exports. A summary refresh of an archived run,
+caused by late traces, recomputes its summaries from the remaining traces as well.
+Run it periodically, e.g. from cron with `python archive.py`, or enqueue archive_old_traces as queue job.
+"""
+
+
+def archive_chunk(db, chunk_name, archive_dir):
+    """
+    Writes all rows of a chunk to <archive_dir>/<chunk>.parquet, via a temporary file so a crash never leaves a
+    truncated archive behind.
+    :return: the path of the archive
+    """
+    columns = ", ".join(f'"{column}"' for column in export.get_export_columns("run_metric"))
+    result = db.execute(text(f"SELECT {columns} FROM {chunk_name} ORDER BY id").execution_options(yield_per=TRACE_ARCHIVE_CHUNK_SIZE))
+    path = os.path.join(archive_dir, f"{chunk_name.split('.')[-1]}.parquet")
+    with open(f"{path}.tmp", "wb") as archive_file:
+        for data in export.stream_export("run_metric", "parquet", result.partitions()):
+            archive_file.write(data)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def archive_old_traces(older_than=TRACE_ARCHIVE_AFTER, archive_dir=TRACE_ARCHIVE_DIR):
+    """
+    :param older_than: postgres interval, chunks with older data get archived and dropped
+    :param archive_dir: directory the parquet files are written to
+    :return: the archived (and dropped) chunks
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    db = get_session()
+    try:
+        # fixed cutoff, so no chunk gets old enough to be dropped in between without being archived
+        cutoff = db.execute(text("SELECT (now() - CAST(:older_than AS INTERVAL))::timestamp"), {"older_than": older_than}).scalar()
+        chunks = db.execute(text("SELECT show_chunks('run_metric', older_than => :cutoff)"), {"cutoff": cutoff}).scalars().all()
+        archived = {}
+        for chunk_name in chunks:
+            archived[chunk_name] = archive_chunk(db, chunk_name, archive_dir)
+            logger.info(f"Archived {chunk_name} to {archived[chunk_name]}")
+        dropped = db.execute(text("SELECT drop_chunks('run_metric', older_than => :cutoff)"), {"cutoff": cutoff}).scalars().all()
+        not_archived = set(dropped) - set(archived)
+        if len(not_archived) > 0:
+            raise RuntimeError(f"Refusing to drop chunks which were not archived: {', '.join(sorted(not_archived))}")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    logger.info(f"Dropped {len(dropped)} chunks older than {cutoff}")
+    return {"cutoff": str(cutoff), "archived": archived, "dropped": dropped}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    archive_old_traces()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import heapq
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import helpers
+from bench_scoring import THRESHOLDS, synthetic_run
+
+"""
+Analyze benchmark: the per-run grouping and top-k part of helpers.analyze, grouped with one scan per process and
+fully sorted as before, against helpers.group_tasks_by_process and heapq, plus the full helpers.analyze call.
+The task dicts are scored once up front with helpers.calculate_scores_columnar. Needs neither Postgres nor Redis.
+Usage: python benchmarks/bench_analyze.py [--tasks 200000] [--processes 300] [--repeat 3]
+"""
+
+TOP_K_KEYS = ['realtime', 'raw_cpu_penalty', 'raw_memory_penalty']
+
+
+def scan_per_process(run_task_information, top_k):
+    distinct_process_names = list(set([task['process'] for task in run_task_information]))
+    tasks_by_process = {process: [task for task in run_task_information if task['process'] == process] for process in distinct_process_names}
+    top_tasks = [sorted(run_task_information, key=lambda task: task.get(key, -1) or -1, reverse=True)[:top_k] for key in TOP_K_KEYS]
+    return helpers.get_per_process_results_from_tasks(tasks_by_process), top_tasks
+
+
+def single_pass(run_task_information, top_k):
+    tasks_by_process = helpers.group_tasks_by_process(run_task_information)
+    top_tasks = [heapq.nlargest(top_k, run_task_information, key=lambda task: task.get(key, -1) or -1) for key in TOP_K_KEYS]
+    return helpers.get_per_process_results_from_tasks(tasks_by_process), top_tasks
+
+
+def measure(function, *args, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=200000)
+    parser.add_argument("--processes", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    grouped_processes = {"run": synthetic_run(args.tasks, args.processes)}
+    run_task_information = helpers.calculate_scores_columnar(grouped_processes, THRESHOLDS)['task_information']['run']
+
+    reference, (reference_results, reference_top) = measure(scan_per_process, run_task_information, args.top_k, repeat=args.repeat)
+    current, (current_results, current_top) = measure(single_pass, run_task_information, args.top_k, repeat=args.repeat)
+    analyze, _ = measure(helpers.analyze, None, grouped_processes, THRESHOLDS, repeat=args.repeat)
+
+    # the process order differs between both groupings, the per process results have to match per name
+    same_results = all(
+        sorted(reference_results[key], key=str) == sorted(current_results[key], key=str)
+        for key in ["duration_sum", "duration_average", "cpu_allocation", "memory_allocation", "rss_ratio"]
+    )
+    print(f"{args.tasks} tasks, {args.processes} processes")
+    print(f"per process scan + sort: {reference:.3f} s")
+    print(f"single pass + heapq:     {current:.3f} s ({reference / current:.1f}x)")
+    print(f"helpers.analyze:         {analyze:.3f} s")
+    print(f"equal top-k lists: {reference_top == current_top}, equal per process results: {same_results}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import os
+import sys
+import argparse
+import tempfile
+from datetime import timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive
+import crud
+import database
+from bench_hypertable import START, create_run_metric, fill_run_metric, measure, upsert_events
+
+"""
+Compression and archive benchmark: size of run_metric and latency of the per token reads and of the trace upsert
+with all chunks uncompressed, after compressing the chunks older than the cutoff with the settings of alembic revision
+f3a9c6d51e27, and after writing these chunks to Parquet with archive.archive_chunk and dropping them. A copy of
+run_metric is created as hypertable in the schema bench_archive, filled with synthetic traces and queried through the
+crud functions with the search_path set to the schema. The schema is dropped afterwards. Needs a local Postgres with
+TimescaleDB and the current schema (alembic upgrade head), configured by the POSTGRES_* environment variables like
+the api.
+Usage: POSTGRES_HOST=localhost python benchmarks/bench_archive.py [--rows 2000000] [--days 90] [--recent-days 14]
+"""
+
+SCHEMA = "bench_archive"
+STAGES = ["uncompressed", "compressed", "archived"]
+
+
+def compress_old_chunks(connection, cutoff):
+    # same settings as alembic revision f3a9c6d51e27
+    connection.execute(text(
+        f"""
+        ALTER TABLE {SCHEMA}.run_metric SET (
+            timescaledb.compress,
+            timescaledb.compress_segmentby = 'token, run_name',
+            timescaledb.compress_orderby = 'run_id, task_id, submit DESC, id'
+        )
+        """
+    ))
+    connection.execute(text(f"SELECT compress_chunk(chunk) FROM show_chunks('{SCHEMA}.run_metric', older_than => :cutoff) chunk"), {"cutoff": cutoff})
+
+
+def archive_old_chunks(engine, cutoff, archive_dir):
+    with Session(engine) as db:
+        chunks = db.execute(text(f"SELECT show_chunks('{SCHEMA}.run_metric', older_than => :cutoff)"), {"cutoff": cutoff}).scalars().all()
+        paths = [archive.archive_chunk(db, chunk_name, archive_dir) for chunk_name in chunks]
+        db.execute(text(f"SELECT drop_chunks('{SCHEMA}.run_metric', older_than => :cutoff)"), {"cutoff": cutoff})
+        db.commit()
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def recent_upsert_events(token, count, offset, submit):
+    # into the newest chunk, which is neither compressed nor archived
+    return [{**event, "submit": submit, "start": submit} for event in upsert_events(token, count, offset)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--tasks-per-run", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=90, help="time span the tasks are submitted over")
+    parser.add_argument("--recent-days", type=int, default=14, help="chunks older than this get compressed and archived")
+    parser.add_argument("--chunk-interval", default="7 days")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark schema")
+    args = parser.parse_args()
+
+    engine = create_engine(database.SQLALCHEMY_DATABASE_URL)
+    with engine.begin() as connection:
+        create_run_metric(connection, SCHEMA, args, True)
+        fill_run_metric(connection, SCHEMA, args)
+    try:
+        token = "token_0"
+        end = START + timedelta(days=args.days)
+        cutoff = end - timedelta(days=args.recent_days)
+        since = end - timedelta(days=7)
+        queries = {
+            "analysis rows of a token": lambda db: crud.get_task_scoring_rows_by_token(db, token),
+            "last 7 days of a token": lambda db: crud.get_task_rows_by_run_name(db, token, since=since),
+            "first trace page": lambda db: crud.get_trace_page(db, token, 100),
+            "upsert of 500 tasks": lambda db: db.execute(crud.trace_upsert_statement(recent_upsert_events(token, 500, args.rows, since))),
+        }
+        latencies = {name: [] for name in queries}
+        sizes = {"table [MB]": [], "archive [MB]": []}
+        archive_size = 0
+        with tempfile.TemporaryDirectory() as archive_dir:
+            for stage in STAGES:
+                if stage == "compressed":
+                    with engine.begin() as connection:
+                        compress_old_chunks(connection, cutoff)
+                elif stage == "archived":
+                    archive_size = archive_old_chunks(engine, cutoff, archive_dir)
+                with engine.begin() as connection:
+                    connection.execute(text(f"ANALYZE {SCHEMA}.run_metric"))
+                for name, function in queries.items():
+                    latencies[name].append(measure(engine, SCHEMA, function, args.repeat))
+                with engine.connect() as connection:
+                    sizes["table [MB]"].append(connection.execute(text(f"SELECT hypertable_size('{SCHEMA}.run_metric')")).scalar() / 2 ** 20)
+                sizes["archive [MB]"].append(archive_size / 2 ** 20)
+
+        print(f"{args.rows} traces of {args.tokens} tokens over {args.days} days, chunks older than {args.recent_days} days "
+              f"compressed, then archived, median of {args.repeat} [ms]")
+        print(f"{'query':>26} " + " ".join(f"{stage:>13}" for stage in STAGES))
+        for name, values in {**latencies, **sizes}.items():
+            print(f"{name:>26} " + " ".join(f"{value:>13.1f}" for value in values))
+    finally:
+        if not args.keep:
+            with engine.begin() as connection:
+                connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == '__main__':
+    main()
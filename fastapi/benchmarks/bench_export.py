@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import BigInteger, Integer, Float, Boolean, DateTime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crud
+import export
+
+"""
+Export benchmark: synthetic rows of an exportable table serialized in memory by export.stream_export as Arrow IPC
+stream and Parquet file, against jsonable_encoder on ORM instances plus json.dumps as /run/info did. Needs
+pyarrow, but neither Postgres nor Redis.
+Usage: python benchmarks/bench_export.py [--rows 200000] [--table run_metric] [--chunk-size 10000] [--skip-json]
+"""
+
+
+def synthetic_value(rng, column, index):
+    if column.name == "id":
+        return index
+    if rng.random() < 0.05 and column.nullable:
+        return None
+    # BigInteger is a subclass of Integer, so it has to be checked first, like in export.get_arrow_type
+    if isinstance(column.type, BigInteger):
+        return rng.randint(0, 2 ** 40)
+    if isinstance(column.type, Integer):
+        return rng.randint(0, 2 ** 16)
+    if isinstance(column.type, Float):
+        return rng.uniform(0, 100)
+    if isinstance(column.type, Boolean):
+        return rng.random() < 0.5
+    if isinstance(column.type, DateTime):
+        return datetime(2026, 1, 1) + timedelta(seconds=rng.randint(0, 10 ** 6))
+    return f"{column.name}_{rng.randint(0, 1000)}"
+
+
+def synthetic_chunks(table, count, chunk_size, seed=0):
+    rng = random.Random(seed)
+    columns = list(crud.EXPORT_TABLES[table].__table__.columns)
+    rows = [tuple(synthetic_value(rng, column, index) for column in columns) for index in range(count)]
+    return [rows[start:start + chunk_size] for start in range(0, count, chunk_size)]
+
+
+def measure_export(table, format, chunks):
+    started = time.perf_counter()
+    size = sum(len(data) for data in export.stream_export(table, format, iter(chunks)))
+    return time.perf_counter() - started, size
+
+
+def measure_json(table, chunks):
+    model = crud.EXPORT_TABLES[table]
+    columns = export.get_export_columns(table)
+    instances = [model(**dict(zip(columns, row))) for chunk in chunks for row in chunk]
+    started = time.perf_counter()
+    size = len(json.dumps(jsonable_encoder(instances)))
+    return time.perf_counter() - started, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--table", choices=list(crud.EXPORT_TABLES), default="run_metric")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--skip-json", action="store_true", help="skip the slow json baseline")
+    args = parser.parse_args()
+
+    chunks = synthetic_chunks(args.table, args.rows, args.chunk_size)
+    results = [(format, *measure_export(args.table, format, chunks)) for format in export.EXPORT_FORMATS]
+    if not args.skip_json:
+        results.append(("json", *measure_json(args.table, chunks)))
+
+    print(f"{args.rows} {args.table} rows")
+    print(f"{'format':>8} {'size [MB]':>10} {'time [s]':>9}")
+    for format, seconds, size in results:
+        print(f"{format:>8} {size / 2 ** 20:>10.1f} {seconds:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
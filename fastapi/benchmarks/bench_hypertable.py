@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crud
+import database
+import models
+
+"""
+Hypertable benchmark: latency of the per token reads and of the trace upsert on run_metric as a plain table against
+the TimescaleDB hypertable of alembic revision c5e8a3f1b604, plus the size of both. Two copies of run_metric (same
+columns, constraints and indexes) are created in the schemas bench_plain and bench_hypertable, filled with the same
+synthetic traces and queried through the crud functions with the search_path set to the schema. The schemas are
+dropped afterwards. Needs a local Postgres with TimescaleDB and the current schema (alembic upgrade head),
+configured by the POSTGRES_* environment variables like the api.
+Usage: POSTGRES_HOST=localhost python benchmarks/bench_hypertable.py [--rows 2000000] [--tokens 50] [--days 90]
+"""
+
+SCHEMAS = ["bench_plain", "bench_hypertable"]
+START = datetime(2026, 1, 1)
+
+
+def fill_run_metric(connection, schema, args):
+    # tasks of a token are submitted over the whole time span, a run takes about a day
+    connection.execute(text(
+        f"""
+        INSERT INTO {schema}.run_metric (
+            token, run_id, run_name, task_id, process, status, submit, start, complete,
+            cpus, memory, realtime, cpu_percentage, rss, vmem, memory_percentage
+        )
+        SELECT
+            'token_' || i % :tokens, 'run_' || i % :tokens || '_' || (i / :tokens) / :tasks_per_run,
+            'run_' || i % :tokens || '_' || (i / :tokens) / :tasks_per_run, i, 'PROCESS_' || i % 20, 'COMPLETED',
+            :start + (i::float8 / :rows) * (:days * INTERVAL '1 day'),
+            :start + (i::float8 / :rows) * (:days * INTERVAL '1 day') + INTERVAL '1 minute',
+            :start + (i::float8 / :rows) * (:days * INTERVAL '1 day') + INTERVAL '10 minutes',
+            1 + i % 16, (1 + i % 64)::bigint * 1073741824, 1000 * (1 + i % 3600), (i % 1600)::float,
+            (i % 1024)::bigint * 1048576, (i % 2048)::bigint * 1048576, (i % 100)::float
+        FROM generate_series(0, :rows - 1) AS i
+        """
+    ), {"tokens": args.tokens, "tasks_per_run": args.tasks_per_run, "rows": args.rows, "days": args.days, "start": START})
+    connection.execute(text(f"ANALYZE {schema}.run_metric"))
+
+
+def create_run_metric(connection, schema, args, hypertable):
+    connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+    connection.execute(text(f"CREATE SCHEMA {schema}"))
+    connection.execute(text(f"CREATE TABLE {schema}.run_metric (LIKE public.run_metric INCLUDING ALL)"))
+    if hypertable:
+        connection.execute(text(
+            f"SELECT create_hypertable('{schema}.run_metric', 'submit', partitioning_column => 'token', "
+            f"number_partitions => 4, chunk_time_interval => INTERVAL '{args.chunk_interval}')"
+        ))
+
+
+def create_tables(connection, args):
+    for schema in SCHEMAS:
+        create_run_metric(connection, schema, args, schema == "bench_hypertable")
+        fill_run_metric(connection, schema, args)
+
+
+def table_size(connection, schema):
+    if schema == "bench_hypertable":
+        return connection.execute(text("SELECT hypertable_size('bench_hypertable.run_metric')")).scalar()
+    return connection.execute(text(f"SELECT pg_total_relation_size('{schema}.run_metric')")).scalar()
+
+
+def upsert_events(token, count, offset):
+    submit = START + timedelta(days=1)
+    return [
+        {
+            **{column.name: None for column in models.RunTrace.__table__.columns if not column.primary_key},
+            "token": token, "run_id": "run_upsert", "run_name": "run_upsert", "task_id": offset + index, "status": "RUNNING",
+            "process": "PROCESS_0", "submit": submit, "start": submit,
+        }
+        for index in range(count)
+    ]
+
+
+def measure(engine, schema, function, repeat):
+    timings = []
+    for _ in range(repeat):
+        with Session(engine) as db:
+            db.execute(text(f"SET search_path TO {schema}, public"))
+            started = time.perf_counter()
+            function(db)
+            timings.append(time.perf_counter() - started)
+            db.rollback()
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--tasks-per-run", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=90, help="time span the tasks are submitted over")
+    parser.add_argument("--chunk-interval", default="7 days")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark schemas")
+    args = parser.parse_args()
+
+    engine = create_engine(database.SQLALCHEMY_DATABASE_URL)
+    with engine.begin() as connection:
+        create_tables(connection, args)
+    try:
+        token = "token_0"
+        since = START + timedelta(days=args.days - 7)
+        queries = {
+            "analysis rows of a token": lambda db: crud.get_task_scoring_rows_by_token(db, token),
+            "last 7 days of a token": lambda db: crud.get_task_rows_by_run_name(db, token, since=since),
+            "first trace page": lambda db: crud.get_trace_page(db, token, 100),
+            "upsert of 500 tasks": lambda db: db.execute(crud.trace_upsert_statement(upsert_events(token, 500, args.rows))),
+        }
+        print(f"{args.rows} traces of {args.tokens} tokens over {args.days} days, median of {args.repeat} [ms]")
+        print(f"{'query':>26} {'plain':>10} {'hypertable':>11}")
+        for name, function in queries.items():
+            plain, hypertable = [measure(engine, schema, function, args.repeat) for schema in SCHEMAS]
+            print(f"{name:>26} {plain:>10.1f} {hypertable:>11.1f}")
+        with engine.connect() as connection:
+            plain, hypertable = [table_size(connection, schema) / 2 ** 20 for schema in SCHEMAS]
+        print(f"{'size [MB]':>26} {plain:>10.1f} {hypertable:>11.1f}")
+    finally:
+        if not args.keep:
+            with engine.begin() as connection:
+                for schema in SCHEMAS:
+                    connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+
+
+if __name__ == '__main__':
+    main()
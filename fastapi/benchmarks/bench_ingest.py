@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crud
+import database
+
+"""
+Ingest benchmark: events per second of the trace persistence of the queue jobs, with a new async engine per event as
+before against the pooled engine of database.get_async_session, plus the batched persistence of ingest.py
+(crud.persist_trace_batch). Every event is a new task of a benchmark token, its rows are deleted afterwards.
+Only the database work is measured, Redis is not needed. Needs a local Postgres with the current schema (alembic
+upgrade head), configured by the POSTGRES_* environment variables like the api.
+Usage: POSTGRES_HOST=localhost python benchmarks/bench_ingest.py [--events 2000] [--batch-size 500]
+"""
+
+
+def synthetic_event(rng, index):
+    submit = 1_700_000_000_000 + index * 1000
+    return {
+        "runId": "benchmark", "runName": "benchmark", "event": "process_completed",
+        "trace": {
+            "task_id": index, "status": "COMPLETED", "process": f"PROCESS_{index % 20}", "tag": None,
+            "submit": submit, "start": submit + 500, "complete": submit + 60000,
+            "cpus": rng.randint(1, 16), "memory": rng.randint(1, 64) * 2 ** 30, "realtime": rng.randint(1, 10 ** 6),
+            "%cpu": round(rng.uniform(0.1, 1600), 1), "%mem": round(rng.uniform(0.01, 100), 2),
+            "rss": rng.randint(1, 2 ** 36), "vmem": rng.randint(1, 2 ** 37),
+        },
+    }
+
+
+def new_engine_session():
+    # what database.get_async_session did before the engines were pooled: one engine with its own pool per event
+    engine = create_async_engine(database.SQLALCHEMY_ASYNC_DATABASE_URL, connect_args={"server_settings": {"jit": "off"}})
+    return engine, async_sessionmaker(engine, expire_on_commit=False)()
+
+
+async def persist_events(events, token, pooled):
+    for json_ob in events:
+        if pooled:
+            engine, session = None, database.get_async_session()
+        else:
+            engine, session = new_engine_session()
+        try:
+            await crud.persist_singleton_trace_data(session, crud.get_trace_data(json_ob, token))
+        finally:
+            await session.close()
+            if engine is not None:
+                await engine.dispose()
+
+
+def persist_batches(events, token, batch_size):
+    for start in range(0, len(events), batch_size):
+        crud.persist_trace_batch([(json_ob, token) for json_ob in events[start:start + batch_size]])
+
+
+def delete_token(token):
+    with database.get_engine().begin() as connection:
+        for table in ["run_metric", "process_aggregate", "run_version"]:
+            connection.execute(text(f"DELETE FROM {table} WHERE token = :token"), {"token": token})
+
+
+def measure(function, events):
+    token = f"benchmark-{uuid.uuid4()}"
+    started = time.perf_counter()
+    try:
+        function(events, token)
+        return len(events) / (time.perf_counter() - started)
+    finally:
+        delete_token(token)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    events = [synthetic_event(rng, index) for index in range(args.events)]
+    loop = asyncio.new_event_loop()
+    variants = [
+        ("engine per event", lambda events, token: loop.run_until_complete(persist_events(events, token, pooled=False))),
+        ("pooled engine", lambda events, token: loop.run_until_complete(persist_events(events, token, pooled=True))),
+        (f"batches of {args.batch_size}", lambda events, token: persist_batches(events, token, args.batch_size)),
+    ]
+
+    print(f"{args.events} trace events against {database.PG_HOST}:{database.PG_PORT}/{database.PG_DB}")
+    print(f"{'variant':>18} {'events/s':>10}")
+    for name, function in variants:
+        print(f"{name:>18} {measure(function, events):>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
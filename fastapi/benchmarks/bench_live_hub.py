@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import orjson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import live
+
+"""
+Load test of the live delta fan-out: SUBSCRIBERS websocket clients of one token are served by live.serve_websocket
+in a single process while MESSAGES deltas are dispatched to the hub, like the Redis listener does. Reports the
+delivery throughput, the dispatch-to-send latency and the resyncs of slow clients. Redis is not needed, the
+listener is replaced by direct dispatch calls.
+Usage: python benchmarks/bench_live_hub.py [--subscribers 1000] [--messages 200] [--slow 10]
+"""
+
+
+class BenchmarkWebSocket:
+    """
+    Stands in for an accepted websocket: records the latency of every sent delta and disconnects on close().
+    """
+
+    def __init__(self, latencies, send_delay=0):
+        self.latencies = latencies
+        self.last_delivery = 0
+        self.send_delay = send_delay
+        self.resyncs = 0
+        self.disconnected = asyncio.Event()
+
+    async def send_text(self, text):
+        message = orjson.loads(text)
+        if message["type"] == "resync":
+            self.resyncs += 1
+        elif message["type"] == "tasks":
+            self.last_delivery = time.perf_counter()
+            self.latencies.append(self.last_delivery - message["sent"])
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {"type": "websocket.disconnect"}
+
+    def close(self):
+        self.disconnected.set()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float("nan")
+
+
+async def run(subscribers, messages, slow, rate):
+    live.hub.ensure_listener = lambda: None
+    latencies = []
+    # the latencies of the slow clients are dominated by their own send delay, they are not part of the statistics
+    websockets = [
+        BenchmarkWebSocket([] if index < slow else latencies, send_delay=0.05 if index < slow else 0) for index in range(subscribers)
+    ]
+    clients = [asyncio.ensure_future(live.serve_websocket(websocket, "benchmark")) for websocket in websockets]
+    await asyncio.sleep(0.1)
+    assert live.hub.get_metrics()["clients"] == subscribers
+
+    started = time.perf_counter()
+    for number in range(messages):
+        live.hub.dispatch("benchmark", orjson.dumps({"type": "tasks", "number": number, "sent": time.perf_counter()}))
+        await asyncio.sleep(1 / rate if rate else 0)
+    # let the clients drain their queues
+    while any(not queue.empty() for queue in live.hub.subscribers["benchmark"]):
+        await asyncio.sleep(0.001)
+    elapsed = max(websocket.last_delivery for websocket in websockets[slow:]) - started
+
+    for websocket in websockets:
+        websocket.close()
+    await asyncio.gather(*clients)
+    assert live.hub.get_metrics()["clients"] == 0
+
+    print(f"subscribers {subscribers}, messages {messages}, slow clients {slow}")
+    print(f"delivered {len(latencies)} deltas to the other clients in {elapsed:.2f} s ({len(latencies) / elapsed:,.0f} deliveries/s)")
+    print(f"latency p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"resyncs sent to slow clients: {sum(websocket.resyncs for websocket in websockets)}, dropped messages: {live.hub.dropped}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--slow", type=int, default=10, help="clients which need 50 ms per send")
+    parser.add_argument("--rate", type=float, default=100, help="dispatched messages per second, 0 for as fast as possible")
+    args = parser.parse_args()
+    asyncio.run(run(args.subscribers, args.messages, args.slow, args.rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crud
+import models
+import schemas
+from bench_export import synthetic_value
+
+"""
+/run/info serialization benchmark: response body for synthetic traces grouped by run, built from ORM instances via
+jsonable_encoder plus JSONResponse as before, against the row dataclasses of crud.get_task_rows_by_run_name plus
+ORJSONResponse. Checks that both bodies hold the same json. Needs neither Postgres nor Redis.
+Usage: python benchmarks/bench_run_info.py [--sizes 10000 100000] [--runs 4]
+"""
+
+
+def synthetic_rows(count, runs, seed=0):
+    rng = random.Random(seed)
+    columns = [models.RunTrace.__table__.columns[name] for name in crud.TRACE_COLUMNS]
+    return [(f"run_{index % runs}", *(synthetic_value(rng, column, index) for column in columns)) for index in range(count)]
+
+
+def encoder_body(rows):
+    result_by_run_name = {}
+    for row in rows:
+        result_by_run_name.setdefault(row[0], []).append(models.RunTrace(**dict(zip(crud.TRACE_COLUMNS, row[1:]))))
+    return JSONResponse(content=jsonable_encoder(result_by_run_name)).body
+
+
+def orjson_body(rows):
+    row_class = schemas.trace_projection_dataclass(tuple(crud.TRACE_COLUMNS))
+    result_by_run_name = {}
+    for row in rows:
+        result_by_run_name.setdefault(row[0], []).append(row_class(*row[1:]))
+    return ORJSONResponse(content=result_by_run_name).body
+
+
+def measure(function, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = function(rows)
+        timings.append(time.perf_counter() - started)
+    return min(timings), body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--runs", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'jsonable_encoder [s]':>21} {'orjson [s]':>11} {'speedup':>8} {'equal':>6}")
+    for size in args.sizes:
+        rows = synthetic_rows(size, args.runs)
+        reference, reference_body = measure(encoder_body, rows, args.repeat)
+        current, current_body = measure(orjson_body, rows, args.repeat)
+        equal = orjson.loads(reference_body) == orjson.loads(current_body)
+        print(f"{size:>8} {reference:>21.2f} {current:>11.2f} {reference / current:>7.1f}x {str(equal):>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import random
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import helpers
+
+"""
+Scoring benchmark: dict based helpers.calculate_scores against helpers.calculate_scores_columnar on synthetic runs.
+Needs neither Postgres nor Redis.
+Usage: python benchmarks/bench_scoring.py [--sizes 10000 100000 1000000] [--processes 100] [--skip-dict-above 100000]
+"""
+
+THRESHOLDS = {'valid_cpu_allocation_deviation': None, 'valid_memory_allocation_deviation': None, 'cpu_weight': None, 'ram_weight': None}
+
+
+def synthetic_run(count, processes, seed=0):
+    rng = random.Random(seed)
+    process_names = [f"PROCESS_{index}" for index in range(processes)]
+    return [
+        SimpleNamespace(
+            task_id=task_id, process=rng.choice(process_names), run_name="run", tag=None,
+            cpus=rng.randint(1, 16), memory=rng.randint(1, 64) * 2 ** 30, duration=rng.randint(1, 10 ** 6),
+            vmem=rng.randint(1, 2 ** 36), realtime=rng.randint(1, 10 ** 6), cpu_percentage=round(rng.uniform(0.1, 2000), 1),
+            rss=rng.randint(1, 2 ** 37), memory_percentage=round(rng.uniform(0.01, 100), 2),
+            status="FAILED" if rng.random() < 0.05 else "COMPLETED",
+        )
+        for task_id in range(count)
+    ]
+
+
+def measure(function, grouped_processes, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(grouped_processes, THRESHOLDS)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--processes", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-dict-above", type=int, default=None, help="skip the dict based path for larger runs")
+    args = parser.parse_args()
+
+    print(f"{'tasks':>10} {'dict [s]':>10} {'columnar [s]':>13} {'speedup':>8}")
+    for size in args.sizes:
+        grouped_processes = {"run": synthetic_run(size, args.processes)}
+        columnar = measure(helpers.calculate_scores_columnar, grouped_processes, args.repeat)
+        if args.skip_dict_above is not None and size > args.skip_dict_above:
+            print(f"{size:>10} {'-':>10} {columnar:>13.3f} {'-':>8}")
+            continue
+        reference = measure(helpers.calculate_scores, grouped_processes, args.repeat)
+        print(f"{size:>10} {reference:>10.3f} {columnar:>13.3f} {reference / columnar:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
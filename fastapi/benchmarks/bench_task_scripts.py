@@ -0,0 +1,114 @@
+import os
+import sys
+import argparse
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from bench_hypertable import create_run_metric, fill_run_metric, measure
+
+"""
+Task script benchmark: size of the trace tables and scan latency with the script stored inline in every run_metric
+row as before, against the content-addressed task_script table of alembic revision b7d2e5f8a913 referenced by
+run_metric.script_hash. Two copies of run_metric are created in the schemas bench_inline (script column instead of
+script_hash) and bench_dedupe (plus a copy of task_script), filled with the same synthetic traces, whose tasks share
+--distinct-scripts scripts of --script-bytes each. The schemas are dropped afterwards. Needs a local Postgres with
+TimescaleDB and the current schema (alembic upgrade head), configured by the POSTGRES_* environment variables like
+the api.
+Usage: POSTGRES_HOST=localhost python benchmarks/bench_task_scripts.py [--rows 2000000] [--distinct-scripts 200]
+"""
+
+SCHEMAS = ["bench_inline", "bench_dedupe"]
+TRACE_COLUMNS = "id, token, run_id, run_name, task_id, process, status, submit, start, complete, cpus, memory, realtime, cpu_percentage, rss, vmem"
+QUERIES = {
+    "scan of all traces": {
+        schema: "SELECT count(*), sum(realtime) FROM run_metric" for schema in SCHEMAS
+    },
+    "traces of a token": {
+        schema: f"SELECT {TRACE_COLUMNS} FROM run_metric WHERE token = 'token_0'" for schema in SCHEMAS
+    },
+    "traces with script": {
+        "bench_inline": f"SELECT {TRACE_COLUMNS}, script FROM run_metric WHERE token = 'token_0'",
+        "bench_dedupe": f"SELECT {TRACE_COLUMNS}, (SELECT script FROM task_script WHERE hash = script_hash) AS script "
+                        f"FROM run_metric WHERE token = 'token_0'",
+    },
+}
+
+
+def create_tables(engine, args):
+    with engine.begin() as connection:
+        for schema in SCHEMAS:
+            create_run_metric(connection, schema, args, True)
+            fill_run_metric(connection, schema, args)
+        # random text, so the scripts do not compress better than real ones
+        connection.execute(text(
+            """
+            CREATE TABLE bench_dedupe.script AS
+            SELECT k, string_agg(md5(k || '_' || j), E'\\n') AS script
+            FROM generate_series(0, :distinct_scripts - 1) AS k, generate_series(1, :script_bytes / 33) AS j
+            GROUP BY k
+            """
+        ), {"distinct_scripts": args.distinct_scripts, "script_bytes": args.script_bytes})
+        connection.execute(text("ALTER TABLE bench_inline.run_metric DROP COLUMN script_hash, ADD COLUMN script TEXT"))
+        connection.execute(text(
+            "UPDATE bench_inline.run_metric SET script = s.script FROM bench_dedupe.script s WHERE s.k = task_id % :distinct_scripts"
+        ), {"distinct_scripts": args.distinct_scripts})
+        # same hash as helpers.get_script_hash
+        connection.execute(text("CREATE TABLE bench_dedupe.task_script (LIKE public.task_script INCLUDING ALL)"))
+        connection.execute(text(
+            "INSERT INTO bench_dedupe.task_script (hash, script) SELECT encode(sha256(convert_to(script, 'UTF8')), 'hex'), script FROM bench_dedupe.script"
+        ))
+        connection.execute(text(
+            "UPDATE bench_dedupe.run_metric SET script_hash = encode(sha256(convert_to(s.script, 'UTF8')), 'hex') "
+            "FROM bench_dedupe.script s WHERE s.k = task_id % :distinct_scripts"
+        ), {"distinct_scripts": args.distinct_scripts})
+        connection.execute(text("DROP TABLE bench_dedupe.script"))
+    # rewrites the tables, so the dead rows of the updates count neither for the size nor for the scans
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for schema in SCHEMAS:
+            connection.execute(text(f"VACUUM FULL ANALYZE {schema}.run_metric"))
+        connection.execute(text("VACUUM FULL ANALYZE bench_dedupe.task_script"))
+
+
+def table_size(connection, schema):
+    size = connection.execute(text(f"SELECT hypertable_size('{schema}.run_metric')")).scalar()
+    if schema == "bench_dedupe":
+        size += connection.execute(text("SELECT pg_total_relation_size('bench_dedupe.task_script')")).scalar()
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--tasks-per-run", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=90, help="time span the tasks are submitted over")
+    parser.add_argument("--chunk-interval", default="7 days")
+    parser.add_argument("--distinct-scripts", type=int, default=200)
+    parser.add_argument("--script-bytes", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark schemas")
+    args = parser.parse_args()
+
+    engine = create_engine(database.SQLALCHEMY_DATABASE_URL)
+    try:
+        create_tables(engine, args)
+        print(f"{args.rows} traces sharing {args.distinct_scripts} scripts of {args.script_bytes} bytes, median of {args.repeat} [ms]")
+        print(f"{'query':>26} {'inline':>10} {'dedupe':>10}")
+        for name, statements in QUERIES.items():
+            inline, dedupe = [measure(engine, schema, lambda db: db.execute(text(statements[schema])).all(), args.repeat) for schema in SCHEMAS]
+            print(f"{name:>26} {inline:>10.1f} {dedupe:>10.1f}")
+        with engine.connect() as connection:
+            inline, dedupe = [table_size(connection, schema) / 2 ** 20 for schema in SCHEMAS]
+        print(f"{'size [MB]':>26} {inline:>10.1f} {dedupe:>10.1f}")
+    finally:
+        if not args.keep:
+            with engine.begin() as connection:
+                for schema in SCHEMAS:
+                    connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import numpy as np
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+"""
+Event loop benchmark: ingest latency while heavy analysis requests run, with the sync database work done inside
+async def endpoints against plain def endpoints plus main.heavy_request. The database calls are replaced by
+blocking sleeps and the requests are ASGI calls in process, so neither Postgres, Redis nor a server is needed.
+The latency of every ingest request is measured from its scheduled send time.
+Usage: python benchmarks/bench_threadpool.py [--analysis-clients 8] [--analysis-ms 200] [--ingest-rate 200] [--ingest-ms 2]
+"""
+
+
+def blocking_app(analysis_seconds, ingest_seconds):
+    app = FastAPI()
+
+    @app.post("/run/analysis/")
+    async def analysis():
+        time.sleep(analysis_seconds)
+        return {}
+
+    @app.post("/run/")
+    async def ingest():
+        time.sleep(ingest_seconds)
+        return {}
+
+    return app
+
+
+def threadpool_app(analysis_seconds, ingest_seconds):
+    app = FastAPI()
+
+    @app.post("/run/analysis/")
+    @main.heavy_request
+    def analysis():
+        time.sleep(analysis_seconds)
+        return {}
+
+    @app.post("/run/")
+    def ingest():
+        time.sleep(ingest_seconds)
+        return {}
+
+    return app
+
+
+async def request(app, path):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": [],
+        "client": ("127.0.0.1", 0), "server": ("benchmark", 80),
+    }
+    received = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # writing to a socket gives the event loop back, like the server does
+        await asyncio.sleep(0)
+
+    await app(scope, receive, send)
+    disconnected.set()
+
+
+async def run(app, args):
+    finished = asyncio.Event()
+    latencies = []
+
+    async def analysis_client():
+        while not finished.is_set():
+            await request(app, "/run/analysis/")
+
+    async def ingest_request(scheduled):
+        await asyncio.sleep(max(0, scheduled - time.perf_counter()))
+        await request(app, "/run/")
+        latencies.append(time.perf_counter() - scheduled)
+
+    # every ingest request waits for its own send time, a blocked event loop delays all requests that are due
+    started = time.perf_counter()
+    clients = [asyncio.create_task(analysis_client()) for _ in range(args.analysis_clients)]
+    await asyncio.gather(*[ingest_request(started + index / args.ingest_rate) for index in range(int(args.duration * args.ingest_rate))])
+    finished.set()
+    await asyncio.gather(*clients)
+    return np.array(latencies) * 1000
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--analysis-clients", type=int, default=8)
+    parser.add_argument("--analysis-ms", type=float, default=200)
+    parser.add_argument("--ingest-rate", type=float, default=200, help="ingest requests per second")
+    parser.add_argument("--ingest-ms", type=float, default=2)
+    parser.add_argument("--duration", type=float, default=5, help="seconds of ingest requests per variant")
+    args = parser.parse_args()
+
+    print(f"{'variant':>24} {'ingest p50 [ms]':>16} {'ingest p99 [ms]':>16}")
+    for name, build in [("async def + sync IO", blocking_app), ("threadpool + limiter", threadpool_app)]:
+        main.heavy_request_limiter = None
+        app = build(args.analysis_ms / 1000, args.ingest_ms / 1000)
+        latencies = asyncio.run(run(app, args))
+        print(f"{name:>24} {np.percentile(latencies, 50):>16.1f} {np.percentile(latencies, 99):>16.1f}")
+
+
+if __name__ == '__main__':
+    main_benchmark()
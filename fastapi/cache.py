@@ -0,0 +1,255 @@
+from redis import Redis
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import orjson
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+
+ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', '300'))  # seconds
+# size limit of a single cached result, larger results are not cached. There is no limit on the total: every entry
+# expires after ANALYSIS_CACHE_TTL, so the cache holds at most the results computed within that time
+ANALYSIS_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRY_BYTES', str(8 * 1024 * 1024)))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))  # tokens kept per process
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', '60'))  # seconds
+
+r_con = Redis(host=REDIS_HOST, port=6379)
+
+logger = logging.getLogger('cache')
+
+"""
+Analysis result cache
+
+Results are stored under a key built from the token, the run name, the hash of the threshold parameters and the
+analysis version of the token. The ingest bumps the version whenever it persists data for a token, so outdated
+results are never read again and expire after ANALYSIS_CACHE_TTL. Version and result are read by one script, so a
+lookup is a single round trip.
+"""
+
+
+def analysis_version_key(token_id):
+    return f"analysis_version:{token_id}"
+
+
+def bump_analysis_version(token_ids):
+    pipeline = r_con.pipeline(transaction=False)
+    for token_id in set(token_ids):
+        pipeline.incr(analysis_version_key(token_id))
+    pipeline.execute()
+
+
+ANALYSIS_CACHE_STATS_KEY = "analysis_cache_stats"
+
+# reads the analysis version KEYS[1] of a token and the result cached for it under ARGV[1] .. version .. ARGV[2],
+# and counts the hit or miss in the hash KEYS[2] shared by all processes
+READ_ANALYSIS_SCRIPT = """
+local version = redis.call('GET', KEYS[1]) or '0'
+local cached = redis.call('GET', ARGV[1] .. version .. ARGV[2])
+redis.call('HINCRBY', KEYS[2], cached and 'hits' or 'misses', 1)
+return {version, cached}
+"""
+read_analysis = r_con.register_script(READ_ANALYSIS_SCRIPT)
+
+
+def get_cached_analysis(token_id, run_name, threshold_params, task_information=False):
+    """
+    Reads the analysis version of the token and the result cached for it in a single round trip
+    :param task_information: whether the result holds the scores of every task, both variants are cached separately
+    :return: tuple of the cache key to store a computed result under and the cached result, None on a miss
+    """
+    params_hash = hashlib.sha1(orjson.dumps(threshold_params, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    variant = "tasks" if task_information else "processes"
+    prefix, suffix = f"analysis:{token_id}:", f":{run_name or '*'}:{variant}:{params_hash}"
+    version, cached = read_analysis(keys=[analysis_version_key(token_id), ANALYSIS_CACHE_STATS_KEY], args=[prefix, suffix])
+    return f"{prefix}{version.decode()}{suffix}", cached
+
+
+def set_cached_analysis(cache_key, payload: bytes):
+    if len(payload) <= ANALYSIS_CACHE_MAX_ENTRY_BYTES:
+        r_con.set(cache_key, payload, ex=ANALYSIS_CACHE_TTL)
+
+
+def get_cache_metrics():
+    """
+    The analysis cache is counted over all processes, the token cache is a per-process LRU and counted for the
+    process answering the request only
+    """
+    hits, misses = [int(value or 0) for value in r_con.hmget(ANALYSIS_CACHE_STATS_KEY, "hits", "misses")]
+    token_lookups = sum(token_cache_stats.values())
+    return {
+        "analysis_cache": {
+            "scope": "all processes",
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": 0 if hits + misses == 0 else hits / (hits + misses),
+            "ttl": ANALYSIS_CACHE_TTL,
+            "max_entry_bytes": ANALYSIS_CACHE_MAX_ENTRY_BYTES,
+        },
+        "token_cache": {
+            "scope": "process",
+            "pid": os.getpid(),
+            **token_cache_stats,
+            "hit_rate": 0 if token_lookups == 0 else (token_cache_stats["local_hits"] + token_cache_stats["redis_hits"]) / token_lookups,
+            "size": len(token_cache),
+            "ttl": TOKEN_CACHE_TTL,
+        },
+    }
+
+
+def get_completed_runs(runs):
+    """
+    :param runs: list of (token_id, run_id, run_name) tuples
+    :return: the completed ones among them, see run completion flags below
+    """
+    pipeline = r_con.pipeline(transaction=False)
+    for token_id, run_id, run_name in runs:
+        pipeline.hexists(run_completion_key(token_id), f"{run_id}:{run_name}")
+    return [run for run, completed in zip(runs, pipeline.execute()) if completed]
+
+
+"""
+Token validity cache
+Tokens never change once created, so known tokens are kept in a per-process LRU (TOKEN_CACHE_SIZE entries, each
+valid for TOKEN_CACHE_TTL seconds) backed by the VALID_TOKENS_KEY set in Redis, which is shared by all processes.
+Only existing tokens are cached. Removing a token drops it from the set and publishes it on
+TOKEN_INVALIDATION_CHANNEL, every process subscribes to the channel from a background thread and drops the token
+from its LRU. Invalidations published while a process is not subscribed are lost, so the LRU is cleared whenever
+the subscription is (re)established. Lookups which started before an invalidation do not cache their result.
+"""
+
+VALID_TOKENS_KEY = "valid_tokens"
+TOKEN_INVALIDATION_CHANNEL = "token_invalidations"
+
+token_cache = OrderedDict()
+token_cache_lock = threading.Lock()
+token_cache_stats = {"local_hits": 0, "redis_hits": 0, "database_lookups": 0}
+token_cache_generation = 0 # bumped by every invalidation this process receives
+token_invalidation_listener_pid = None # process the listener thread runs in, threads do not survive a fork
+
+
+def remember_token(token_id, generation):
+    """
+    :param generation: token_cache_generation when the lookup started, the token is not cached if it changed since
+    """
+    with token_cache_lock:
+        if generation != token_cache_generation:
+            return
+        token_cache[token_id] = time.monotonic() + TOKEN_CACHE_TTL
+        token_cache.move_to_end(token_id)
+        while len(token_cache) > TOKEN_CACHE_SIZE:
+            token_cache.popitem(last=False)
+
+
+def forget_tokens(token_id=None):
+    """
+    Drops a token from the LRU of this process, or all tokens if token_id is None
+    """
+    global token_cache_generation
+    with token_cache_lock:
+        token_cache_generation += 1
+        if token_id is None:
+            token_cache.clear()
+        else:
+            token_cache.pop(token_id, None)
+
+
+def handle_invalidation_message(message):
+    if message["type"] == "subscribe":
+        # invalidations may have been missed while not subscribed
+        forget_tokens()
+    elif message["type"] == "message":
+        forget_tokens(message["data"].decode())
+
+
+def listen_for_invalidations():
+    while True:
+        pubsub = r_con.pubsub()
+        try:
+            pubsub.subscribe(TOKEN_INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                handle_invalidation_message(message)
+        except Exception:
+            logger.exception("Token invalidation subscription failed, reconnecting")
+            time.sleep(1)
+        finally:
+            pubsub.close()
+
+
+def ensure_invalidation_listener():
+    global token_invalidation_listener_pid
+    with token_cache_lock:
+        if token_invalidation_listener_pid == os.getpid():
+            return
+        token_invalidation_listener_pid = os.getpid()
+        token_cache.clear()
+    threading.Thread(target=listen_for_invalidations, name="token-invalidations", daemon=True).start()
+
+
+def is_valid_token(token_id, lookup):
+    """
+    :param token_id: the token id
+    :param lookup: callable checking the database, called if neither the LRU nor Redis know the token
+    :return: whether the token exists
+    """
+    ensure_invalidation_listener()
+    with token_cache_lock:
+        generation = token_cache_generation
+        expires = token_cache.get(token_id)
+        if expires is not None and expires > time.monotonic():
+            token_cache.move_to_end(token_id)
+            token_cache_stats["local_hits"] += 1
+            return True
+    if r_con.sismember(VALID_TOKENS_KEY, token_id):
+        token_cache_stats["redis_hits"] += 1
+        remember_token(token_id, generation)
+        return True
+    token_cache_stats["database_lookups"] += 1
+    if not lookup():
+        return False
+    r_con.sadd(VALID_TOKENS_KEY, token_id)
+    remember_token(token_id, generation)
+    return True
+
+
+def invalidate_token(token_id):
+    """
+    Removes a token from the cache of all processes, to be called once its deletion is committed
+    """
+    pipeline = r_con.pipeline(transaction=False)
+    pipeline.srem(VALID_TOKENS_KEY, token_id)
+    pipeline.publish(TOKEN_INVALIDATION_CHANNEL, token_id)
+    pipeline.execute()
+    forget_tokens(token_id)
+
+
+"""
+Run completion flags
+One hash per token with a field per completed (run_id, run_name). The ingest sets the field once a completed/failed
+metadata event is persisted, so POST /run/{token_id} can reject events of finished runs with a single HEXISTS.
+"""
+
+
+def run_completion_key(token_id):
+    return f"run_completed:{token_id}"
+
+
+def set_runs_completed(runs):
+    """
+    :param runs: iterable of (token_id, run_id, run_name) tuples
+    """
+    pipeline = r_con.pipeline(transaction=False)
+    for token_id, run_id, run_name in runs:
+        pipeline.hset(run_completion_key(token_id), f"{run_id}:{run_name}", 1)
+    pipeline.execute()
+
+
+def is_run_completed(token_id, run_id, run_name):
+    return bool(r_con.hexists(run_completion_key(token_id), f"{run_id}:{run_name}"))
+
+
+def clear_runs_completed(token_id):
+    r_con.delete(run_completion_key(token_id))
@@ -1,18 +1,26 @@
+import os
 import json
-from datetime import datetime
+import base64
+import binascii
+from datetime import datetime, timedelta
 import time
 from fastapi import Depends
 
-from database import engine, get_session, get_async_session
+from database import engine, get_session, get_async_session, run_in_worker_loop
 
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import create_engine, select
+from sqlalchemy import create_engine, select, insert, delete, update, func, tuple_, and_, or_, String, Float, literal, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert, array as pg_array, ARRAY
 import string, random
-import models, schemas, helpers
+import models, schemas, helpers, cache, live
 import logging
-import numpy as np
+from rq import Queue, get_current_job
+import orjson
+
+STAT_HISTORY_INTERVAL = int(os.environ.get('STAT_HISTORY_INTERVAL', '60'))  # seconds between stat history rows of a run, 0 to disable
 
 logger = logging.getLogger('rq.worker')
+summary_queue = Queue("request_queue", connection=cache.r_con)
 
 """
 Change the Session for each database query, instead of using all the same!
@@ -53,25 +61,53 @@ def get_full_processes(db: Session):
     return db.query(models.Process).all()
 
 def get_process_by_token(db: Session, token_id):
-    stats = get_stats_by_token(db, token_id)
-    processes = []
-    for stat in stats:
-        st = db.query(models.Process).filter(models.Process.parent_id == stat.id).all()
-        for s in st:
-            processes.append(s)
-    return processes
+    return db.query(models.Process).join(
+        models.Stat, models.Process.parent_id == models.Stat.id
+    ).join(
+        models.RunMetadata, models.Stat.parent_id == models.RunMetadata.id
+    ).filter(models.RunMetadata.token == token_id).order_by(models.RunMetadata.id, models.Stat.id, models.Process.id).all()
     
 
 def get_stats_by_token(db: Session, token_id):
-    metas = db.query(models.RunMetadata).filter(models.RunMetadata.token == token_id).all()
-    #return db.query(models.Stat).filter(models.Stat.parent_id == token_id).all()
-    # more pythonic way for sure
-    stats = []
-    for meta in metas:
-        mt = db.query(models.Stat).filter(models.Stat.parent_id == meta.id).all()
-        for m in mt: 
-            stats.append(m)
-    return stats
+    return db.query(models.Stat).join(
+        models.RunMetadata, models.Stat.parent_id == models.RunMetadata.id
+    ).filter(models.RunMetadata.token == token_id).order_by(models.RunMetadata.id, models.Stat.id).all()
+
+def get_process_rows_by_token(db: Session, token_id, run_name=None, processes=None):
+    query = select(*models.Process.__table__.columns).join(
+        models.Stat, models.Process.parent_id == models.Stat.id
+    ).join(
+        models.RunMetadata, models.Stat.parent_id == models.RunMetadata.id
+    ).where(models.RunMetadata.token == token_id).order_by(models.RunMetadata.id, models.Stat.id, models.Process.id)
+    if run_name is not None:
+        query = query.where(models.RunMetadata.run_name == run_name)
+    if processes:
+        query = query.where(models.Process.name.in_(processes))
+    return [schemas.ProcessRow(*row) for row in db.execute(query)]
+
+def get_stat_rows_by_token(db: Session, token_id, run_name=None):
+    query = select(*models.Stat.__table__.columns).join(
+        models.RunMetadata, models.Stat.parent_id == models.RunMetadata.id
+    ).where(models.RunMetadata.token == token_id).order_by(models.RunMetadata.id, models.Stat.id)
+    if run_name is not None:
+        query = query.where(models.RunMetadata.run_name == run_name)
+    return [schemas.StatRow(*row) for row in db.execute(query)]
+
+def get_stat_history_rows(db: Session, token_id, run_name=None):
+    query = select(*models.StatHistory.__table__.columns).where(
+        models.StatHistory.token == token_id
+    ).order_by(models.StatHistory.run_id, models.StatHistory.recorded_at, models.StatHistory.id)
+    if run_name is not None:
+        query = query.where(models.StatHistory.run_name == run_name)
+    return [schemas.StatHistoryRow(*row) for row in db.execute(query)]
+
+def get_meta_rows_by_token(db: Session, token_id, run_name=None):
+    query = select(*models.RunMetadata.__table__.columns).where(
+        models.RunMetadata.token == token_id
+    ).order_by(models.RunMetadata.timestamp, models.RunMetadata.id)
+    if run_name is not None:
+        query = query.where(models.RunMetadata.run_name == run_name)
+    return [schemas.RunMetadataRow(*row) for row in db.execute(query)]
 
 def get_meta_by_token(db: Session, token_id):
     metas = db.query(models.RunMetadata).filter(models.RunMetadata.token == token_id).all()
@@ -102,6 +138,238 @@ def get_task_states_by_token(db: Session, token_id):
     traces = db.query(models.RunTrace).filter(models.RunTrace.token == token_id).all()
     return traces
 
+def get_task_rows_by_run_name(db: Session, token_id, run_name=None, processes=None, tags=None, statuses=None, since=None, until=None, fields=None):
+    """
+    Selects the traces of a token grouped by run name, with all filters applied in SQL and only the requested
+    columns selected.
+    :param token_id: the token id
+    :param run_name: only traces of this run
+    :param processes: only traces of these processes
+    :param tags: only traces with these tags
+    :param statuses: only traces in these states
+    :param since: only traces submitted at or after this time
+    :param until: only traces submitted before this time
+    :param fields: names of the RunTrace columns to select (see SELECTABLE_TRACE_COLUMNS), all but the script if None
+    :return: dict of run name to list of row dataclasses
+    """
+    field_names = tuple(fields or TRACE_COLUMNS)
+    row_class = schemas.trace_projection_dataclass(field_names)
+    query = select(models.RunTrace.run_name, *[get_trace_column(field) for field in field_names])
+    query = query.where(models.RunTrace.token == token_id)
+    if run_name is not None:
+        query = query.where(models.RunTrace.run_name == run_name)
+    if processes:
+        query = query.where(models.RunTrace.process.in_(processes))
+    if tags:
+        query = query.where(models.RunTrace.tag.in_(tags))
+    if statuses:
+        query = query.where(models.RunTrace.status.in_(statuses))
+    if since is not None:
+        query = query.where(models.RunTrace.submit >= since)
+    if until is not None:
+        query = query.where(models.RunTrace.submit < until)
+    result_by_run_name = {}
+    for row in db.execute(query):
+        result_by_run_name.setdefault(row[0], []).append(row_class(*row[1:]))
+    return result_by_run_name
+
+TOP_TASK_LIMIT = 10 # length of the worst task lists, see helpers.get_analysis
+
+def get_task_scoring_rows_by_token(db: Session, token_id, run_name=None):
+    """
+    Only the columns needed for the scoring (see helpers.calculate_scores_columnar), as plain rows instead of ORM objects
+    """
+    scoring_columns = [getattr(models.RunTrace, key) for key in helpers.SCORING_COLUMNS + ['memory_percentage']]
+    query = select(*scoring_columns).where(models.RunTrace.token == token_id)
+    if run_name is not None:
+        query = query.where(models.RunTrace.run_name == run_name)
+    return db.execute(query).all()
+
+def get_top_task_rows_by_token(db: Session, token_id, run_names, limit=TOP_TASK_LIMIT):
+    """
+    The candidates of the worst task lists of the analysis: per run, the limit tasks with the largest value of every
+    models.TOP_TASK_KEYS key, each read from its index
+    :param run_names: the runs to select the candidates of
+    :return: dict of run name -> list of scoring rows, without duplicates
+    """
+    scoring_columns = [getattr(models.RunTrace, key) for key in helpers.SCORING_COLUMNS + ['memory_percentage']]
+    top_tasks_by_run_name = {}
+    for run_name in run_names:
+        run_condition = models.RunTrace.run_name.is_(None) if run_name is None else models.RunTrace.run_name == run_name
+        candidates = {}
+        for sort_key in models.TOP_TASK_KEYS.values():
+            query = select(models.RunTrace.id, *scoring_columns).where(models.RunTrace.token == token_id, run_condition)
+            for row in db.execute(query.order_by(sort_key.desc()).limit(limit)):
+                candidates[row.id] = row
+        top_tasks_by_run_name[run_name] = list(candidates.values())
+    return top_tasks_by_run_name
+
+TRACE_COLUMNS = [column.name for column in models.RunTrace.__table__.columns]
+# selectable on request only, resolved from task_script
+DEFERRED_TRACE_COLUMNS = ['script']
+SELECTABLE_TRACE_COLUMNS = TRACE_COLUMNS + DEFERRED_TRACE_COLUMNS
+
+def get_trace_column(name):
+    return getattr(models.RunTrace, name).label(name)
+
+def stream_run_trace_rows(token_id, columns=None, run_name=None, process=None, chunk_size=1000):
+    """
+    Yields the traces of a token as plain rows, fetched chunk-wise via a server-side cursor, so memory stays flat
+    regardless of the run size. Uses its own session, as the rows are consumed after the request handler returned.
+    :param token_id: the token id
+    :param columns: names of the RunTrace columns to select (see SELECTABLE_TRACE_COLUMNS), all but the script if None
+    :param run_name: only traces of this run
+    :param process: only traces of this process
+    :param chunk_size: number of rows fetched per round trip
+    """
+    selected_columns = [get_trace_column(column) for column in (columns or TRACE_COLUMNS)]
+    query = select(*selected_columns).where(models.RunTrace.token == token_id)
+    if run_name is not None:
+        query = query.where(models.RunTrace.run_name == run_name)
+    if process is not None:
+        query = query.where(models.RunTrace.process == process)
+    query = query.order_by(models.RunTrace.id).execution_options(yield_per=chunk_size)
+    db = get_session()
+    try:
+        for row in db.execute(query):
+            yield row
+    finally:
+        db.close()
+
+EXPORT_TABLES = {
+    "run_metric": models.RunTrace,
+    "run_metadata": models.RunMetadata,
+    "stat": models.Stat,
+    "process": models.Process,
+}
+
+def get_export_query(table, token_id, run_name=None):
+    """
+    Selects all columns of an exportable table for a token. Stats and processes carry no token themselves and are
+    resolved via their run_metadata (stat) and stat (process) parents.
+    :param table: one of EXPORT_TABLES
+    :param token_id: the token id
+    :param run_name: only rows of this run
+    """
+    model = EXPORT_TABLES[table]
+    query = select(*model.__table__.columns)
+    if model is models.Process:
+        query = query.join(models.Stat, models.Process.parent_id == models.Stat.id)
+    if model in [models.Process, models.Stat]:
+        query = query.join(models.RunMetadata, models.Stat.parent_id == models.RunMetadata.id)
+        owner = models.RunMetadata
+    else:
+        owner = model
+    query = query.where(owner.token == token_id)
+    if run_name is not None:
+        query = query.where(owner.run_name == run_name)
+    return query.order_by(model.id)
+
+def stream_export_chunks(table, token_id, run_name=None, chunk_size=10000):
+    """
+    Yields the rows of an exportable table for a token in lists of up to chunk_size rows, fetched via a server-side
+    cursor. Uses its own session, as the chunks are consumed after the request handler returned.
+    """
+    query = get_export_query(table, token_id, run_name).execution_options(yield_per=chunk_size)
+    db = get_session()
+    try:
+        for chunk in db.execute(query).partitions():
+            yield chunk
+    finally:
+        db.close()
+
+"""
+Keyset pagination
+Pages are selected with a WHERE (order columns) > (cursor values) condition instead of OFFSET, so every page costs
+an index range scan of limit rows, no matter how deep the client paged. The cursor is the url-safe base64 encoded
+json list of the order column values of the last row of the previous page.
+"""
+
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(orjson.dumps(list(values))).decode()
+
+def decode_cursor(cursor, length):
+    """
+    :raises ValueError: if the cursor is malformed
+    """
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, orjson.JSONDecodeError) as error:
+        raise ValueError("Invalid cursor") from error
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor")
+    return values
+
+def estimate_count(db: Session, query):
+    """
+    Row estimate of the planner for the query, taken from EXPLAIN without executing it.
+    """
+    compiled = query.compile(dialect=db.get_bind().dialect)
+    plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = orjson.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def get_page(db: Session, query, order_columns, row_class, limit, after=None):
+    """
+    Selects one page of rows in keyset order.
+    :param query: select of all columns of row_class, already filtered
+    :param order_columns: unique, non-null ordering of the rows, the last ones selected being the cursor values
+    :param row_class: schemas row dataclass the rows are mapped into
+    :param limit: page size, capped at MAX_PAGE_SIZE
+    :param after: cursor returned with the previous page
+    :return: dict with the items, the cursor of the next page (None on the last page) and the estimated total
+    :raises ValueError: if the cursor is malformed
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    estimated_total = estimate_count(db, query)
+    if after is not None:
+        query = query.where(tuple_(*order_columns) > tuple_(*decode_cursor(after, len(order_columns))))
+    rows = db.execute(query.add_columns(*order_columns).order_by(*order_columns).limit(limit + 1)).all()
+    width = len(row_class.__slots__)
+    items = [row_class(*row[:width]) for row in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1][width:]) if len(rows) > limit else None
+    return {"items": items, "next": next_cursor, "estimated_total": estimated_total}
+
+def get_trace_page(db: Session, token_id, limit, after=None):
+    query = select(*models.RunTrace.__table__.columns)
+    if token_id is not None:
+        query = query.where(models.RunTrace.token == token_id)
+    # coalesced like ix_run_metric_token_run_name_task, as NULLs would drop out of the row comparison; the defaults
+    # are rendered inline, so the planner can match the expressions against the index
+    order_columns = [
+        func.coalesce(models.RunTrace.run_name, literal_column("''")),
+        func.coalesce(models.RunTrace.task_id, literal_column("-1")),
+        models.RunTrace.id,
+    ]
+    return get_page(db, query, order_columns, schemas.RunTraceRow, limit, after)
+
+def get_meta_page(db: Session, token_id, limit, after=None):
+    query = select(*models.RunMetadata.__table__.columns)
+    if token_id is not None:
+        query = query.where(models.RunMetadata.token == token_id)
+    return get_page(db, query, [models.RunMetadata.id], schemas.RunMetadataRow, limit, after)
+
+def get_stat_page(db: Session, token_id, limit, after=None):
+    query = select(*models.Stat.__table__.columns)
+    if token_id is not None:
+        query = query.join(
+            models.RunMetadata, models.Stat.parent_id == models.RunMetadata.id
+        ).where(models.RunMetadata.token == token_id)
+    return get_page(db, query, [models.Stat.id], schemas.StatRow, limit, after)
+
+def get_process_page(db: Session, token_id, limit, after=None):
+    query = select(*models.Process.__table__.columns)
+    if token_id is not None:
+        query = query.join(
+            models.Stat, models.Process.parent_id == models.Stat.id
+        ).join(
+            models.RunMetadata, models.Stat.parent_id == models.RunMetadata.id
+        ).where(models.RunMetadata.token == token_id)
+    return get_page(db, query, [models.Process.id], schemas.ProcessRow, limit, after)
+
 def get_run_trace_by_token(db: Session, token_id):
     return db.query(models.RunTrace).filter(models.RunTrace.token == token_id).all()
 
@@ -196,39 +464,63 @@ def get_token(db: Session, token_id: str):
     return db.query(models.RunToken).get(token_id)
 
 
+def is_valid_token(db: Session, token_id: str):
+    """
+    Existence check of a token, answered by the token cache without a database round trip for known tokens
+    """
+    return cache.is_valid_token(token_id, lambda: get_token(db, token_id) is not None)
+
 def remove_token(db: Session, token):
     user = db.query(models.User).filter(models.User.run_tokens.contains([token.id])).first()
     if user:
         remove_token_from_user(db, user, token)
     db.delete(token)
     db.commit()
+    cache.invalidate_token(token.id)
     return {"removed_token": token.id, "removed_from_user": user is not None}
 
-def remove_token_and_connected_information(db, token):
-    token_id = token.id
-    processes = get_process_by_token(db, token_id)
-    for process in processes:
-        db.delete(process)
-    db.commit()
-    stats = get_stats_by_token(db, token_id)   
-    for stat in stats:
-        db.delete(stat)
-    db.commit()
-    metas = get_meta_by_token(db, token_id)
-    for meta in metas:
-        db.delete(meta)
-    db.commit()
-    traces = get_run_trace_by_token(db, token_id)
-    for trace in traces:
-        db.delete(trace)
-    db.commit()
-    db.delete(token)
-    db.commit()
-    return {"deleted": True}
- 
-    
-   
-
+def remove_token_and_connected_information(token_id):
+    """
+    Removes a token and everything persisted for it (processes, stats, stat history, metadata, traces, process
+    aggregates, summaries and run versions) with one bulk DELETE per table in a single transaction. The token is also removed from the token list of its user.
+    Meant to run as a queue job: progress and deleted row counts are reported in the meta data of the job.
+    :param token_id: the id of the token to remove
+    :return: deleted row counts by table
+    """
+    job = get_current_job()
+    db = get_session()
+    meta_ids = select(models.RunMetadata.id).where(models.RunMetadata.token == token_id)
+    stat_ids = select(models.Stat.id).where(models.Stat.parent_id.in_(meta_ids))
+    steps = [
+        ("process", delete(models.Process).where(models.Process.parent_id.in_(stat_ids))),
+        ("stat", delete(models.Stat).where(models.Stat.parent_id.in_(meta_ids))),
+        ("stat_history", delete(models.StatHistory).where(models.StatHistory.token == token_id)),
+        ("run_metadata", delete(models.RunMetadata).where(models.RunMetadata.token == token_id)),
+        ("run_metric", delete(models.RunTrace).where(models.RunTrace.token == token_id)),
+        ("process_aggregate", delete(models.ProcessAggregate).where(models.ProcessAggregate.token == token_id)),
+        ("process_summary", delete(models.ProcessSummary).where(models.ProcessSummary.token == token_id)),
+        ("run_version", delete(models.RunVersion).where(models.RunVersion.token == token_id)),
+        ("user", update(models.User).where(models.User.run_tokens.contains([token_id])).values(
+            run_tokens=func.array_remove(models.User.run_tokens, token_id)
+        )),
+        ("runtoken", delete(models.RunToken).where(models.RunToken.id == token_id)),
+    ]
+    deleted = {}
+    try:
+        for finished_steps, (table, statement) in enumerate(steps, start=1):
+            deleted[table] = db.execute(statement.execution_options(synchronize_session=False)).rowcount
+            if job is not None:
+                job.meta["progress"] = {"finished_steps": finished_steps, "steps": len(steps), "rows": deleted}
+                job.save_meta()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    cache.invalidate_token(token_id)
+    cache.clear_runs_completed(token_id)
+    return {"deleted": True, "token": token_id, "rows": deleted}
 
 
 def remove_all_token_from_user(user_id: str, db: Session):
@@ -334,6 +626,7 @@ def get_stat_data(json_ob, meta_id):
                     "succeeded_count": stats.get("succeededCount", None),
                     "compute_time_fmt": stats.get("computeTimeFmt", None),
                     "cached_count": stats.get("cachedCount", None),
+                    "peak_running": stats.get("peakRunning", None),
                     "succeeded_duration": stats.get("succeededDuration", None),
                     "cached_pct": stats.get("cachedPct", None),
                     "load_memory": stats.get("loadMemory", None),
@@ -416,8 +709,6 @@ def get_trace_data(json_obj, token_id):
         complete_time = trace.get("complete", None)
         if complete_time is not None:
             complete_time = datetime.fromtimestamp(complete_time / 1000)
-        
-        
         trace_data = {
             "token": token_id,
             "run_id": json_obj.get("runId", None),
@@ -435,7 +726,7 @@ def get_trace_data(json_obj, token_id):
             "duration": trace.get("duration", None),
             "name": trace.get("name", None),
             "attempt": trace.get("attempt", None),
-            "script": trace.get("script", None),
+            "script_hash": helpers.get_script_hash(trace.get("script", None)),
             "time": trace.get("time", None),
             "realtime": trace.get("realtime", None),
             "cpu_percentage": trace.get("%cpu", None),
@@ -456,18 +747,53 @@ def get_trace_data(json_obj, token_id):
             "scratch": trace.get("scratch", None),
         }
 
+        # not a run_metric column, written to task_script by task_script_insert_statement
+        trace_data["script"] = trace.get("script", None)
         return trace_data
     return {}
     # adjust this functions in the near future because there certainly is a more pythonic way to do this...
 
-def check_for_workflow_completed(db: Session, json_ob: object, token_id: string):
-    metas = get_meta_by_token(db, token_id)
-    run_id = json_ob["runId"];
-    run_name = json_ob["runName"]
-    return any(
-        meta.event in ['completed', 'failed'] and meta.run_id == run_id and meta.run_name == run_name
-        for meta in metas
-    )
+COMPLETION_EVENTS = ['completed', 'failed']
+
+def check_for_workflow_completed(json_ob: object, token_id: string):
+    """
+    Checks the completion flag of the run, set by mark_runs_completed once its completed/failed event was persisted
+    """
+    return cache.is_run_completed(token_id, json_ob.get("runId"), json_ob.get("runName"))
+
+def mark_runs_completed(metadata_data_list):
+    """
+    Sets the completion flag of every run with a completed/failed event among the persisted metadata
+    :param metadata_data_list: metadata dicts as returned by get_metadata_data
+    """
+    completed_runs = [
+        (metadata_data["token"], metadata_data["run_id"], metadata_data["run_name"])
+        for metadata_data in metadata_data_list if metadata_data["event"] in COMPLETION_EVENTS
+    ]
+    if len(completed_runs) > 0:
+        cache.set_runs_completed(completed_runs)
+        enqueue_process_summary_refresh([(token_id, run_name) for token_id, run_id, run_name in completed_runs])
+
+def restore_run_completion_flags(db: Session):
+    """
+    Sets the completion flags of all completed runs persisted so far, e.g. after Redis lost its data, and enqueues the
+    summary computation of completed runs whose summaries were not computed at their current version. Runs without
+    any summary rows count as summarized once refreshed, see RunVersion.summarized_version.
+    """
+    completed_runs = db.execute(
+        select(models.RunMetadata.token, models.RunMetadata.run_id, models.RunMetadata.run_name)
+        .where(models.RunMetadata.event.in_(COMPLETION_EVENTS)).distinct()
+    ).all()
+    if len(completed_runs) > 0:
+        cache.set_runs_completed(completed_runs)
+    summarized_runs = set(db.execute(
+        select(models.RunVersion.token, models.RunVersion.run_name)
+        .where(models.RunVersion.summarized_version == models.RunVersion.version)
+    ).all())
+    enqueue_process_summary_refresh([
+        (token_id, run_name) for token_id, run_id, run_name in completed_runs if (token_id, run_name) not in summarized_runs
+    ])
+    return len(completed_runs)
 
 
 """
@@ -519,22 +845,110 @@ def update_trace_state(trace_id: str, new_state: str):
 PLOT DATA RETRIEVAL BELOW
 """
 
-def get_filtered_ram_plot_results(db: Session, token_id, run_name, process_filter, tag_filter):
-    traces = db.query(models.RunTrace).filter(models.RunTrace.token == token_id, models.RunTrace.run_name == run_name).all()
-    
-    grouped_traces = helpers.group_by_process(traces)
-    process_boxplot_values = {}
-    for process, tasks in grouped_traces.items():
-        percentage_values = [(task.rss / task.memory) * 100 for task in tasks if task.rss and task.memory]
+# value plotted per task and the condition a task needs to fulfill to have a value, see get_filtered_boxplot_results
+BOXPLOT_METRICS = {
+    "ram": (
+        models.RunTrace.rss.cast(Float) / models.RunTrace.memory.cast(Float) * 100,
+        and_(models.RunTrace.rss != 0, models.RunTrace.memory != 0),
+    ),
+    "cpu": (
+        models.RunTrace.cpu_percentage / models.RunTrace.cpus,
+        and_(models.RunTrace.cpu_percentage.is_not(None), models.RunTrace.cpus > 0),
+    ),
+    "duration": (
+        models.RunTrace.realtime,
+        models.RunTrace.realtime.is_not(None),
+    ),
+    "io": (
+        func.coalesce(models.RunTrace.read_bytes, 0) + func.coalesce(models.RunTrace.write_bytes, 0),
+        or_(models.RunTrace.read_bytes.is_not(None), models.RunTrace.write_bytes.is_not(None)),
+    ),
+}
+
+def get_boxplot_query(token_id, run_name, metric):
+    """
+    Per process boxplot values of a metric: process, [q1, median, q3], min, max, count and sum
+    """
+    value, condition = BOXPLOT_METRICS[metric]
+    return select(
+        models.RunTrace.process,
+        func.percentile_cont(pg_array([0.25, 0.5, 0.75]).cast(ARRAY(Float))).within_group(value),
+        func.min(value),
+        func.max(value),
+        func.count(),
+        func.sum(value),
+    ).where(
+        models.RunTrace.token == token_id, models.RunTrace.run_name == run_name, condition,
+    ).group_by(models.RunTrace.process).order_by(models.RunTrace.process)
+
+def get_run_version(db: Session, token_id, run_name):
+    """
+    Current change counter of the run, 0 if no traces were persisted for it yet
+    """
+    return db.execute(select(models.RunVersion.version).where(
+        models.RunVersion.token == token_id, models.RunVersion.run_name == run_name,
+    )).scalar() or 0
+
+def run_version_upsert_statement(changed_tasks):
+    """
+    Increments the run versions of the changed tasks, in the transaction persisting them - so a summary computed at
+    an older version is never taken for current, whatever happens to Redis.
+    :return: the upsert statement, None if no task changed
+    """
+    # sorted, so concurrent batches lock the rows in the same order
+    runs = sorted({(task.token, task.run_name) for task in changed_tasks}, key=lambda run: (run[0], run[1] is not None, run[1] or ""))
+    if len(runs) == 0:
+        return None
+    stmt = pg_insert(models.RunVersion).values([{"token": token_id, "run_name": run_name, "version": 1} for token_id, run_name in runs])
+    return stmt.on_conflict_do_update(
+        index_elements=[models.RunVersion.token, models.RunVersion.run_name],
+        set_={"version": models.RunVersion.version + 1},
+    )
 
-        # Calculate quartiles and other boxplot values using numpy
-        q1 = np.percentile(percentage_values, 25)
-        median = np.percentile(percentage_values, 50)
-        q3 = np.percentile(percentage_values, 75)
-        min_val = np.min(percentage_values)
-        max_val = np.max(percentage_values)
+def get_process_summary_query(token_id, run_name, metric, version):
+    """
+    Same rows as get_boxplot_query, read from the precomputed process summaries of the given run version
+    """
+    return select(
+        models.ProcessSummary.process,
+        models.ProcessSummary.quartiles,
+        models.ProcessSummary.min,
+        models.ProcessSummary.max,
+        models.ProcessSummary.count,
+        models.ProcessSummary.sum,
+    ).where(
+        models.ProcessSummary.token == token_id, models.ProcessSummary.run_name == run_name,
+        models.ProcessSummary.metric == metric, models.ProcessSummary.source_version == version,
+    ).order_by(models.ProcessSummary.process)
+
+def get_filtered_boxplot_results(db: Session, token_id, run_name, metric, process_filter=None, tag_filter=None):
+    """
+    Computes the boxplot values (min, quartiles, max) of a metric per process in the database, so only one summary
+    row per process is transferred. Without tag filter, the precomputed process summaries of the run are read
+    instead if they are up to date, which they are for completed runs.
+    :param token_id: the token id
+    :param run_name: the run name
+    :param metric: one of BOXPLOT_METRICS
+    :param process_filter: only tasks of these processes, all if empty
+    :param tag_filter: only tasks with these tags, all if empty
+    :return: the process labels and the boxplot values per process
+    """
+    rows = []
+    if not tag_filter:
+        summary_query = get_process_summary_query(token_id, run_name, metric, get_run_version(db, token_id, run_name))
+        if process_filter:
+            summary_query = summary_query.where(models.ProcessSummary.process.in_(process_filter))
+        rows = db.execute(summary_query).all()
+    if len(rows) == 0:
+        query = get_boxplot_query(token_id, run_name, metric)
+        if process_filter:
+            query = query.where(models.RunTrace.process.in_(process_filter))
+        if tag_filter:
+            query = query.where(models.RunTrace.tag.in_(tag_filter))
+        rows = db.execute(query).all()
 
-        # Store the calculated values for the group
+    process_boxplot_values = {}
+    for process, (q1, median, q3), min_val, max_val, count, value_sum in rows:
         process_boxplot_values[process] = {
             'min': min_val,
             'q1': q1,
@@ -542,7 +956,64 @@ def get_filtered_ram_plot_results(db: Session, token_id, run_name, process_filte
             'q3': q3,
             'max': max_val,
         }
-    return [list(grouped_traces.keys()), process_boxplot_values], 
+    return [list(process_boxplot_values.keys()), process_boxplot_values],
+
+def refresh_process_summaries(token_id, run_name):
+    """
+    Recomputes the process summaries of all BOXPLOT_METRICS for a run in one transaction. Queue job, enqueued by
+    enqueue_process_summary_refresh once the run completed (or late traces of a completed run arrived).
+    :return: number of summary rows
+    """
+    db = get_session()
+    try:
+        # read before the data, so traces persisted meanwhile make the summaries outdated instead of being missed
+        version = get_run_version(db, token_id, run_name)
+        db.execute(delete(models.ProcessSummary).where(
+            models.ProcessSummary.token == token_id, models.ProcessSummary.run_name == run_name,
+        ))
+        summary_rows = []
+        for metric in BOXPLOT_METRICS:
+            for process, quartiles, min_val, max_val, count, value_sum in db.execute(get_boxplot_query(token_id, run_name, metric)):
+                summary_rows.append({
+                    "token": token_id, "run_name": run_name, "metric": metric, "process": process, "count": count,
+                    "sum": value_sum, "min": min_val, "quartiles": quartiles, "max": max_val,
+                    "source_version": version, "refreshed_at": datetime.utcnow(),
+                })
+        if len(summary_rows) > 0:
+            db.execute(pg_insert(models.ProcessSummary).values(summary_rows))
+        stmt = pg_insert(models.RunVersion).values(token=token_id, run_name=run_name, version=version, summarized_version=version)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[models.RunVersion.token, models.RunVersion.run_name], set_={"summarized_version": version},
+        ))
+        db.commit()
+        return len(summary_rows)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def enqueue_process_summary_refresh(runs):
+    """
+    :param runs: iterable of (token_id, run_name) tuples
+    """
+    for token_id, run_name in set(runs):
+        summary_queue.enqueue(refresh_process_summaries, token_id, run_name)
+
+def refresh_completed_run_summaries(changed_tasks):
+    """
+    Enqueues a summary refresh for the runs of the changed tasks which already completed, so late traces of a
+    completed run are included again. Their run versions were bumped with the traces, see run_version_upsert_statement.
+    """
+    runs = list({(task.token, task.run_id, task.run_name) for task in changed_tasks})
+    if len(runs) == 0:
+        return
+    completed_runs = cache.get_completed_runs(runs)
+    if len(completed_runs) > 0:
+        enqueue_process_summary_refresh([(token_id, run_name) for token_id, run_id, run_name in completed_runs])
+
+def get_filtered_ram_plot_results(db: Session, token_id, run_name, process_filter, tag_filter):
+    return get_filtered_boxplot_results(db, token_id, run_name, "ram", process_filter, tag_filter)
 
 
 """
@@ -595,83 +1066,293 @@ const data: ChartConfiguration<'boxplot'>['data'] = {
 
     
 
-def persist_trace(json_ob, token):
-  
-    db = get_session()
-    
+"""
+Run snapshots
+Every metadata event (started, process_*, completed, ...) carries the full workflow stats and the stats of every
+process. Instead of storing a copy of them per event, each run has one stat row with its process rows, which is
+updated in place with the stats of its newest event. Progress over time is kept in the downsampled stat history.
+"""
 
-    metadata_saved = False
-    trace_saved = False
-    metadata = json_ob.get("metadata", None)
-    if metadata is not None:
-        metadata_data = get_metadata_data(json_ob, token.id)
+STAT_HISTORY_COLUMNS = [
+    'submitted_count', 'pending_count', 'running_count', 'succeeded_count', 'failed_count', 'cached_count',
+    'aborted_count', 'ignored_count', 'retries_count', 'load_cpus', 'load_memory', 'peak_running',
+]
+
+def stat_upsert_statement(stat_data):
+    """
+    Writes the stat snapshot of a run, keyed by (token, run_id). An existing snapshot is only replaced by the stats of
+    a newer metadata event (higher parent_id), so events persisted out of order never roll the run state back.
+    :return: the upsert statement, returning the stat id - or no row if the existing snapshot is newer
+    """
+    stmt = pg_insert(models.Stat).values(stat_data)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Stat.token, models.Stat.run_id],
+        set_={
+            column.name: stmt.excluded[column.name] for column in models.Stat.__table__.columns
+            if column.name not in ["id", "token", "run_id"]
+        },
+        where=models.Stat.parent_id < stmt.excluded.parent_id,
+    ).returning(models.Stat.id)
+
+def process_upsert_statement(process_data_list):
+    """
+    Writes the process snapshots of a run stat, keyed by (parent_id, name). The list must not contain a process twice.
+    """
+    stmt = pg_insert(models.Process).values(process_data_list)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Process.parent_id, models.Process.name],
+        set_={
+            column.name: stmt.excluded[column.name] for column in models.Process.__table__.columns
+            if column.name not in ["id", "parent_id", "name"]
+        },
+    )
+
+def stat_history_insert_statement(stat_data, metadata_data):
+    """
+    Inserts a stat history row, unless the run already has one recorded less than STAT_HISTORY_INTERVAL seconds
+    before the event. Completion events are always recorded, so the history ends with the final state of the run.
+    :return: the insert statement, None if the history is disabled
+    """
+    if STAT_HISTORY_INTERVAL <= 0:
+        return None
+    history = models.StatHistory
+    values = {
+        "token": metadata_data["token"],
+        "run_id": metadata_data["run_id"],
+        "run_name": metadata_data["run_name"],
+        "event": metadata_data["event"],
+        "recorded_at": metadata_data["timestamp"],
+        **{column: stat_data.get(column, None) for column in STAT_HISTORY_COLUMNS},
+    }
+    if metadata_data["event"] in COMPLETION_EVENTS:
+        return insert(history).values(values)
+    row = select(*[literal(value, type_=history.__table__.c[name].type).label(name) for name, value in values.items()])
+    recent = select(history.id).where(
+        history.token == values["token"], history.run_id == values["run_id"],
+        history.recorded_at > values["recorded_at"] - timedelta(seconds=STAT_HISTORY_INTERVAL),
+    )
+    return insert(history).from_select(list(values), row.where(~recent.exists()))
+
+def persist_run_snapshot(db: Session, json_ob, metadata_data, meta_id):
+    """
+    Updates the stat/process snapshot of the run with the stats of a metadata event and records them in the stat
+    history. Does not commit.
+    :param meta_id: id of the already flushed run_metadata row of the event
+    :return: True if the snapshot was updated, False if the event has no stats or the snapshot is newer
+    """
+    stat_data = get_stat_data(json_ob, meta_id)
+    if len(stat_data) == 0:
+        return False
+    stat_data["token"] = metadata_data["token"]
+    stat_data["run_id"] = metadata_data["run_id"]
+    stat_id = db.execute(stat_upsert_statement(stat_data)).scalar()
+    if stat_id is None:
+        return False
+    processes_by_name = {process_data["name"]: process_data for process_data in get_process_data(json_ob, stat_id)}
+    if len(processes_by_name) > 0:
+        db.execute(process_upsert_statement(list(processes_by_name.values())))
+    history_stmt = stat_history_insert_statement(stat_data, metadata_data)
+    if history_stmt is not None:
+        db.execute(history_stmt)
+    return True
+
+def persist_run_metadata(db: Session, events):
+    """
+    Persists one run_metadata row per metadata event and updates the snapshot of every run with its newest event of
+    the list - the older ones would be overwritten right away. Does not commit.
+    :param events: list of (json_ob, token_id) tuples in arrival order, events without metadata are skipped
+    :return: the persisted metadata dicts, as returned by get_metadata_data
+    """
+    metadata_data_list = []
+    newest_per_run = {}
+    for json_ob, token_id in events:
+        if json_ob.get("metadata", None) is None:
+            continue
+        metadata_data = get_metadata_data(json_ob, token_id)
         meta_object = models.RunMetadata(**metadata_data)
         db.add(meta_object)
-        db.commit()
-        db.refresh(meta_object)
-        
-        stat_data = get_stat_data(json_ob, meta_object.id)
-        stat_object = models.Stat(**stat_data)
-        db.add(stat_object)
-        db.commit()
-        db.refresh(stat_object)
-
-        processes_data = get_process_data(json_ob, stat_object.id)
-        for process_data in processes_data:
-            process_object = models.Process(**process_data)
-            db.add(process_object)
-            db.commit()
-            db.refresh(process_object)
-    
-    trace = json_ob.get("trace")
-    
-    if trace is not None:
-        trace_data = get_trace_data(json_ob, token.id)
-        trace_object = models.RunTrace(**trace_data)
-           
-        db.add(trace_object)
-        db.commit()
-        db.refresh(trace_object)
-        trace_saved = True
-    db.close()
-    return {"metadata_saved": metadata_saved, "trace_saved": trace_saved}
+        metadata_data_list.append(metadata_data)
+        newest_per_run[(token_id, metadata_data["run_id"])] = (json_ob, metadata_data, meta_object)
+    if len(metadata_data_list) == 0:
+        return metadata_data_list
+    # assigns the ids, in order of the events
+    db.flush()
+    for json_ob, metadata_data, meta_object in newest_per_run.values():
+        persist_run_snapshot(db, json_ob, metadata_data, meta_object.id)
+    return metadata_data_list
 
 
-async def persist_object_data(async_session, add_object):
-    async with async_session.begin():
-        async_session.add(add_object)
-    await async_session.commit()
+def get_trace_row_values(trace_data):
+    return {key: value for key, value in trace_data.items() if key != "script"}
 
-async def persist_singleton_trace_data(async_session, trace_object: models.RunTrace):
-    async with async_session.begin():
-        result_traces = await async_session.execute(
-            select(models.RunTrace).where(
-                models.RunTrace.task_id == trace_object.task_id,
-                models.RunTrace.token == trace_object.token, 
-                models.RunTrace.run_id == trace_object.run_id,
-            )
+def task_script_insert_statement(trace_data_list):
+    """
+    Inserts the scripts of the given traces into task_script, every distinct script once. Scripts already stored (by
+    an earlier run or a concurrent batch) are skipped.
+    :return: the insert statement, None if no trace has a script
+    """
+    scripts = {
+        trace_data["script_hash"]: trace_data["script"] for trace_data in trace_data_list if trace_data.get("script") is not None
+    }
+    if len(scripts) == 0:
+        return None
+    return pg_insert(models.TaskScript).values(
+        [{"hash": script_hash, "script": script} for script_hash, script in scripts.items()]
+    ).on_conflict_do_nothing(index_elements=[models.TaskScript.hash])
+
+def trace_upsert_statement(trace_data_list):
+    """
+    Builds a single INSERT ... ON CONFLICT DO UPDATE for the given traces, keyed on (token, run_id, task_id) - plus
+    submit, which every unique key of the hypertable has to contain and which resolve_submits sets to the submit of
+    the persisted row of the task.
+    An existing task row is only overwritten if the incoming status is newer according to helpers.STATUS_SORTING,
+    the comparison is done inside the database, so there is no read-modify-write cycle (and no race) anymore.
+    Unknown states rank lowest, like in helpers.get_status_rank. The list must not contain the same task twice (see
+    helpers.coalesce_trace_data).
+    :param trace_data_list: list of trace dicts as returned by get_trace_data
+    :return: the upsert statement
+    """
+    stmt = pg_insert(models.RunTrace).values([get_trace_row_values(trace_data) for trace_data in trace_data_list])
+    status_order = pg_array(helpers.STATUS_SORTING, type_=String)
+
+    def status_rank(status):
+        return func.coalesce(func.array_position(status_order, status), 0)
+
+    conflict_columns = [models.RunTrace.token, models.RunTrace.run_id, models.RunTrace.task_id, models.RunTrace.submit]
+
+    return stmt.on_conflict_do_update(
+        index_elements=conflict_columns,
+        # the key columns are equal anyway, and updating the partitioning columns of a hypertable is best avoided
+        set_={
+            column.name: stmt.excluded[column.name] for column in models.RunTrace.__table__.columns
+            if not column.primary_key and column.name not in [conflict_column.name for conflict_column in conflict_columns]
+        },
+        where=status_rank(stmt.excluded.status) > status_rank(models.RunTrace.status),
+    )
+
+
+AGGREGATED_TRACE_COLUMNS = ['token', 'run_id', 'task_id', 'run_name', 'process', 'status', 'cpus', 'memory', 'realtime', 'cpu_percentage', 'rss', 'vmem', 'memory_percentage']
+
+def resolve_submits(db: Session, trace_data_list):
+    """
+    Sets the submit time the traces are upserted under, as submit is part of the conflict key (and the time dimension
+    of the hypertable): a task which is already persisted keeps the submit of its row, so every later event updates
+    that row instead of creating a second one - also if the task was first seen without a submit and the real one
+    arrives later. Tasks seen for the first time are filed under their submit, or their start or complete time if it
+    is missing.
+    :param trace_data_list: list of trace dicts as returned by get_trace_data, changed in place
+    """
+    if len(trace_data_list) == 0:
+        return
+    persisted_submits = {}
+    for token_id, run_id, task_id, submit in db.execute(
+        select(models.RunTrace.token, models.RunTrace.run_id, models.RunTrace.task_id, func.min(models.RunTrace.submit))
+        .where(tuple_(models.RunTrace.token, models.RunTrace.run_id, models.RunTrace.task_id).in_(
+            [(trace_data["token"], trace_data["run_id"], trace_data["task_id"]) for trace_data in trace_data_list]
+        ))
+        .group_by(models.RunTrace.token, models.RunTrace.run_id, models.RunTrace.task_id)
+    ):
+        persisted_submits[(token_id, run_id, task_id)] = submit
+    for trace_data in trace_data_list:
+        persisted_submit = persisted_submits.get((trace_data["token"], trace_data["run_id"], trace_data["task_id"]))
+        trace_data["submit"] = persisted_submit or trace_data["submit"] or trace_data["start"] or trace_data["complete"] or datetime.now()
+
+def trace_upsert_with_previous_status_statement(trace_data_list):
+    """
+    Wraps trace_upsert_statement, so it returns every inserted or changed task together with the status the task had
+    before (previous_status, NULL for new tasks). Used to maintain the process aggregates.
+    The submit times have to be resolved already, see resolve_submits.
+    """
+    previous = select(
+        models.RunTrace.token, models.RunTrace.run_id, models.RunTrace.task_id, models.RunTrace.submit, models.RunTrace.status,
+    ).where(
+        tuple_(models.RunTrace.token, models.RunTrace.run_id, models.RunTrace.task_id, models.RunTrace.submit).in_(
+            [(trace_data["token"], trace_data["run_id"], trace_data["task_id"], trace_data["submit"]) for trace_data in trace_data_list]
         )
-        
-        task_trace_object = result_traces.first()
-        if task_trace_object:
-            # this needs to be adjust! seems like some adds are still slipping through - e.g when during retrieval of the object there is a an update -->
-            # check for race condition fix
-            task_trace_object = task_trace_object[0]
-            if helpers.has_newer_state(task_trace_object, trace_object):
-                await async_session.delete(task_trace_object)
-                async_session.add(trace_object)
-        else:
-            async_session.add(trace_object)
-        await async_session.commit()
+    ).cte("previous")
+    upserted = trace_upsert_statement(trace_data_list).returning(
+        *[getattr(models.RunTrace, column) for column in AGGREGATED_TRACE_COLUMNS], models.RunTrace.submit,
+    ).cte("upserted")
+    return select(upserted, previous.c.status.label("previous_status")).select_from(
+        upserted.outerjoin(previous, and_(
+            upserted.c.token == previous.c.token, upserted.c.run_id == previous.c.run_id,
+            upserted.c.task_id == previous.c.task_id, upserted.c.submit == previous.c.submit,
+        ))
+    )
 
-        
 
+def process_aggregate_upsert_statement(deltas):
+    stmt = pg_insert(models.ProcessAggregate).values(deltas)
+    table = models.ProcessAggregate.__table__
+    update_values = {}
+    for column in table.columns:
+        if column.primary_key or column.name in ["token", "run_name", "process"]:
+            continue
+        elif column.name.endswith("_min"):
+            update_values[column.name] = func.least(column, stmt.excluded[column.name])
+        elif column.name.endswith("_max") or column.name.startswith("max_"):
+            update_values[column.name] = func.greatest(column, stmt.excluded[column.name])
+        else:
+            update_values[column.name] = column + stmt.excluded[column.name]
+    return stmt.on_conflict_do_update(
+        index_elements=[models.ProcessAggregate.token, models.ProcessAggregate.run_name, models.ProcessAggregate.process],
+        set_=update_values,
+    )
 
 
-async def persist_object_list_data(async_session, add_object_list):
+def get_process_aggregates_by_token(db: Session, token_id, run_name=None):
+    """
+    The process aggregates of the runs of a token, completed with the tasks which are not in a terminal state yet (the
+    ingest only adds terminal tasks, see helpers.get_process_aggregate_deltas). Reads one row per process plus one
+    per unfinished task, instead of all traces.
+    :return: dict of run name -> list of aggregate dicts (see helpers.new_process_aggregate), in order of creation
+    """
+    aggregate_columns = [column for column in models.ProcessAggregate.__table__.columns if not column.primary_key]
+    query = select(*aggregate_columns).where(models.ProcessAggregate.token == token_id)
+    unfinished_query = select(*[getattr(models.RunTrace, column) for column in AGGREGATED_TRACE_COLUMNS]).where(
+        models.RunTrace.token == token_id, models.UNFINISHED_TASK_CONDITION,
+    )
+    if run_name is not None:
+        query = query.where(models.ProcessAggregate.run_name == run_name)
+        unfinished_query = unfinished_query.where(models.RunTrace.run_name == run_name)
+    aggregates_by_run_name = {}
+    aggregates_by_process = {}
+    for row in db.execute(query.order_by(models.ProcessAggregate.id)):
+        aggregate = dict(row._mapping)
+        aggregates_by_run_name.setdefault(aggregate["run_name"], []).append(aggregate)
+        aggregates_by_process[(aggregate["run_name"], aggregate["process"])] = aggregate
+    if all(aggregate["terminal_count"] == aggregate["task_count"] for aggregate in aggregates_by_process.values()):
+        # finished runs, nothing to add
+        return aggregates_by_run_name
+    for task in db.execute(unfinished_query):
+        aggregate = aggregates_by_process.get((task.run_name, task.process))
+        if aggregate is None:
+            # every persisted task is counted in the transaction which inserts it, so this only fills up gaps
+            aggregate = helpers.new_process_aggregate(token_id, task.run_name, task.process)
+            aggregate["task_count"] = 1
+            aggregates_by_run_name.setdefault(task.run_name, []).append(aggregate)
+            aggregates_by_process[(task.run_name, task.process)] = aggregate
+        helpers.add_task_to_process_aggregate(aggregate, task)
+    return aggregates_by_run_name
+
+
+async def persist_singleton_trace_data(async_session, trace_data):
     async with async_session.begin():
-        async_session.add_all(add_object_list)
-    await async_session.commit()
+        await async_session.run_sync(resolve_submits, [trace_data])
+        script_stmt = task_script_insert_statement([trace_data])
+        if script_stmt is not None:
+            await async_session.execute(script_stmt)
+        changed_tasks = (await async_session.execute(trace_upsert_with_previous_status_statement([trace_data]))).all()
+        aggregate_deltas = helpers.get_process_aggregate_deltas(changed_tasks)
+        if len(aggregate_deltas) > 0:
+            await async_session.execute(process_aggregate_upsert_statement(aggregate_deltas))
+        version_stmt = run_version_upsert_statement(changed_tasks)
+        if version_stmt is not None:
+            await async_session.execute(version_stmt)
+    return changed_tasks
+
+        
+
 
 
 async def persist_trace_async(json_ob, token_id):
@@ -681,30 +1362,88 @@ async def persist_trace_async(json_ob, token_id):
     """
 
     async_db = get_async_session()
-    metadata = json_ob.get("metadata", None)
-    if metadata is not None:
-        metadata_data = get_metadata_data(json_ob, token_id)
-        meta_object = models.RunMetadata(**metadata_data)
-        stat_data = get_stat_data(json_ob, meta_object.id)
-        stat_object = models.Stat(**stat_data)
-        process_object_list = []
-        processes_data = get_process_data(json_ob, stat_object.id)
-        for process_data in processes_data:
-                process_object = models.Process(**process_data)
-                process_object_list.append(process_object)
-
-        await persist_object_data(async_db, meta_object)
-        await persist_object_data(async_db, stat_object)
-        if len(process_object_list) > 0:
-            await persist_object_list_data(async_db, process_object_list)
+    try:
+        metadata = json_ob.get("metadata", None)
+        if metadata is not None:
+            async with async_db.begin():
+                metadata_data_list = await async_db.run_sync(persist_run_metadata, [(json_ob, token_id)])
+            mark_runs_completed(metadata_data_list)
+            live.publish_run_events(metadata_data_list)
+                
+        trace = json_ob.get("trace")
             
-    trace = json_ob.get("trace")
-        
-    if trace is not None:
-        trace_data = get_trace_data(json_ob, token_id)
-        trace_object = models.RunTrace(**trace_data)
-        
-        await persist_singleton_trace_data(async_db, trace_object)
+        if trace is not None:
+            trace_data = get_trace_data(json_ob, token_id)
+            
+            changed_tasks = await persist_singleton_trace_data(async_db, trace_data)
+            refresh_completed_run_summaries(changed_tasks)
+            live.publish_task_deltas(changed_tasks)
+        cache.bump_analysis_version([token_id])
+    finally:
+        # hand the connection back to the pool of the worker process
+        await async_db.close()
+
+
+def persist_trace_job(json_ob, token_id):
+    """
+    Queue entry point for persist_trace_async. Runs the coroutine on the long-living event loop of the worker,
+    so the pooled async engine can be reused over all jobs of this worker process.
+    """
+    return run_in_worker_loop(persist_trace_async(json_ob, token_id))
+
+
+def persist_trace_batch(events):
+    """
+    Persists a batch of weblog events in a single transaction. Used by the batching consumer (ingest.py) instead of
+    one persist_trace_async job per event.
+    Trace events are coalesced per (token, run_id, task_id) first, so only the newest state per task is written -
+    the same semantics as persist_singleton_trace_data. Remaining traces are written with one multi-row upsert.
+    Metadata events update the run snapshots, see persist_run_metadata.
+    Only touches the database, the Redis side effects of the committed batch are done by publish_trace_batch.
+    :param events: list of (json_ob, token_id) tuples in arrival order
+    :return: the changed tasks and the persisted metadata dicts
+    """
+    db = get_session()
+    try:
+        trace_data_list = [
+            get_trace_data(json_ob, token_id) for json_ob, token_id in events if json_ob.get("trace", None) is not None
+        ]
+
+        newest_per_task = helpers.coalesce_trace_data(trace_data_list)
+        changed_tasks = []
+        if len(newest_per_task) > 0:
+            resolve_submits(db, list(newest_per_task.values()))
+            script_stmt = task_script_insert_statement(list(newest_per_task.values()))
+            if script_stmt is not None:
+                db.execute(script_stmt)
+            changed_tasks = db.execute(trace_upsert_with_previous_status_statement(list(newest_per_task.values()))).all()
+            aggregate_deltas = helpers.get_process_aggregate_deltas(changed_tasks)
+            if len(aggregate_deltas) > 0:
+                db.execute(process_aggregate_upsert_statement(aggregate_deltas))
+            version_stmt = run_version_upsert_statement(changed_tasks)
+            if version_stmt is not None:
+                db.execute(version_stmt)
+
+        metadata_data_list = persist_run_metadata(db, events)
+        db.commit()
+        return changed_tasks, metadata_data_list
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def publish_trace_batch(events, changed_tasks, metadata_data_list):
+    """
+    Redis side effects of a batch committed by persist_trace_batch: invalidates the cached analyses, sets completion
+    flags, enqueues summary refreshes and publishes the live deltas.
+    """
+    cache.bump_analysis_version([token_id for json_ob, token_id in events])
+    refresh_completed_run_summaries(changed_tasks)
+    live.publish_task_deltas(changed_tasks)
+    mark_runs_completed(metadata_data_list)
+    live.publish_run_events(metadata_data_list)
 
 
 def create_random_token():
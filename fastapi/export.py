@@ -0,0 +1,113 @@
+from sqlalchemy import BigInteger, Integer, Float, Boolean, DateTime
+
+import crud
+
+EXPORT_FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+"""
+Columnar export
+The rows are fetched chunk-wise from a server-side cursor and every chunk is turned into one Arrow record batch column
+by column, so neither ORM objects nor per-row dicts are created. pyarrow is an optional dependency and only imported
+once an export is requested.
+"""
+
+
+class ChunkSink:
+    """
+    Write-only file object, which collects everything the Arrow/Parquet writers write until it is drained.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def get_arrow_type(pa, column_type):
+    # BigInteger is a subclass of Integer, so it has to be checked first
+    if isinstance(column_type, BigInteger):
+        return pa.int64()
+    if isinstance(column_type, Integer):
+        return pa.int32()
+    if isinstance(column_type, Float):
+        return pa.float64()
+    if isinstance(column_type, Boolean):
+        return pa.bool_()
+    if isinstance(column_type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def get_export_columns(table):
+    return [column.name for column in crud.EXPORT_TABLES[table].__table__.columns]
+
+
+def get_arrow_schema(pa, table):
+    columns = crud.EXPORT_TABLES[table].__table__.columns
+    return pa.schema([pa.field(column.name, get_arrow_type(pa, column.type)) for column in columns])
+
+
+def get_record_batches(pa, schema, chunks):
+    for chunk in chunks:
+        columns = zip(*chunk)
+        yield pa.record_batch([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+
+
+def stream_export(table, format, chunks):
+    """
+    Serializes the row chunks of an exportable table as Arrow IPC stream or Parquet file and yields the written
+    bytes after every record batch.
+    :param table: one of crud.EXPORT_TABLES
+    :param format: one of EXPORT_FORMATS
+    :param chunks: lists of rows, as yielded by crud.stream_export_chunks
+    """
+    import pyarrow as pa
+
+    schema = get_arrow_schema(pa, table)
+    sink = ChunkSink()
+    if format == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for batch in get_record_batches(pa, schema, chunks):
+            if format == "parquet":
+                writer.write_batch(batch, row_group_size=batch.num_rows)
+            else:
+                writer.write_batch(batch)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def is_available():
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
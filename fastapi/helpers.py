@@ -1,7 +1,11 @@
 import json
+import hashlib
 from datetime import datetime
 import sys
 import math
+import heapq
+import numpy as np
+import orjson
 from itertools import groupby
 from operator import attrgetter
 
@@ -15,6 +19,7 @@ Analysis part
 """
 
 STATUS_SORTING = ["SUBMITTED", "RUNNING", "ABORTED", "FAILED", "COMPLETED"]
+TERMINAL_STATES = ["ABORTED", "FAILED", "COMPLETED"]
 interval_valid_ram_relation = (0.6, 1.2)  # from 60 to 120%
 interval_valid_cpu_allocation_percentage = (60, 140)  # from 60 to 140%
 interval_valid_ram_allocation = (60, 100)
@@ -137,7 +142,7 @@ def calculate_weighted_scores(tasks, process_name=None, limits={}):
     else:
         return score
 
-def calculate_scores(grouped_processes, threshold_numbers):
+def get_scoring_parameters(threshold_numbers):
     if threshold_numbers['valid_cpu_allocation_deviation']:
         VALID_CPU_DEVIATION = float(threshold_numbers['valid_cpu_allocation_deviation'] / 100)
     else: 
@@ -152,6 +157,10 @@ def calculate_scores(grouped_processes, threshold_numbers):
     else:
         RAM_WEIGHT = 0.5
         CPU_WEIGHT = 0.5
+    return VALID_CPU_DEVIATION, VALID_MEMORY_DEVIATION, CPU_WEIGHT, RAM_WEIGHT
+
+def calculate_scores(grouped_processes, threshold_numbers):
+    VALID_CPU_DEVIATION, VALID_MEMORY_DEVIATION, CPU_WEIGHT, RAM_WEIGHT = get_scoring_parameters(threshold_numbers)
 
     process_scores_per_run = {}
     full_score_per_run = {}
@@ -177,8 +186,9 @@ def calculate_scores(grouped_processes, threshold_numbers):
                 max_memory_requested = task.memory
             if task.rss and task.rss > available_rss:
                 available_rss = task.rss
-            if available_memory == 0 and task.memory_percentage and task.memory_percentage > 0 and task.rss and task.rss > 0:
-                available_memory = (100 / task.memory_percentage) * task.rss
+            # largest estimation over all tasks, so it does not depend on the task order (see add_task_to_process_aggregate)
+            if task.memory_percentage and task.memory_percentage > 0 and task.rss and task.rss > 0:
+                available_memory = max([available_memory, (100 / task.memory_percentage) * task.rss])
             available_memory = max([available_memory, available_rss])
 
         limits = {
@@ -192,15 +202,210 @@ def calculate_scores(grouped_processes, threshold_numbers):
             weighted_task_information_per_run[run_name].append(x)        
         
         process_scores_per_run[run_name] = []
-        distinct_process_names = list(set([task['process'] for task in weighted_task_information_per_run[run_name]]))
-        for process in distinct_process_names:
-            tasks_by_process = [task for task in weighted_task_information_per_run[run_name] if task['process'] == process]
+        for process, tasks_by_process in group_tasks_by_process(weighted_task_information_per_run[run_name]).items():
             process_scores_per_run[run_name].append(calculate_weighted_scores(tasks_by_process, process, limits))
         
         full_score_per_run[run_name] = calculate_weighted_scores(weighted_task_information_per_run[run_name])
 
     return {"task_information": weighted_task_information_per_run, "process_scores": process_scores_per_run, "full_scores": full_score_per_run}
 
+"""
+Columnar scoring
+
+Same results as calculate_scores, but the trace values of a run are loaded into numpy arrays once and all
+scores are calculated with array operations. Per process sums are np.bincount reductions, which add up the values
+in task order - just like the loops of the dict based implementation, so the results are identical.
+"""
+SCORING_COLUMNS = ['task_id', 'process', 'run_name', 'cpus', 'tag', 'memory', 'duration', 'vmem', 'realtime', 'cpu_percentage', 'rss', 'status']
+SCORE_KEYS = ['cpu_allocation', 'raw_cpu_penalty', 'raw_cpu_score', 'memory_allocation', 'raw_memory_penalty', 'raw_memory_score']
+FAILED_SCORE_KEYS = ['raw_cpu_penalty', 'raw_memory_penalty', 'memory_allocation', 'cpu_allocation', 'raw_memory_score', 'raw_cpu_score']
+WEIGHTED_SCORE_KEYS = ['weighted_cpu_score', 'weighted_memory_score', 'pure_score']
+
+
+def to_float_array(values):
+    # None becomes nan
+    return np.array(values, dtype=np.float64)
+
+def is_truthy(values):
+    return ~np.isnan(values) & (values != 0)
+
+def masked_list(values, mask):
+    result = values.astype(object)
+    result[~mask] = None
+    return result.tolist()
+
+def penalty_score(ratio, penalty, over_allocated):
+    # exp is taken from math for the over allocated tasks only, np.exp may differ in the last digit
+    score = ratio.copy()
+    score[over_allocated] = [math.exp(-4 * delta) for delta in penalty[over_allocated].tolist()]
+    return score
+
+def grouped_sum(codes, values, mask, groups):
+    return np.bincount(codes, weights=np.where(mask, values, 0.0), minlength=groups)
+
+def grouped_count(codes, mask, groups):
+    return np.bincount(codes, weights=mask, minlength=groups).astype(np.int64)
+
+def grouped_average(sums, counts, index):
+    return 0 if counts[index] == 0 else float(sums[index]) / int(counts[index])
+
+def get_run_columns(run_tasks):
+    columns = {key: [getattr(task, key) for task in run_tasks] for key in SCORING_COLUMNS}
+    columns['memory_percentage'] = [task.memory_percentage for task in run_tasks]
+    return columns
+
+def get_available_memory(rss, memory_percentage):
+    # same estimation as in calculate_scores: the largest rss, or the largest memory estimated from the memory
+    # percentage of a task if that is larger
+    available_memory = 0
+    for task_rss, task_memory_percentage in zip(rss, memory_percentage):
+        if task_rss and task_rss > 0:
+            if task_memory_percentage and task_memory_percentage > 0:
+                available_memory = max([available_memory, (100 / task_memory_percentage) * task_rss])
+            available_memory = max([available_memory, task_rss])
+    return available_memory
+
+def calculate_run_scores_columnar(run_tasks, CPU_WEIGHT, RAM_WEIGHT, VALID_CPU_DEVIATION, VALID_MEMORY_DEVIATION):
+    columns = get_run_columns(run_tasks)
+    cpus = to_float_array(columns['cpus'])
+    memory = to_float_array(columns['memory'])
+    rss = to_float_array(columns['rss'])
+    realtime = to_float_array(columns['realtime'])
+    cpu_percentage = to_float_array(columns['cpu_percentage'])
+    failed = np.array([status == "FAILED" for status in columns['status']], dtype=bool)
+
+    limits = {
+        "max_cpu_requested": max([value for value in columns['cpus'] if value and value > 0], default=0),
+        "max_memory_requested": max([value for value in columns['memory'] if value and value > 0], default=0),
+        "max_memory": get_available_memory(columns['rss'], columns['memory_percentage']),
+        "cpu_deviation": VALID_CPU_DEVIATION, "memory_deviation": VALID_MEMORY_DEVIATION,
+    }
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # raw scores
+        cpu_valid = ~failed & (cpus > 0) & is_truthy(cpu_percentage)
+        cpu_allocation = cpu_percentage / cpus
+        raw_cpu_penalty = np.abs(1 - (cpu_allocation / 100))
+        raw_cpu_score = penalty_score(cpu_allocation / 100, raw_cpu_penalty, cpu_valid & (cpu_allocation > 100))
+
+        memory_valid = ~failed & (memory > 0) & is_truthy(rss)
+        memory_ratio = rss / memory
+        memory_allocation = memory_ratio * 100
+        raw_memory_penalty = np.abs(1 - memory_ratio)
+        raw_memory_score = penalty_score(memory_ratio, raw_memory_penalty, memory_valid & (memory_ratio > 1))
+
+        # weighted scores
+        cpu_scored = cpu_valid & (raw_cpu_score != 0)
+        memory_scored = memory_valid & (raw_memory_score != 0)
+        weighted_cpu_score = CPU_WEIGHT * raw_cpu_score
+        weighted_memory_score = RAM_WEIGHT * raw_memory_score
+        pure_nominator = np.where(cpu_scored, weighted_cpu_score, 0.0) + np.where(memory_scored, weighted_memory_score, 0.0)
+        pure_denominator = np.where(cpu_scored, CPU_WEIGHT, 0.0) + np.where(memory_scored, RAM_WEIGHT, 0.0)
+        pure_valid = pure_denominator != 0
+        pure_score = pure_nominator / pure_denominator
+
+        # summands of calculate_weighted_scores
+        contributing = (cpu_scored & (weighted_cpu_score != 0) & is_truthy(cpu_percentage) & memory_scored
+                        & (weighted_memory_score != 0) & is_truthy(rss) & is_truthy(realtime))
+        numbers_cpu = cpu_percentage / 100
+        mem_adjusted = (rss / math.pow(1024, 3)) / 8
+        score_nominator = ((weighted_cpu_score * numbers_cpu) + (weighted_memory_score * mem_adjusted)) * realtime
+        score_denominator = ((CPU_WEIGHT * numbers_cpu) + (RAM_WEIGHT * mem_adjusted)) * realtime
+
+    # per task results
+    score_columns = [
+        masked_list(cpu_allocation, cpu_valid), masked_list(raw_cpu_penalty, cpu_valid), masked_list(raw_cpu_score, cpu_valid),
+        masked_list(memory_allocation, memory_valid), masked_list(raw_memory_penalty, memory_valid), masked_list(raw_memory_score, memory_valid),
+    ]
+    weighted_columns = [
+        masked_list(weighted_cpu_score, cpu_scored), masked_list(weighted_memory_score, memory_scored), masked_list(pure_score, pure_valid),
+    ]
+    task_information = []
+    for index, values in enumerate(zip(*[columns[key] for key in SCORING_COLUMNS])):
+        task = dict(zip(SCORING_COLUMNS, values))
+        if failed[index]:
+            for key in FAILED_SCORE_KEYS:
+                task[key] = None
+            for key in WEIGHTED_SCORE_KEYS:
+                task[key] = None
+        else:
+            for key, column in zip(SCORE_KEYS, score_columns):
+                task[key] = column[index]
+            task['weight_cpu'] = CPU_WEIGHT
+            task['weight_memory'] = RAM_WEIGHT
+            for key, column in zip(WEIGHTED_SCORE_KEYS, weighted_columns):
+                task[key] = column[index]
+        task_information.append(task)
+
+    # per process aggregates
+    process_index = {}
+    codes = np.array([process_index.setdefault(process, len(process_index)) for process in columns['process']], dtype=np.int64)
+    groups = len(process_index)
+    nominator_sums = grouped_sum(codes, score_nominator, contributing, groups)
+    denominator_sums = grouped_sum(codes, score_denominator, contributing, groups)
+
+    cpu_penalty_sums = grouped_sum(codes, raw_cpu_penalty, cpu_valid, groups)
+    cpu_penalty_counts = grouped_count(codes, cpu_valid, groups)
+    memory_penalty_sums = grouped_sum(codes, raw_memory_penalty, memory_valid, groups)
+    memory_penalty_counts = grouped_count(codes, memory_valid, groups)
+
+    memory_allocation_given = memory_valid & (memory_allocation != 0)
+    memory_allocation_sums = grouped_sum(codes, memory_allocation, memory_allocation_given, groups)
+    memory_allocation_counts = grouped_count(codes, memory_allocation_given, groups)
+    cpu_allocation_given = cpu_valid & (cpu_allocation != 0)
+    cpu_allocation_sums = grouped_sum(codes, cpu_allocation, cpu_allocation_given, groups)
+    cpu_allocation_counts = grouped_count(codes, cpu_allocation_given, groups)
+    memory_requested_sums = grouped_sum(codes, memory, is_truthy(memory), groups)
+    memory_requested_counts = grouped_count(codes, is_truthy(memory), groups)
+    rss_sums = grouped_sum(codes, rss, is_truthy(rss), groups)
+    rss_counts = grouped_count(codes, is_truthy(rss), groups)
+    cpus_requested_sums = grouped_sum(codes, cpus, is_truthy(cpus), groups)
+    cpus_requested_counts = grouped_count(codes, is_truthy(cpus), groups)
+    cpu_used_sums = grouped_sum(codes, numbers_cpu, is_truthy(cpu_percentage), groups)
+    cpu_used_counts = grouped_count(codes, is_truthy(cpu_percentage), groups)
+
+    process_scores = []
+    for process, index in process_index.items():
+        problems = get_process_invalidities_from_averages(
+            {"deviation_average": grouped_average(memory_penalty_sums, memory_penalty_counts, index)},
+            {"deviation_average": grouped_average(cpu_penalty_sums, cpu_penalty_counts, index)},
+            {
+                'allocation_average': grouped_average(memory_allocation_sums, memory_allocation_counts, index),
+                'requested_average': grouped_average(memory_requested_sums, memory_requested_counts, index),
+                'used_average': grouped_average(rss_sums, rss_counts, index),
+            },
+            {
+                'allocation_average': grouped_average(cpu_allocation_sums, cpu_allocation_counts, index),
+                'requested_average': grouped_average(cpus_requested_sums, cpus_requested_counts, index),
+                'used_average': grouped_average(cpu_used_sums, cpu_used_counts, index),
+            },
+            limits["max_cpu_requested"], limits["max_memory"], limits['cpu_deviation'], limits['memory_deviation'],
+        )
+        score = None if denominator_sums[index] == 0 else float(nominator_sums[index]) / float(denominator_sums[index])
+        process_scores.append({"process": process, "score": score, "problems": problems})
+
+    full_nominator = grouped_sum(np.zeros(len(codes), dtype=np.int64), score_nominator, contributing, 1)[0]
+    full_denominator = grouped_sum(np.zeros(len(codes), dtype=np.int64), score_denominator, contributing, 1)[0]
+    full_score = None if full_denominator == 0 else float(full_nominator) / float(full_denominator)
+
+    return task_information, process_scores, full_score
+
+def calculate_scores_columnar(grouped_processes, threshold_numbers):
+    VALID_CPU_DEVIATION, VALID_MEMORY_DEVIATION, CPU_WEIGHT, RAM_WEIGHT = get_scoring_parameters(threshold_numbers)
+
+    process_scores_per_run = {}
+    full_score_per_run = {}
+    weighted_task_information_per_run = {}
+    for run_name in grouped_processes:
+        task_information, process_scores, full_score = calculate_run_scores_columnar(
+            grouped_processes[run_name], CPU_WEIGHT, RAM_WEIGHT, VALID_CPU_DEVIATION, VALID_MEMORY_DEVIATION,
+        )
+        weighted_task_information_per_run[run_name] = task_information
+        process_scores_per_run[run_name] = process_scores
+        full_score_per_run[run_name] = full_score
+
+    return {"task_information": weighted_task_information_per_run, "process_scores": process_scores_per_run, "full_scores": full_score_per_run}
+
 def get_per_process_worst_rss_ratios(process_name, tasks):
     ratios = [1 if task['vmem'] == 0 else task['rss'] / task['vmem'] for task in tasks if task['rss'] and task['vmem']]
     ratio_sum = sum(ratios)
@@ -296,8 +501,265 @@ def get_process_relation_data(tasks):
     return rel_data
 
 
+def get_per_process_results_from_tasks(tasks_by_process):
+    per_process_results = {
+        "process_names": list(tasks_by_process.keys()), "duration_sum": [], "duration_average": [],
+        "cpu_allocation": [], "memory_allocation": [], "rss_ratio": [], "relation_data": [],
+    }
+    for process_name, by_process_tasks in tasks_by_process.items():
+        per_process_realtime_list = [task['realtime'] for task in by_process_tasks if task['realtime'] is not None]
+        per_process_results["duration_sum"].append({"process": process_name, "sum": sum(per_process_realtime_list)})
+        if len(per_process_realtime_list) == 0:
+            per_process_results["duration_average"].append({"process": process_name, "average": 0})
+        else: 
+            per_process_results["duration_average"].append({"process": process_name, "average": sum(per_process_realtime_list) / len(per_process_realtime_list)})
+        
+        per_process_results["cpu_allocation"].append(get_per_process_cpu_allocation_results(process_name, by_process_tasks))
+        per_process_results["memory_allocation"].append(get_per_process_memory_allocation_results(process_name, by_process_tasks))
+        per_process_results["rss_ratio"].append(get_per_process_worst_rss_ratios(process_name, by_process_tasks))
+        per_process_results["relation_data"].append(get_process_relation_data(by_process_tasks))
+    return per_process_results
+
+def get_per_process_results_from_aggregates(aggregates):
+    """
+    Same as get_per_process_results_from_tasks, but read from the process aggregates of a run (see
+    crud.get_process_aggregates_by_token), so the cost depends on the number of processes only
+    :param aggregates: list of aggregate dicts, see new_process_aggregate
+    """
+    per_process_results = {
+        "process_names": [aggregate["process"] for aggregate in aggregates], "duration_sum": [], "duration_average": [],
+        "cpu_allocation": [], "memory_allocation": [], "rss_ratio": [], "relation_data": [],
+    }
+    for aggregate in aggregates:
+        process_name = aggregate["process"]
+        per_process_results["duration_sum"].append({"process": process_name, "sum": aggregate["realtime_sum"]})
+        per_process_results["duration_average"].append({"process": process_name, "average": aggregate_average(aggregate["realtime_sum"], aggregate["realtime_count"])})
+        per_process_results["cpu_allocation"].append({
+            "deviation_sum": aggregate["cpu_penalty_sum"], "deviation_average": aggregate_average(aggregate["cpu_penalty_sum"], aggregate["cpu_penalty_count"]),
+            "tasks": [aggregate["task_count"]], "process_name": process_name,
+        })
+        per_process_results["memory_allocation"].append({
+            "deviation_sum": aggregate["memory_penalty_sum"], "deviation_average": aggregate_average(aggregate["memory_penalty_sum"], aggregate["memory_penalty_count"]),
+            "tasks": [aggregate["task_count"]], "process_name": process_name,
+        })
+        per_process_results["rss_ratio"].append({
+            "ratio_average": aggregate_average(aggregate["rss_ratio_sum"], aggregate["rss_ratio_count"], 1), "tasks": aggregate["task_count"], "process_name": process_name,
+        })
+        relation_data = {}
+        if aggregate["relation_count"] > 0:
+            relation_data["xMin"] = aggregate["cpu_allocation_min"]
+            relation_data["x"] = aggregate["cpu_allocation_sum"] / aggregate["relation_count"]
+            relation_data["xMax"] = aggregate["cpu_allocation_max"]
+            relation_data["yMin"] = aggregate["memory_allocation_min"]
+            relation_data["y"] = aggregate["memory_allocation_sum"] / aggregate["relation_count"]
+            relation_data["yMax"] = aggregate["memory_allocation_max"]
+        per_process_results["relation_data"].append(relation_data)
+    return per_process_results
+
+"""
+Process aggregates
+Sums, counts, minima and maxima per (token, run_name, process) of everything the analysis derives from the tasks.
+The ingest adds a task once it reaches a terminal state (get_process_aggregate_deltas, stored by
+crud.process_aggregate_upsert_statement), the analysis adds the tasks which are not in a terminal state yet when it
+reads the aggregates - so both cover the same tasks as the analysis of all traces. A task moving from one terminal
+state to a later one keeps the values of its first terminal state in the aggregates.
+"""
+
+def aggregate_average(value_sum, count, default=0):
+    return default if count == 0 else value_sum / count
+
+def new_process_aggregate(token, run_name, process):
+    return {
+        "token": token, "run_name": run_name, "process": process,
+        "task_count": 0, "terminal_count": 0, "realtime_sum": 0, "realtime_count": 0,
+        "cpu_penalty_sum": 0.0, "cpu_penalty_count": 0, "memory_penalty_sum": 0.0, "memory_penalty_count": 0,
+        "scored_cpu_allocation_sum": 0.0, "scored_memory_allocation_sum": 0.0,
+        "rss_ratio_sum": 0.0, "rss_ratio_count": 0, "relation_count": 0,
+        "cpu_allocation_sum": 0.0, "cpu_allocation_min": None, "cpu_allocation_max": None,
+        "memory_allocation_sum": 0.0, "memory_allocation_min": None, "memory_allocation_max": None,
+        "cpus_requested_sum": 0, "cpus_requested_count": 0, "memory_requested_sum": 0, "memory_requested_count": 0,
+        "cpus_used_sum": 0.0, "cpus_used_count": 0, "rss_sum": 0, "rss_count": 0,
+        "score_count": 0, "cpu_score_sum": 0.0, "memory_score_sum": 0.0, "cpu_score_weight_sum": 0.0, "memory_score_weight_sum": 0.0,
+        "max_cpus": None, "max_available_memory": None,
+    }
+
+def add_task_to_process_aggregate(aggregate, task):
+    """
+    Adds the values of a task to a process aggregate, with the same rules as the analysis of all traces. The task
+    and terminal counts are left to the caller.
+    :param task: object with the AGGREGATED_TRACE_COLUMNS of crud as attributes
+    """
+    scored = calculate_raw_scores_per_task(
+        {"status": task.status, "cpus": task.cpus, "cpu_percentage": task.cpu_percentage, "memory": task.memory, "rss": task.rss}, None, None,
+    )
+    if task.realtime is not None:
+        aggregate["realtime_sum"] += task.realtime
+        aggregate["realtime_count"] += 1
+    if scored["raw_cpu_penalty"] is not None:
+        aggregate["cpu_penalty_sum"] += scored["raw_cpu_penalty"]
+        aggregate["cpu_penalty_count"] += 1
+        aggregate["scored_cpu_allocation_sum"] += scored["cpu_allocation"]
+    if scored["raw_memory_penalty"] is not None:
+        aggregate["memory_penalty_sum"] += scored["raw_memory_penalty"]
+        aggregate["memory_penalty_count"] += 1
+        aggregate["scored_memory_allocation_sum"] += scored["memory_allocation"]
+    if task.rss and task.vmem:
+        aggregate["rss_ratio_sum"] += task.rss / task.vmem
+        aggregate["rss_ratio_count"] += 1
+    if scored["cpu_allocation"] and task.cpus and scored["memory_allocation"] and task.memory:
+        aggregate["relation_count"] += 1
+        for metric in ["cpu_allocation", "memory_allocation"]:
+            aggregate[f"{metric}_sum"] += scored[metric]
+            aggregate[f"{metric}_min"] = scored[metric] if aggregate[f"{metric}_min"] is None else min(aggregate[f"{metric}_min"], scored[metric])
+            aggregate[f"{metric}_max"] = scored[metric] if aggregate[f"{metric}_max"] is None else max(aggregate[f"{metric}_max"], scored[metric])
+    # requested and used averages of get_process_invalidities
+    if task.cpus:
+        aggregate["cpus_requested_sum"] += task.cpus
+        aggregate["cpus_requested_count"] += 1
+        aggregate["max_cpus"] = max(aggregate["max_cpus"] or 0, task.cpus)
+    if task.memory:
+        aggregate["memory_requested_sum"] += task.memory
+        aggregate["memory_requested_count"] += 1
+    if task.cpu_percentage:
+        aggregate["cpus_used_sum"] += task.cpu_percentage / 100
+        aggregate["cpus_used_count"] += 1
+    if task.rss:
+        aggregate["rss_sum"] += task.rss
+        aggregate["rss_count"] += 1
+    if task.rss and task.rss > 0:
+        available_memory = task.rss
+        if task.memory_percentage and task.memory_percentage > 0:
+            available_memory = max([(100 / task.memory_percentage) * task.rss, task.rss])
+        aggregate["max_available_memory"] = max(aggregate["max_available_memory"] or 0, available_memory)
+    # summands of calculate_weighted_scores, with the weights factored out - see get_aggregated_score
+    if scored["raw_cpu_score"] and scored["raw_memory_score"] and task.realtime:
+        numbers_cpu = task.cpu_percentage / 100
+        mem_adjusted = (task.rss / math.pow(1024, 3)) / 8
+        aggregate["score_count"] += 1
+        aggregate["cpu_score_sum"] += scored["raw_cpu_score"] * numbers_cpu * task.realtime
+        aggregate["memory_score_sum"] += scored["raw_memory_score"] * mem_adjusted * task.realtime
+        aggregate["cpu_score_weight_sum"] += numbers_cpu * task.realtime
+        aggregate["memory_score_weight_sum"] += mem_adjusted * task.realtime
+    return aggregate
+
+def merge_process_aggregate(aggregate, delta):
+    """
+    Adds an aggregate increment to an aggregate in place, like crud.process_aggregate_upsert_statement does in the
+    database: minima and maxima are combined, everything else is summed up.
+    """
+    for key, value in delta.items():
+        if key in ["token", "run_name", "process"] or value is None:
+            continue
+        if aggregate[key] is None:
+            aggregate[key] = value
+        elif key.endswith("_min"):
+            aggregate[key] = min(aggregate[key], value)
+        elif key.endswith("_max") or key.startswith("max_"):
+            aggregate[key] = max(aggregate[key], value)
+        else:
+            aggregate[key] += value
+    return aggregate
+
+def get_process_aggregate_deltas(changed_tasks):
+    """
+    Calculates the increments for the process aggregates from upserted task rows. A task is counted when it is seen
+    for the first time, its values are added once it reaches a terminal state.
+    :param changed_tasks: rows with the upserted task values and the status the task had before (previous_status)
+    :return: list of aggregate increments by (token, run_name, process)
+    """
+    deltas = {}
+    for task in changed_tasks:
+        first_seen = task.previous_status is None
+        newly_terminal = task.status in TERMINAL_STATES and task.previous_status not in TERMINAL_STATES
+        if not first_seen and not newly_terminal:
+            continue
+        key = (task.token, task.run_name, task.process)
+        if key not in deltas:
+            deltas[key] = new_process_aggregate(task.token, task.run_name, task.process)
+        delta = deltas[key]
+        if first_seen:
+            delta["task_count"] += 1
+        if newly_terminal:
+            delta["terminal_count"] += 1
+            add_task_to_process_aggregate(delta, task)
+    return list(deltas.values())
+
+def get_aggregated_score(score_count, cpu_score_sum, memory_score_sum, cpu_score_weight_sum, memory_score_weight_sum, CPU_WEIGHT, RAM_WEIGHT):
+    # calculate_weighted_scores: a task only contributes with both weighted scores set, i.e. with both weights given
+    if score_count == 0 or CPU_WEIGHT == 0 or RAM_WEIGHT == 0:
+        return None
+    denominator = CPU_WEIGHT * cpu_score_weight_sum + RAM_WEIGHT * memory_score_weight_sum
+    if denominator == 0:
+        return None
+    return (CPU_WEIGHT * cpu_score_sum + RAM_WEIGHT * memory_score_sum) / denominator
+
+def get_process_scores_from_aggregates(aggregates, CPU_WEIGHT, RAM_WEIGHT, VALID_CPU_DEVIATION, VALID_MEMORY_DEVIATION):
+    """
+    Process scores, problems and full score of a run like calculate_run_scores_columnar, from its process aggregates
+    :return: process scores, full score
+    """
+    max_cpu_requested = max([aggregate["max_cpus"] or 0 for aggregate in aggregates], default=0)
+    max_memory = max([aggregate["max_available_memory"] or 0 for aggregate in aggregates], default=0)
+    score_sums = ["score_count", "cpu_score_sum", "memory_score_sum", "cpu_score_weight_sum", "memory_score_weight_sum"]
+    process_scores = []
+    for aggregate in aggregates:
+        problems = get_process_invalidities_from_averages(
+            {"deviation_average": aggregate_average(aggregate["memory_penalty_sum"], aggregate["memory_penalty_count"])},
+            {"deviation_average": aggregate_average(aggregate["cpu_penalty_sum"], aggregate["cpu_penalty_count"])},
+            {
+                'allocation_average': aggregate_average(aggregate["scored_memory_allocation_sum"], aggregate["memory_penalty_count"]),
+                'requested_average': aggregate_average(aggregate["memory_requested_sum"], aggregate["memory_requested_count"]),
+                'used_average': aggregate_average(aggregate["rss_sum"], aggregate["rss_count"]),
+            },
+            {
+                'allocation_average': aggregate_average(aggregate["scored_cpu_allocation_sum"], aggregate["cpu_penalty_count"]),
+                'requested_average': aggregate_average(aggregate["cpus_requested_sum"], aggregate["cpus_requested_count"]),
+                'used_average': aggregate_average(aggregate["cpus_used_sum"], aggregate["cpus_used_count"]),
+            },
+            max_cpu_requested, max_memory, VALID_CPU_DEVIATION, VALID_MEMORY_DEVIATION,
+        )
+        score = get_aggregated_score(*[aggregate[key] for key in score_sums], CPU_WEIGHT, RAM_WEIGHT)
+        process_scores.append({"process": aggregate["process"], "score": score, "problems": problems})
+    full_score = get_aggregated_score(*[sum(aggregate[key] for aggregate in aggregates) for key in score_sums], CPU_WEIGHT, RAM_WEIGHT)
+    return process_scores, full_score
+
 def analyze(db: Session, grouped_processes, threshold_numbers):
-    result_scores = calculate_scores(grouped_processes, threshold_numbers)
+    """
+    Analysis of all traces of the runs, including the scores of every task (workflow_scores.task_information)
+    """
+    result_scores = calculate_scores_columnar(grouped_processes, threshold_numbers)
+    per_run_results = {}
+    for run_name, run_task_information in result_scores['task_information'].items():
+        per_process_results = get_per_process_results_from_tasks(group_tasks_by_process(run_task_information))
+        per_run_results[run_name] = (per_process_results, run_task_information)
+    return get_analysis(result_scores, per_run_results)
+
+def analyze_process_aggregates(process_aggregates, top_tasks, threshold_numbers):
+    """
+    Same analysis as analyze, read from the process aggregates of the runs (see crud.get_process_aggregates_by_token)
+    and the candidates of the worst task lists (see crud.get_top_task_rows_by_token) instead of all traces. The
+    workflow_scores hold the process and full scores only, not the scores of every task.
+    """
+    VALID_CPU_DEVIATION, VALID_MEMORY_DEVIATION, CPU_WEIGHT, RAM_WEIGHT = get_scoring_parameters(threshold_numbers)
+    result_scores = {"process_scores": {}, "full_scores": {}}
+    per_run_results = {}
+    for run_name, run_aggregates in process_aggregates.items():
+        process_scores, full_score = get_process_scores_from_aggregates(run_aggregates, CPU_WEIGHT, RAM_WEIGHT, VALID_CPU_DEVIATION, VALID_MEMORY_DEVIATION)
+        result_scores["process_scores"][run_name] = process_scores
+        result_scores["full_scores"][run_name] = full_score
+        # the scores of a task do not depend on the other tasks, so scoring the candidates only is enough
+        candidates = top_tasks.get(run_name, [])
+        run_task_information = []
+        if len(candidates) > 0:
+            run_task_information = calculate_run_scores_columnar(candidates, CPU_WEIGHT, RAM_WEIGHT, VALID_CPU_DEVIATION, VALID_MEMORY_DEVIATION)[0]
+        per_run_results[run_name] = (get_per_process_results_from_aggregates(run_aggregates), run_task_information)
+    return get_analysis(result_scores, per_run_results)
+
+def get_analysis(result_scores, per_run_results):
+    """
+    :param result_scores: the workflow scores
+    :param per_run_results: dict of run name -> (per process results, scored tasks the worst tasks are taken from)
+    """
     analysis = {}
 
 
@@ -325,77 +787,51 @@ def analyze(db: Session, grouped_processes, threshold_numbers):
     per_run_worst_rss_vmem_ratio_processes = {} # worst ratio for rss/vmem
    
 
-    for run_name in result_scores['task_information']:
-        run_task_information = result_scores['task_information'][run_name]
-        distinct_process_names = list(set([task['process'] for task in run_task_information]))
+    for run_name, (per_process_results, run_task_information) in per_run_results.items():
+        per_process_duration_sum = per_process_results["duration_sum"]
+        per_process_duration_average = per_process_results["duration_average"]
+        per_process_cpu_allocation = per_process_results["cpu_allocation"]
+        per_process_memory_allocation = per_process_results["memory_allocation"]
+        per_process_rss_ratio = per_process_results["rss_ratio"]
+
+        # ratio plot
+        ram_cpu_relation_labels = per_process_results["process_names"]
+        ram_cpu_relation_data = per_process_results["relation_data"]
         
         return_number_tasks = min([10, len(run_task_information)]) # could be more dynamic
-        return_number_processes = min([10, len(distinct_process_names)]) # as well
+        return_number_processes = min([10, len(ram_cpu_relation_labels)]) # as well
 
+        # heapq.nlargest is equivalent to sorted(..., reverse=True)[:n], without sorting the whole run
         # duration
-        duration_sorted_list_descending = sorted(run_task_information, key=lambda task: task.get('realtime', -1) or -1, reverse=True)
+        per_run_bad_duration_tasks[run_name] = heapq.nlargest(return_number_tasks, run_task_information, key=lambda task: task.get('realtime', -1) or -1)
         # cpu_alloc
-        cpu_alloc_sorted_list_descending = sorted(run_task_information, key=lambda task: task.get('raw_cpu_penalty', -1) or -1, reverse=True)
+        per_run_task_worst_cpu_allocation[run_name] = heapq.nlargest(return_number_tasks, run_task_information, key=lambda task: task.get('raw_cpu_penalty', -1) or -1)
         # memory_alloc
-        memory_alloc_sorted_list_descending = sorted(run_task_information, key=lambda task: task.get('raw_memory_penalty', -1) or -1, reverse=True)
-        
-        per_run_bad_duration_tasks[run_name] = duration_sorted_list_descending[:return_number_tasks]
-        per_run_task_worst_cpu_allocation[run_name] = cpu_alloc_sorted_list_descending[:return_number_tasks]
-        per_run_task_worst_memory_allocation[run_name] = memory_alloc_sorted_list_descending[:return_number_tasks]
-
-        per_process_duration_sum = []
-        per_process_duration_average = []
-        per_process_cpu_allocation = []
-        per_process_memory_allocation = []
-        per_process_rss_ratio = []
-
-        # ratio plot
-        ram_cpu_relation_labels = distinct_process_names
-        ram_cpu_relation_data = []
-
-        for process_name in distinct_process_names:
-            by_process_tasks = [task for task in run_task_information if task['process'] == process_name]
-            per_process_realtime_list = [task['realtime'] for task in by_process_tasks if task['realtime'] is not None]
-            per_process_duration_sum.append({"process": process_name, "sum": sum(per_process_realtime_list)})
-            if len(per_process_realtime_list) == 0:
-                per_process_duration_average.append({"process": process_name, "average": 0})
-            else: 
-                per_process_duration_average.append({"process": process_name, "average": sum(per_process_realtime_list) / len(per_process_realtime_list)})
-            
-            cpu_allocation_results = get_per_process_cpu_allocation_results(process_name, by_process_tasks)
-            per_process_cpu_allocation.append(cpu_allocation_results)
-            memory_allocation_results = get_per_process_memory_allocation_results(process_name, by_process_tasks)
-            per_process_memory_allocation.append(memory_allocation_results)
-
-            memory_physical_ratio_results = get_per_process_worst_rss_ratios(process_name, by_process_tasks)
-            per_process_rss_ratio.append(memory_physical_ratio_results)
-
-            process_relation_data = get_process_relation_data(by_process_tasks)
-            ram_cpu_relation_data.append(process_relation_data)
+        per_run_task_worst_memory_allocation[run_name] = heapq.nlargest(return_number_tasks, run_task_information, key=lambda task: task.get('raw_memory_penalty', -1) or -1)
 
-            final_error_bar_data = {
-                "data": ram_cpu_relation_data,
-                "label": "CPU - RAM ratio"
-            }
+        final_error_bar_data = {
+            "data": ram_cpu_relation_data,
+            "label": "CPU - RAM ratio"
+        }
 
-            per_run_cpu_ram_ratio_data[run_name] = {
-                "data": final_error_bar_data,
-                "labels": ram_cpu_relation_labels,
-            }
+        per_run_cpu_ram_ratio_data[run_name] = {
+            "data": final_error_bar_data,
+            "labels": ram_cpu_relation_labels,
+        }
 
     
-        per_run_bad_duration_processes_sums[run_name] = sorted(per_process_duration_sum, key=lambda process: process.get('sum'), reverse=True)[:return_number_processes]
+        per_run_bad_duration_processes_sums[run_name] = heapq.nlargest(return_number_processes, per_process_duration_sum, key=lambda process: process.get('sum'))
        
-        per_run_bad_duration_processes_average[run_name] = sorted(per_process_duration_average, key=lambda process: process.get('average'), reverse=True)[:return_number_processes]
+        per_run_bad_duration_processes_average[run_name] = heapq.nlargest(return_number_processes, per_process_duration_average, key=lambda process: process.get('average'))
 
     
         
-        per_run_process_cpu_allocation_deviation_sums[run_name] = sorted(per_process_cpu_allocation, key=lambda process: process.get('deviation_sum'), reverse=True)[:return_number_processes]
-        per_run_process_cpu_allocation_deviation_averages[run_name] = sorted(per_process_cpu_allocation, key=lambda process: process.get('deviation_average'), reverse=True)[:return_number_processes]
+        per_run_process_cpu_allocation_deviation_sums[run_name] = heapq.nlargest(return_number_processes, per_process_cpu_allocation, key=lambda process: process.get('deviation_sum'))
+        per_run_process_cpu_allocation_deviation_averages[run_name] = heapq.nlargest(return_number_processes, per_process_cpu_allocation, key=lambda process: process.get('deviation_average'))
 
-        per_run_process_memory_allocation_deviation_sums[run_name] = sorted(per_process_memory_allocation, key=lambda process: process.get('deviation_sum'), reverse=True)[:return_number_processes]
-        per_run_process_memory_allocation_deviation_averages[run_name] = sorted(per_process_memory_allocation, key=lambda process: process.get('deviation_average'), reverse=True)[:return_number_processes]
-        per_run_worst_rss_vmem_ratio_processes[run_name] = sorted(per_process_rss_ratio, key=lambda process: process.get('ratio_average'))[:return_number_processes]
+        per_run_process_memory_allocation_deviation_sums[run_name] = heapq.nlargest(return_number_processes, per_process_memory_allocation, key=lambda process: process.get('deviation_sum'))
+        per_run_process_memory_allocation_deviation_averages[run_name] = heapq.nlargest(return_number_processes, per_process_memory_allocation, key=lambda process: process.get('deviation_average'))
+        per_run_worst_rss_vmem_ratio_processes[run_name] = heapq.nsmallest(return_number_processes, per_process_rss_ratio, key=lambda process: process.get('ratio_average'))
 
         
 
@@ -442,10 +878,50 @@ def sort_values_per_run(run_duration_data, key_name, reverse=False):
     return per_run_mapping
 
 
+def get_status_rank(status):
+    """
+    Position of the status in STATUS_SORTING, starting at 1. Unknown states (and None) rank lowest with 0, the same
+    as coalesce(array_position(...), 0) in crud.trace_upsert_statement.
+    """
+    try:
+        return STATUS_SORTING.index(status) + 1
+    except ValueError:
+        return 0
+
+
 def has_newer_state(old_trace_entry: models.RunTrace, new_trace_entry: models.RunTrace):
-    old_status, new_status = old_trace_entry.status, new_trace_entry.status
-    return STATUS_SORTING.index(new_status) > STATUS_SORTING.index(old_status)
-    
+    return get_status_rank(new_trace_entry.status) > get_status_rank(old_trace_entry.status)
+
+
+def get_script_hash(script):
+    """
+    Content address of a task script in the task_script table, same as encode(sha256(convert_to(script, 'UTF8')), 'hex')
+    in postgres (see alembic revision b7d2e5f8a913)
+    """
+    if script is None:
+        return None
+    return hashlib.sha256(script.encode()).hexdigest()
+
+
+def coalesce_trace_data(trace_data_list):
+    """
+    Reduces a list of trace dicts (in arrival order) to the newest state per task, keyed by (token, run_id, task_id).
+    Same semantics as has_newer_state: a later event only replaces an earlier one if its status is strictly newer.
+    A submit time known from any event of the task is kept, as it is part of the conflict key of the upsert.
+    :param trace_data_list: list of trace dicts as returned by crud.get_trace_data
+    :return: dict of (token, run_id, task_id) -> trace dict
+    """
+    newest_per_task = {}
+    for trace_data in trace_data_list:
+        key = (trace_data["token"], trace_data["run_id"], trace_data["task_id"])
+        current = newest_per_task.get(key)
+        if current is None:
+            newest_per_task[key] = trace_data
+            continue
+        newest = trace_data if get_status_rank(trace_data["status"]) > get_status_rank(current["status"]) else current
+        newest_per_task[key] = {**newest, "submit": current["submit"] or trace_data["submit"]}
+    return newest_per_task
+
 
 
 def group_runwise(data):
@@ -564,7 +1040,14 @@ def get_process_invalidities(tasks, max_cpu_requested, max_memory, max_memory_re
     cpu_allocation_results = get_per_process_cpu_allocation_results('', tasks)
     memory_allocation_average = get_memory_allocation_average_over_tasks(tasks)
     cpu_allocation_average = get_cpu_allocation_average_over_tasks(tasks)
-    
+    return get_process_invalidities_from_averages(
+        memory_allocation_results, cpu_allocation_results, memory_allocation_average, cpu_allocation_average,
+        max_cpu_requested, max_memory, cpu_deviation, memory_deviation,
+    )
+
+def get_process_invalidities_from_averages(memory_allocation_results, cpu_allocation_results, memory_allocation_average, cpu_allocation_average,
+                                           max_cpu_requested, max_memory, cpu_deviation, memory_deviation):
+    problems = []
     if cpu_allocation_results['deviation_average'] > cpu_deviation:
         cpu_needed_float = cpu_allocation_average['used_average']
         cpu_requested_average = cpu_allocation_average['requested_average']
@@ -650,6 +1133,18 @@ def group_by_run_name(result_by_task):
     return run_name_dictionary
 
 
+def group_tasks_by_process(tasks):
+    """
+    Groups task dicts by their process in a single pass, keeping the task order within each process
+    :param tasks: list of task dicts
+    :return: dict of process name -> list of task dicts, in order of first appearance
+    """
+    tasks_by_process = {}
+    for task in tasks:
+        tasks_by_process.setdefault(task['process'], []).append(task)
+    return tasks_by_process
+
+
 def group_by_process(traces):
     grouped_traces = {key: list(process_group) for key, process_group in groupby(sorted(traces, key=attrgetter('process')), key=attrgetter('process'))}
     return grouped_traces
@@ -658,4 +1153,24 @@ def group_by_process(traces):
 
 """
 End of analysis part
-"""
\ No newline at end of file
+"""
+
+"""
+Streaming serialization
+"""
+
+def stream_ndjson(rows, columns):
+    for row in rows:
+        yield orjson.dumps(dict(zip(columns, row))) + b"\n"
+
+def stream_json_array(rows, columns, chunk_size=1000):
+    yield b"["
+    separator = b""
+    chunk = []
+    for row in rows:
+        chunk.append(separator + orjson.dumps(dict(zip(columns, row))))
+        separator = b","
+        if len(chunk) >= chunk_size:
+            yield b"".join(chunk)
+            chunk = []
+    yield b"".join(chunk) + b"]"
\ No newline at end of file
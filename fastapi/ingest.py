@@ -0,0 +1,155 @@
+from redis import Redis
+import os
+import socket
+import time
+import logging
+
+import orjson
+
+import crud
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+
+TRACE_EVENT_BUFFER = "trace_event_buffer"
+TRACE_EVENT_DEAD_LETTER = "trace_event_buffer:failed"
+BATCH_MAX_EVENTS = int(os.environ.get('INGEST_BATCH_MAX_EVENTS', '500'))
+BATCH_MAX_WAIT_MS = int(os.environ.get('INGEST_BATCH_MAX_WAIT_MS', '200'))
+# has to be stable over restarts of a consumer, so it finds its unacknowledged events again
+INGEST_CONSUMER_NAME = os.environ.get('INGEST_CONSUMER_NAME', socket.gethostname())
+
+logger = logging.getLogger('ingest')
+
+r_con = Redis(host=REDIS_HOST, port=6379)
+
+"""
+Batching consumer for weblog events.
+POST /run/{token_id} pushes every event onto the TRACE_EVENT_BUFFER list. This consumer drains up to
+BATCH_MAX_EVENTS events, or whatever arrived within BATCH_MAX_WAIT_MS after the first one, and persists them
+in a single transaction via crud.persist_trace_batch.
+Events are moved (not popped) into the processing list of the consumer and only removed from there once they are
+committed, so a crashing consumer loses nothing: it moves its leftovers back onto the buffer when it starts again.
+"""
+
+# moves up to ARGV[1] events from the head of KEYS[1] to the tail of KEYS[2] atomically
+MOVE_EVENTS_SCRIPT = """
+local events = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #events > 0 then
+    redis.call('LTRIM', KEYS[1], #events, -1)
+    redis.call('RPUSH', KEYS[2], unpack(events))
+end
+return events
+"""
+# registered once, the calls pass the client of the consumer and load the script on demand
+move_events = r_con.register_script(MOVE_EVENTS_SCRIPT)
+
+
+def push_event(r_con: Redis, json_ob, token_id):
+    r_con.rpush(TRACE_EVENT_BUFFER, orjson.dumps({"token_id": token_id, "event": json_ob}))
+
+
+def get_processing_list(consumer_name=INGEST_CONSUMER_NAME):
+    return f"{TRACE_EVENT_BUFFER}:processing:{consumer_name}"
+
+
+def requeue_unacknowledged(r_con: Redis, processing_list):
+    """
+    Moves the events a previous run of this consumer took but did not commit back to the head of the buffer, in
+    their original order.
+    :return: number of requeued events
+    """
+    requeued = 0
+    while r_con.lmove(processing_list, TRACE_EVENT_BUFFER, "RIGHT", "LEFT") is not None:
+        requeued += 1
+    return requeued
+
+
+def drain_batch(r_con: Redis, processing_list, max_events=BATCH_MAX_EVENTS, max_wait_ms=BATCH_MAX_WAIT_MS, idle_timeout=1):
+    """
+    Blocks until an event is available (or idle_timeout seconds passed) and collects further events until either
+    max_events are collected or max_wait_ms passed since the first event. The events are moved to the processing
+    list, see acknowledge.
+    :return: list of raw (serialized) events, possibly empty
+    """
+    first = r_con.blmove(TRACE_EVENT_BUFFER, processing_list, idle_timeout, "LEFT", "RIGHT")
+    if first is None:
+        return []
+    batch = [first]
+    deadline = time.monotonic() + max_wait_ms / 1000
+    while len(batch) < max_events:
+        available = move_events(keys=[TRACE_EVENT_BUFFER, processing_list], args=[max_events - len(batch)], client=r_con)
+        if available:
+            batch.extend(available)
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        item = r_con.blmove(TRACE_EVENT_BUFFER, processing_list, remaining, "LEFT", "RIGHT")
+        if item is None:
+            break
+        batch.append(item)
+    return batch
+
+
+def acknowledge(r_con: Redis, processing_list, count):
+    """
+    Removes the first count events of the processing list, once they are committed (or dead-lettered)
+    """
+    r_con.ltrim(processing_list, count, -1)
+
+
+def publish(events, changed_tasks, metadata_data_list):
+    # the batch is committed already, a failure here must not persist it again
+    try:
+        crud.publish_trace_batch(events, changed_tasks, metadata_data_list)
+    except Exception:
+        logger.exception(f"Publishing the side effects of {len(events)} persisted events failed")
+
+
+def persist_one_by_one(r_con: Redis, processing_list, batch, events):
+    """
+    Fallback in case a batch fails: persist every event on its own, so a single malformed event does not block the
+    whole batch. Events which still fail are moved to the TRACE_EVENT_DEAD_LETTER list for inspection.
+    """
+    for raw_event, event in zip(batch, events):
+        try:
+            changed_tasks, metadata_data_list = crud.persist_trace_batch([event])
+        except Exception:
+            logger.exception(f"Persisting event for token {event[1]} failed, moving it to {TRACE_EVENT_DEAD_LETTER}")
+            r_con.rpush(TRACE_EVENT_DEAD_LETTER, raw_event)
+            acknowledge(r_con, processing_list, 1)
+            continue
+        acknowledge(r_con, processing_list, 1)
+        publish([event], changed_tasks, metadata_data_list)
+
+
+def consume(r_con: Redis, consumer_name=INGEST_CONSUMER_NAME):
+    processing_list = get_processing_list(consumer_name)
+    requeued = requeue_unacknowledged(r_con, processing_list)
+    if requeued > 0:
+        logger.warning(f"Requeued {requeued} unacknowledged events of consumer {consumer_name}")
+    while True:
+        batch = drain_batch(r_con, processing_list)
+        if len(batch) == 0:
+            continue
+        events = []
+        for raw_event in batch:
+            event = orjson.loads(raw_event)
+            events.append((event["event"], event["token_id"]))
+        started = time.monotonic()
+        try:
+            changed_tasks, metadata_data_list = crud.persist_trace_batch(events)
+        except Exception:
+            logger.exception(f"Persisting a batch of {len(batch)} events failed, persisting them one by one")
+            persist_one_by_one(r_con, processing_list, batch, events)
+            continue
+        acknowledge(r_con, processing_list, len(batch))
+        publish(events, changed_tasks, metadata_data_list)
+        logger.info(
+            f"Persisted {len(batch)} events ({len(metadata_data_list)} metadata, {len(changed_tasks)} traces) "
+            f"in {(time.monotonic() - started) * 1000:.1f} ms"
+        )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    consume(r_con)
@@ -0,0 +1,199 @@
+from redis import Redis
+from redis import asyncio as aioredis
+import os
+import asyncio
+import logging
+
+import orjson
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+
+LIVE_CHANNEL_PREFIX = "run_deltas:"
+LIVE_CLIENT_QUEUE_SIZE = int(os.environ.get('LIVE_CLIENT_QUEUE_SIZE', '100'))  # messages buffered per client
+LIVE_KEEPALIVE_SECONDS = float(os.environ.get('LIVE_KEEPALIVE_SECONDS', '15'))
+
+# task columns sent with every delta, in this order
+DELTA_TASK_COLUMNS = ['run_name', 'run_id', 'task_id', 'process', 'status', 'realtime', 'cpu_percentage', 'rss', 'memory']
+
+RESYNC_MESSAGE = orjson.dumps({"type": "resync"})
+KEEPALIVE_MESSAGE = orjson.dumps({"type": "keepalive"})
+
+r_con = Redis(host=REDIS_HOST, port=6379)
+
+logger = logging.getLogger('live')
+
+"""
+Live run state deltas
+The ingest publishes a compact delta for every persisted batch to the Redis channel of the token. Every API process
+holds a single pattern subscription and fans the deltas out to the WebSocket/SSE clients of the token, each of which
+has a bounded queue. A client which does not keep up gets its backlog dropped and a resync message instead, so it
+reloads /run/info once rather than slowing down the other clients or growing the memory of the API process.
+"""
+
+
+def get_channel(token_id):
+    return f"{LIVE_CHANNEL_PREFIX}{token_id}"
+
+
+def publish_task_deltas(changed_tasks):
+    """
+    Publishes the new state of the changed tasks, one message per token.
+    :param changed_tasks: rows returned by crud.trace_upsert_with_previous_status_statement
+    """
+    rows_by_token = {}
+    for task in changed_tasks:
+        rows_by_token.setdefault(task.token, []).append([getattr(task, column) for column in DELTA_TASK_COLUMNS])
+    if len(rows_by_token) == 0:
+        return
+    pipeline = r_con.pipeline(transaction=False)
+    for token_id, rows in rows_by_token.items():
+        pipeline.publish(get_channel(token_id), orjson.dumps({"type": "tasks", "columns": DELTA_TASK_COLUMNS, "rows": rows}))
+    pipeline.execute()
+
+
+def publish_run_events(metadata_data_list):
+    """
+    Publishes run level events (started, completed, ...) of persisted metadata.
+    :param metadata_data_list: metadata dicts as returned by crud.get_metadata_data
+    """
+    if len(metadata_data_list) == 0:
+        return
+    pipeline = r_con.pipeline(transaction=False)
+    for metadata_data in metadata_data_list:
+        pipeline.publish(get_channel(metadata_data["token"]), orjson.dumps({
+            "type": "run", "run_name": metadata_data["run_name"], "run_id": metadata_data["run_id"], "event": metadata_data["event"],
+        }))
+    pipeline.execute()
+
+
+class LiveHub:
+    """
+    Fans the deltas of the Redis channels out to the subscribed clients of this process.
+    """
+
+    def __init__(self, queue_size=LIVE_CLIENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.listener = None
+        self.dropped = 0
+
+    def ensure_listener(self):
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.get_running_loop().create_task(self.listen())
+
+    def subscribe(self, token_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(token_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, token_id, queue):
+        queues = self.subscribers.get(token_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if len(queues) == 0:
+            del self.subscribers[token_id]
+
+    def dispatch(self, token_id, message: bytes):
+        for queue in self.subscribers.get(token_id, ()):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # slow client: drop its backlog, it has to reload the run state anyway
+                self.dropped += queue.qsize()
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC_MESSAGE)
+
+    async def listen(self):
+        while True:
+            connection = aioredis.Redis(host=REDIS_HOST, port=6379)
+            try:
+                pubsub = connection.pubsub()
+                await pubsub.psubscribe(f"{LIVE_CHANNEL_PREFIX}*")
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    token_id = message["channel"].decode()[len(LIVE_CHANNEL_PREFIX):]
+                    self.dispatch(token_id, message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Live delta subscription failed, reconnecting")
+                # deltas may have been missed in between
+                for token_id in list(self.subscribers):
+                    self.dispatch(token_id, RESYNC_MESSAGE)
+                await asyncio.sleep(1)
+            finally:
+                await connection.aclose()
+
+    def get_metrics(self):
+        return {
+            "tokens": len(self.subscribers),
+            "clients": sum(len(queues) for queues in self.subscribers.values()),
+            "dropped_messages": self.dropped,
+        }
+
+
+hub = LiveHub()
+
+
+async def next_message(queue):
+    try:
+        return await asyncio.wait_for(queue.get(), timeout=LIVE_KEEPALIVE_SECONDS)
+    except asyncio.TimeoutError:
+        return KEEPALIVE_MESSAGE
+
+
+async def send_deltas(websocket, queue):
+    try:
+        while True:
+            message = await next_message(queue)
+            await websocket.send_text(message.decode())
+    except (OSError, RuntimeError) as error:
+        # the peer is gone: the server raises ClientDisconnected (an IOError) or refuses to send after the close
+        logger.debug(f"Live websocket send failed, treating it as disconnect: {error!r}")
+
+
+async def receive_until_disconnect(websocket):
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+async def serve_websocket(websocket, token_id):
+    """
+    Sends the deltas of a token to an accepted websocket until the client disconnects. The receiving side runs
+    next to the sender, so a close is noticed right away instead of at the next failing send.
+    """
+    hub.ensure_listener()
+    queue = hub.subscribe(token_id)
+    tasks = [
+        asyncio.ensure_future(send_deltas(websocket, queue)),
+        asyncio.ensure_future(receive_until_disconnect(websocket)),
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        hub.unsubscribe(token_id, queue)
+
+
+async def stream_events(request, token_id):
+    """
+    Server-sent events stream of the deltas of a token, ends once the client disconnected.
+    """
+    hub.ensure_listener()
+    queue = hub.subscribe(token_id)
+    try:
+        while not await request.is_disconnected():
+            message = await next_message(queue)
+            if message is KEEPALIVE_MESSAGE:
+                yield b": keepalive\n\n"
+            else:
+                yield b"data: " + message + b"\n\n"
+    finally:
+        hub.unsubscribe(token_id, queue)
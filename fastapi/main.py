@@ -1,32 +1,50 @@
 import json
 import os
+import logging
 from json import JSONDecodeError
+from datetime import datetime
 
 import asyncio
+import functools
+
+import anyio
+
+import orjson
 
 from redis import Redis
+from redis.exceptions import RedisError
 
 from rq import Queue
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
 
-from fastapi import Depends, FastAPI, Query, HTTPException, WebSocket, BackgroundTasks
+from fastapi import Depends, FastAPI, Query, HTTPException, WebSocket, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, JSONResponse, ORJSONResponse
+from fastapi.responses import Response, JSONResponse, ORJSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
 from fastapi.middleware.gzip import GZipMiddleware
 
 
-import crud, models, schemas, helpers
+import crud, models, schemas, helpers, ingest, cache, export, live
 
 
 from database import SessionLocal, engine
 
 REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+# push weblog events to the batching consumer (ingest.py) instead of enqueueing one rq job per event
+INGEST_BATCHING = os.environ.get('INGEST_BATCHING', 'true').lower() in ('1', 'true', 'yes')
+REMOVAL_JOB_TIMEOUT = int(os.environ.get('REMOVAL_JOB_TIMEOUT', '3600'))  # seconds
+HEAVY_REQUEST_CONCURRENCY = int(os.environ.get('HEAVY_REQUEST_CONCURRENCY', '4'))  # analysis, info, plots, listings
 
 app = FastAPI(
     title="TraceFlow",
 )
 
+logger = logging.getLogger('api')
+
 r_con = Redis(host=REDIS_HOST, port=6379)
 request_queue = Queue("request_queue", connection=r_con)
 calculation_queue = Queue("calculation_queue", connection=r_con)
@@ -53,6 +71,37 @@ def get_db():
         db.close()
 
 
+def heavy_request(endpoint):
+    """
+    Runs an expensive, blocking endpoint in the threadpool, at most HEAVY_REQUEST_CONCURRENCY of them at once.
+    Light endpoints are plain def endpoints, which FastAPI runs in the threadpool as well - so neither of them
+    blocks the event loop, and a burst of heavy requests cannot take all threads and pooled connections from
+    the ingest.
+    """
+    @functools.wraps(endpoint)
+    async def run_limited(*args, **kwargs):
+        global heavy_request_limiter
+        if heavy_request_limiter is None:
+            heavy_request_limiter = anyio.CapacityLimiter(HEAVY_REQUEST_CONCURRENCY)
+        return await anyio.to_thread.run_sync(functools.partial(endpoint, *args, **kwargs), limiter=heavy_request_limiter)
+    return run_limited
+
+heavy_request_limiter = None
+
+
+@app.on_event("startup")
+def restore_run_completion_flags():
+    # the completion check of POST /run/{token_id} only asks Redis, so flags lost with Redis data are set again
+    # best effort: the api has to come up even if Postgres or Redis are not reachable yet
+    db = SessionLocal()
+    try:
+        crud.restore_run_completion_flags(db)
+    except (SQLAlchemyError, RedisError):
+        logger.exception("Restoring the run completion flags failed")
+    finally:
+        db.close()
+
+
 @app.get("/")
 async def root():
     """
@@ -62,7 +111,7 @@ async def root():
     return {"message": "Hello World"}
 
 @app.get("/user/{user_id}/token/create")
-async def create_token_for_user(user_id: str, db: Session = Depends(get_db)):
+def create_token_for_user(user_id: str, db: Session = Depends(get_db)):
     """
     Creating a token for a user provided by his/her id.
 
@@ -85,7 +134,7 @@ async def create_token_for_user(user_id: str, db: Session = Depends(get_db)):
 
 
 @app.post("/user/token/add")
-async def add_token_to_user(add_token_item: models.UserTokenItem, db: Session = Depends(get_db)):
+def add_token_to_user(add_token_item: models.UserTokenItem, db: Session = Depends(get_db)):
     """
     Enables adding a token to a user, given both the user id and the token id is valid.
     :param add_token_item: The request body with user id and token id provided
@@ -115,7 +164,7 @@ async def add_token_to_user(add_token_item: models.UserTokenItem, db: Session =
 
 
 @app.delete("/user/{user_id}}/token/{token_id}")
-async def remove_token_from_user(user_id: str, token_id: str, db: Session = Depends(get_db)):
+def remove_token_from_user(user_id: str, token_id: str, db: Session = Depends(get_db)):
     """
     Removes a given token from a given user.
     :param user_id: The id of the user
@@ -147,7 +196,7 @@ async def remove_token_from_user(user_id: str, token_id: str, db: Session = Depe
 
 
 @app.get("/token/validate/{token_id}")
-async def validate_token(token_id: str, db: Session = Depends(get_db)):
+def validate_token(token_id: str, db: Session = Depends(get_db)):
     """
     Returns whether a given token is valid (exists in the database) or not
     :param token_id: The id of the token
@@ -157,35 +206,57 @@ async def validate_token(token_id: str, db: Session = Depends(get_db)):
     if not token_id:
         return JSONResponse(content={"error": "No token id provided"}, status_code=400)
     else:
-        token = crud.get_token(db, token_id)
-        if token is not None:
+        if crud.is_valid_token(db, token_id):
             return JSONResponse(content={"valid": True}, status_code=200)
         else:
             return JSONResponse(content={"valid": False}, status_code=200)
 
 
 @app.delete("/token/remove/{token_id}")
-async def remove_token(token_id: str, db: Session = Depends(get_db)):
+def remove_token(token_id: str, db: Session = Depends(get_db)):
     """
     Removing a token from the database. In case the token is associated with a user - it also gets removed from the
-    users token list
+    users token list. The removal runs as a queue job, its progress can be requested with the returned job id
+    at /token/remove/status/{job_id}
 
     :param token_id: the id of the token
     :param db: the database to send the request to
-    :return: json-response with removal result or error message
+    :return: json-response with the job id of the removal or error message
     """
     if not token_id:
         return JSONResponse(content={"error": "No token id provided"}, status_code=400)
     else:
         token = crud.get_token(db, token_id)
         if token:
-            result = crud.remove_token_and_connected_information(db, token)
-            return JSONResponse(content=result, status_code=200)
+            # stop accepting data for the token right away, the removal job invalidates it again once done
+            cache.invalidate_token(token_id)
+            job_instance = request_queue.enqueue(crud.remove_token_and_connected_information, token_id, job_timeout=REMOVAL_JOB_TIMEOUT)
+            return JSONResponse(content={"token": token_id, "job_id": job_instance.id}, status_code=202)
         else:
             return JSONResponse(content={"error": "No such token"}, status_code=404)
 
+
+@app.get("/token/remove/status/{job_id}")
+def remove_token_status(job_id: str):
+    """
+    Reports the state of a token removal started by DELETE /token/remove/{token_id}
+    :param job_id: the job id returned when the removal was started
+    :return: json-response with job status, progress, deleted row counts or error message
+    """
+    try:
+        job_instance = Job.fetch(job_id, connection=r_con)
+    except NoSuchJobError:
+        return JSONResponse(content={"error": "No such job"}, status_code=404)
+    content = {
+        "job_id": job_id,
+        "status": job_instance.get_status(),
+        "progress": job_instance.meta.get("progress", None),
+        "result": job_instance.result,
+    }
+    return JSONResponse(content=content, status_code=200)
+
 @app.delete("/user/{user_id}/remove/token/all/")
-async def remove_user_tokens(user_id: str, db: Session = Depends(get_db)):
+def remove_user_tokens(user_id: str, db: Session = Depends(get_db)):
     """
     Removes all tokens for a given user.
     :param user_id: the id of the user to remove all tokens from
@@ -202,7 +273,7 @@ async def remove_user_tokens(user_id: str, db: Session = Depends(get_db)):
 
 
 @app.get("/token/create/")
-async def create_token(db: Session = Depends(get_db)):
+def create_token(db: Session = Depends(get_db)):
     """
     Creates a token, which is not linked to a user in this step.
     :param db: the database to send the request to
@@ -213,7 +284,7 @@ async def create_token(db: Session = Depends(get_db)):
 
 
 @app.get("/user/{user_id}")
-async def get_user_information(user_id: str, db: Session = Depends(get_db)):
+def get_user_information(user_id: str, db: Session = Depends(get_db)):
     """
     Returns user information for user given by id
     :param user_id: the user id
@@ -231,7 +302,7 @@ async def get_user_information(user_id: str, db: Session = Depends(get_db)):
 
 
 @app.post("/user/create")
-async def create_user(add_user_item: models.AddUserItem, db: Session = Depends(get_db)):
+def create_user(add_user_item: models.AddUserItem, db: Session = Depends(get_db)):
     """
     Creates a new user with a name provided
     :param add_user_item: The request body consisting of the name value
@@ -246,14 +317,14 @@ async def create_user(add_user_item: models.AddUserItem, db: Session = Depends(g
 
 
 @app.delete("/run/{token_id}")
-async def remove_run_information_for_token(token_id: str, db: Session = Depends(get_db)):
+def remove_run_information_for_token(token_id: str, db: Session = Depends(get_db)):
     pass
     """
     TODO: implement
     """
 
 @app.post("/run/{token_id}")
-async def persist_run_for_token(token_id: str, json_ob: dict, db: Session = Depends(get_db)):
+def persist_run_for_token(token_id: str, json_ob: dict, db: Session = Depends(get_db)):
     """
     Endpoint for persistence of run information. Users do use this endpoint when executing
     their workflows.
@@ -261,16 +332,17 @@ async def persist_run_for_token(token_id: str, json_ob: dict, db: Session = Depe
     :param json_ob: The request json object including e.g. the trace
     :param db: The database to persist the information in
     :return: Response state
-    # # # TODO: adjust checking to be part of the persistence function --> give it to the worker instead of doing it with main component
     """
     if not token_id:
         return Response(status_code=404)
-    token = crud.get_token(db, token_id)
-    if token:
+    if crud.is_valid_token(db, token_id):
         
-        if crud.check_for_workflow_completed(db, json_ob, token_id):
+        if crud.check_for_workflow_completed(json_ob, token_id):
             return Response(status_code=400)
-        job_instance = request_queue.enqueue(crud.persist_trace_async, json_ob, token_id)
+        if INGEST_BATCHING:
+            ingest.push_event(r_con, json_ob, token_id)
+            return Response(status_code=204)
+        job_instance = request_queue.enqueue(crud.persist_trace_job, json_ob, token_id)
         # what to do with the job instance?
         #second_job_instance = calculation_queue()
 
@@ -280,14 +352,45 @@ async def persist_run_for_token(token_id: str, json_ob: dict, db: Session = Depe
     
 
 @app.post("/run/analysis/{token_id}/")
-async def get_run_analysis(token_id: str, threshold_params: dict = None, db: Session = Depends(get_db), response_class=ORJSONResponse):
-    result_by_task = crud.get_task_states_by_token(db, token_id)
-    result_by_run_name = helpers.group_by_run_name(result_by_task)
-    result_analysis = helpers.analyze(db, result_by_run_name, threshold_params)
-    return ORJSONResponse(result_analysis, status_code=200)
+@heavy_request
+def get_run_analysis(token_id: str, threshold_params: dict = None, run_name: str = None, task_information: bool = False, db: Session = Depends(get_db), response_class=ORJSONResponse):
+    """
+    Returns the analysis for all runs of a token, or only for the run given by run_name. Results are cached until
+    new data is persisted for the token.
+    :param token_id: The id of the run-token
+    :param threshold_params: the threshold parameters
+    :param run_name: optional name of the run to analyze
+    :param task_information: whether to include the scores of every task, which reads all traces of the runs
+    instead of the process aggregates
+    :param db:
+    :return: analysis result
+    """
+    cache_key, cached_analysis = cache.get_cached_analysis(token_id, run_name, threshold_params, task_information)
+    if cached_analysis is not None:
+        return Response(content=cached_analysis, media_type="application/json", status_code=200)
+    if task_information:
+        result_by_task = crud.get_task_scoring_rows_by_token(db, token_id, run_name)
+        result_analysis = helpers.analyze(db, helpers.group_by_run_name(result_by_task), threshold_params)
+    else:
+        process_aggregates = crud.get_process_aggregates_by_token(db, token_id, run_name)
+        top_tasks = crud.get_top_task_rows_by_token(db, token_id, list(process_aggregates))
+        result_analysis = helpers.analyze_process_aggregates(process_aggregates, top_tasks, threshold_params)
+    payload = orjson.dumps(result_analysis, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    cache.set_cached_analysis(cache_key, payload)
+    return Response(content=payload, media_type="application/json", status_code=200)
+
+
+@app.get("/metrics/")
+def get_metrics():
+    """
+    Returns cache metrics (hits, misses and hit rate of the analysis cache over all processes and of the token cache
+    of this process) and the live subscriptions of this process
+    :return: json-response with the metrics
+    """
+    return JSONResponse(content={**cache.get_cache_metrics(), "live": live.hub.get_metrics()}, status_code=200)
 
 @app.post("/test/redis")
-async def test_redis(json_b: dict):
+def test_redis(json_b: dict):
     job_instance = request_queue.enqueue(print, json_b)
     return {
         "id": job_instance.id
@@ -303,63 +406,224 @@ async def test_redis(json_b: dict):
     
 """
 
-@app.get("/run/ram_plot/{token_id}")
-async def get_ram_plot_data(token_id: str, processFilter, tagFilter, runName, db: Session = Depends(get_db), response_class=ORJSONResponse):
+def get_boxplot_response(db: Session, token_id: str, metric: str, processFilter, tagFilter, runName):
     if not token_id:
         return ORJSONResponse({"error": "No token provided"}, status_code=400)
-    token = crud.get_token(db, token_id)
-    if not token:
+    if not crud.is_valid_token(db, token_id):
         return ORJSONResponse({"error": "No such token"}, status_code=404)
 
     process_filter = json.loads(processFilter)
     tag_filter = json.loads(tagFilter)
     run_name = json.loads(runName)
-    filtered_ram_plot_results = crud.get_filtered_ram_plot_results(db, token_id, run_name,process_filter, tag_filter)
-    
-    return ORJSONResponse(content=jsonable_encoder(filtered_ram_plot_results), status_code=200)
-    
+    filtered_boxplot_results = crud.get_filtered_boxplot_results(db, token_id, run_name, metric, process_filter, tag_filter)
+
+    return ORJSONResponse(content=filtered_boxplot_results, status_code=200)
+
+
+@app.get("/run/ram_plot/{token_id}")
+@heavy_request
+def get_ram_plot_data(token_id: str, processFilter, tagFilter, runName, db: Session = Depends(get_db), response_class=ORJSONResponse):
+    """
+    Boxplot values of the memory allocation (rss in % of the requested memory) per process
+    """
+    return get_boxplot_response(db, token_id, "ram", processFilter, tagFilter, runName)
+
+
+@app.get("/run/cpu_plot/{token_id}")
+@heavy_request
+def get_cpu_plot_data(token_id: str, processFilter, tagFilter, runName, db: Session = Depends(get_db), response_class=ORJSONResponse):
+    """
+    Boxplot values of the cpu allocation (%cpu per requested cpu) per process
+    """
+    return get_boxplot_response(db, token_id, "cpu", processFilter, tagFilter, runName)
+
+
+@app.get("/run/duration_plot/{token_id}")
+@heavy_request
+def get_duration_plot_data(token_id: str, processFilter, tagFilter, runName, db: Session = Depends(get_db), response_class=ORJSONResponse):
+    """
+    Boxplot values of the task duration (realtime in ms) per process
+    """
+    return get_boxplot_response(db, token_id, "duration", processFilter, tagFilter, runName)
+
+
+@app.get("/run/io_plot/{token_id}")
+@heavy_request
+def get_io_plot_data(token_id: str, processFilter, tagFilter, runName, db: Session = Depends(get_db), response_class=ORJSONResponse):
+    """
+    Boxplot values of the bytes read and written by a task (read_bytes + write_bytes) per process
+    """
+    return get_boxplot_response(db, token_id, "io", processFilter, tagFilter, runName)
+
+
+@app.get("/run/stat_history/{token_id}/")
+def get_stat_history(token_id: str, run_name: str = None, db: Session = Depends(get_db)):
+    """
+    Downsampled history of the run stats (task counts and load over time), e.g. for throughput plots.
+    See STAT_HISTORY_INTERVAL in crud.py.
+    :param token_id: The id of the run-token
+    :param run_name: only the history of this run
+    :param db:
+    :return: history rows ordered by run and time
+    """
+    if not crud.is_valid_token(db, token_id):
+        return ORJSONResponse({"error": "No such token"}, status_code=404)
+    return ORJSONResponse(content=crud.get_stat_history_rows(db, token_id, run_name), status_code=200)
+
+
+def split_parameter(value: str):
+    """
+    Splits a comma separated query parameter
+    :return: list of the non-empty values, None if the parameter was not given
+    """
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
 
 
 @app.get("/run/info/{token_id}/")
-async def get_run_information(token_id: str, db: Session = Depends(get_db), response_class=ORJSONResponse):
+@heavy_request
+def get_run_information(token_id: str, run_name: str = None, process: str = None, tag: str = None, status: str = None,
+                              since: datetime = None, until: datetime = None, fields: str = None,
+                              db: Session = Depends(get_db), response_class=ORJSONResponse):
     """
-    Returns all information persisted for a certain token.
+    Returns all information persisted for a certain token. Traces can be filtered and projected, all filters are
+    applied in the database.
     :param token_id: The id of the run-token
-    :param threshold_params: the threshold parameters
+    :param run_name: only information of this run
+    :param process: comma separated process names, only traces and processes of these
+    :param tag: comma separated tags, only traces with these tags
+    :param status: comma separated states, only traces in these states
+    :param since: only traces submitted at or after this time
+    :param until: only traces submitted before this time
+    :param fields: comma separated list of trace fields to return, all fields but the script if not given
     :param db:
-    :return: information on run with token
+    :return: information on run with token, stats and processes being the current snapshot of every run
     """
     if not token_id:
         return ORJSONResponse({"error": "No token provided"}, status_code=400)
-    token = crud.get_token(db, token_id)
-    if not token:
+    fields = split_parameter(fields)
+    if fields is not None:
+        unknown_fields = [field for field in fields if field not in crud.SELECTABLE_TRACE_COLUMNS]
+        if len(fields) == 0 or len(unknown_fields) > 0:
+            return ORJSONResponse({"error": f"Unknown fields: {', '.join(unknown_fields)}"}, status_code=400)
+    if not crud.is_valid_token(db, token_id):
         return ORJSONResponse({"error": "No such token"}, status_code=404)
-    meta = sorted(crud.get_meta_by_token(db, token_id), key=lambda obj: obj.timestamp)
+    processes = split_parameter(process)
+    meta = crud.get_meta_rows_by_token(db, token_id, run_name)
     result_meta = meta if len(meta) > 0 else {}
-    result_by_task = crud.get_task_states_by_token(db, token_id)
-    result_by_run_name = helpers.group_by_run_name(result_by_task)
-    result_stat = crud.get_stats_by_token(db, token_id)
-    result_meta_processes = crud.get_process_by_token(db, token_id)
+    result_by_run_name = crud.get_task_rows_by_run_name(
+        db, token_id, run_name, processes, split_parameter(tag), split_parameter(status), since, until, fields,
+    )
+    result_stat = crud.get_stat_rows_by_token(db, token_id, run_name)
+    result_meta_processes = crud.get_process_rows_by_token(db, token_id, run_name, processes)
     result = {
         "result_meta": result_meta,
         "result_by_run_name": result_by_run_name,
         "result_stat": result_stat,
         "result_meta_processes": result_meta_processes,
     }
-    return JSONResponse(content=jsonable_encoder(result), status_code=200)
+    return ORJSONResponse(content=result, status_code=200)
 """
 """
 
-"""
-@app.websocket("/run/{token}")
-async def websocket_test(websocket: WebSocket):
+@app.get("/run/export/{token_id}/")
+def export_run_traces(token_id: str, format: str = "ndjson", fields: str = None, run_name: str = None, process: str = None, db: Session = Depends(get_db)):
+    """
+    Streams the traces of a token, either as newline delimited json (one trace per line) or as one json array.
+    The traces are read chunk-wise from the database, so memory stays flat regardless of the run size.
+    :param token_id: The id of the run-token
+    :param format: "ndjson" (default) or "json"
+    :param fields: comma separated list of trace fields to export, all fields but the script if not given
+    :param run_name: only export traces of this run
+    :param process: only export traces of this process
+    :param db:
+    :return: streamed traces or error message
+    """
+    if not token_id:
+        return ORJSONResponse({"error": "No token provided"}, status_code=400)
+    if format not in ["ndjson", "json"]:
+        return ORJSONResponse({"error": "Unknown format, use ndjson or json"}, status_code=400)
+    columns = crud.TRACE_COLUMNS
+    if fields is not None:
+        columns = split_parameter(fields)
+        unknown_fields = [field for field in columns if field not in crud.SELECTABLE_TRACE_COLUMNS]
+        if len(columns) == 0 or len(unknown_fields) > 0:
+            return ORJSONResponse({"error": f"Unknown fields: {', '.join(unknown_fields)}"}, status_code=400)
+    if not crud.is_valid_token(db, token_id):
+        return ORJSONResponse({"error": "No such token"}, status_code=404)
+
+    rows = crud.stream_run_trace_rows(token_id, columns, run_name, process)
+    if format == "ndjson":
+        return StreamingResponse(helpers.stream_ndjson(rows, columns), media_type="application/x-ndjson")
+    return StreamingResponse(helpers.stream_json_array(rows, columns), media_type="application/json")
+
+@app.get("/run/export/{token_id}/columnar/")
+def export_run_columnar(token_id: str, format: str = "arrow", table: str = "run_metric", run_name: str = None, db: Session = Depends(get_db)):
+    """
+    Exports the rows of a token as Arrow IPC stream or Parquet file, built batch-wise from a server-side cursor.
+    :param token_id: The id of the run-token
+    :param format: "arrow" (default) or "parquet"
+    :param table: "run_metric" (default), "run_metadata", "stat" or "process"
+    :param run_name: only export rows of this run
+    :param db:
+    :return: streamed export or error message
+    """
+    if format not in export.EXPORT_FORMATS:
+        return ORJSONResponse({"error": f"Unknown format, use {' or '.join(export.EXPORT_FORMATS)}"}, status_code=400)
+    if table not in crud.EXPORT_TABLES:
+        return ORJSONResponse({"error": f"Unknown table, use one of {', '.join(crud.EXPORT_TABLES)}"}, status_code=400)
+    if not export.is_available():
+        return ORJSONResponse({"error": "Columnar export requires pyarrow"}, status_code=501)
+    if not crud.is_valid_token(db, token_id):
+        return ORJSONResponse({"error": "No such token"}, status_code=404)
+
+    chunks = crud.stream_export_chunks(table, token_id, run_name)
+    filename = f"{token_id}_{table}.{format}"
+    return StreamingResponse(export.stream_export(table, format, chunks), media_type=export.EXPORT_FORMATS[format],
+                             headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+def is_known_token(token_id: str):
+    """
+    Token check with a short-lived session, for long-living connections which must not hold a pooled connection.
+    Known tokens are answered by the token cache without opening a connection at all.
+    """
+    db = SessionLocal()
+    try:
+        return crud.is_valid_token(db, token_id)
+    finally:
+        db.close()
+
+
+@app.websocket("/run/live/{token_id}")
+async def live_run_websocket(websocket: WebSocket, token_id: str):
+    """
+    Pushes the state deltas of a token as they are persisted, see live.py. Messages are json objects of type
+    "tasks" (columns and rows of changed tasks), "run" (run events), "resync" (deltas were dropped, reload the run
+    information) or "keepalive".
+    :param token_id: The id of the run-token
+    """
+    if not await run_in_threadpool(is_known_token, token_id):
+        await websocket.close(code=1008)
+        return
     await websocket.accept()
-    await websocket.send_text("Test")
-"""
+    await live.serve_websocket(websocket, token_id)
+
+
+@app.get("/run/live/{token_id}/sse")
+async def live_run_events(token_id: str, request: Request):
+    """
+    Server-sent events variant of the live websocket, same messages
+    :param token_id: The id of the run-token
+    """
+    if not await run_in_threadpool(is_known_token, token_id):
+        return ORJSONResponse({"error": "No such token"}, status_code=404)
+    return StreamingResponse(live.stream_events(request, token_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
         
 
 @app.get("/test/token/")
-async def get_all_tokens(db: Session = Depends(get_db)):
+def get_all_tokens(db: Session = Depends(get_db)):
     """
     Shows all tokens - this test function is about to be removed
     :param db:
@@ -368,7 +632,7 @@ async def get_all_tokens(db: Session = Depends(get_db)):
     return crud.get_all_token(db)
 
 @app.get("/test/users/")
-async def get_all_users(db: Session = Depends(get_db)):
+def get_all_users(db: Session = Depends(get_db)):
     """
     Shows all users - this test function os about to be removed
     :param db:
@@ -376,44 +640,83 @@ async def get_all_users(db: Session = Depends(get_db)):
     """
     return crud.get_all_users(db)
 
+def get_page_response(get_page, db: Session, token_id, limit: int, after: str):
+    """
+    Keyset paginated listing, see crud.get_page. Listings without a limit keep returning the full result.
+    :param get_page: one of crud.get_trace_page, get_meta_page, get_stat_page, get_process_page
+    :param token_id: the token id, None for all tokens
+    :param limit: page size
+    :param after: cursor returned as "next" with the previous page
+    :return: json-response with items, next cursor and estimated total
+    """
+    try:
+        page = get_page(db, token_id, limit, after)
+    except ValueError as error:
+        return ORJSONResponse({"error": str(error)}, status_code=400)
+    return ORJSONResponse(content=page, status_code=200)
+
 @app.get("/test/trace/all/")
-async def get_full_trace(db: Session = Depends(get_db)):
+@heavy_request
+def get_full_trace(limit: int = None, after: str = None, db: Session = Depends(get_db)):
+    if limit is not None:
+        return get_page_response(crud.get_trace_page, db, None, limit, after)
     return crud.get_full_trace(db)
 
 @app.get("/test/meta/all/")
-async def get_full_meta(db: Session = Depends(get_db)):
+@heavy_request
+def get_full_meta(limit: int = None, after: str = None, db: Session = Depends(get_db)):
+    if limit is not None:
+        return get_page_response(crud.get_meta_page, db, None, limit, after)
     return crud.get_full_meta(db)
 
 @app.get("/test/stats/all/")
-async def get_full_stats(db: Session = Depends(get_db)):
+@heavy_request
+def get_full_stats(limit: int = None, after: str = None, db: Session = Depends(get_db)):
+    if limit is not None:
+        return get_page_response(crud.get_stat_page, db, None, limit, after)
     return crud.get_full_stats(db)
 
 @app.get("/test/stats/{token_id}/")
-async def get_stats_by_token(token_id: str, db: Session = Depends(get_db)):
+@heavy_request
+def get_stats_by_token(token_id: str, limit: int = None, after: str = None, db: Session = Depends(get_db)):
+    if limit is not None:
+        return get_page_response(crud.get_stat_page, db, token_id, limit, after)
     return crud.get_stats_by_token(db, token_id)
 
 @app.get("/test/meta/{token_id}/")
-async def get_meta_by_token(token_id: str, db: Session = Depends(get_db)):
+@heavy_request
+def get_meta_by_token(token_id: str, limit: int = None, after: str = None, db: Session = Depends(get_db)):
+    if limit is not None:
+        return get_page_response(crud.get_meta_page, db, token_id, limit, after)
     return crud.get_meta_by_token(db, token_id)
 
 @app.get("/test/process/all/")
-async def get_processes_full(db: Session = Depends(get_db)):
+@heavy_request
+def get_processes_full(limit: int = None, after: str = None, db: Session = Depends(get_db)):
+    if limit is not None:
+        return get_page_response(crud.get_process_page, db, None, limit, after)
     return crud.get_full_processes(db)
 
 @app.get("/test/process/{token_id}/")
-async def get_process_by_token(token_id: str, db: Session = Depends(get_db)):
+@heavy_request
+def get_process_by_token(token_id: str, limit: int = None, after: str = None, db: Session = Depends(get_db)):
+    if limit is not None:
+        return get_page_response(crud.get_process_page, db, token_id, limit, after)
     return crud.get_process_by_token(db, token_id)
 
 @app.get("/test/trace/{token_id}/")
-async def get_trace_by_token(token_id: str, db: Session = Depends(get_db)):
+@heavy_request
+def get_trace_by_token(token_id: str, limit: int = None, after: str = None, db: Session = Depends(get_db)):
+    if limit is not None:
+        return get_page_response(crud.get_trace_page, db, token_id, limit, after)
     return crud.get_run_trace_by_token(db, token_id)
 
 @app.get("/test/trace/running/{token_id}/")
-async def adjust_trace_to_running(token_id: str, db: Session = Depends(get_db)):
+def adjust_trace_to_running(token_id: str, db: Session = Depends(get_db)):
     return crud.set_all_tasks_running(db, token_id)
 
 @app.post("/test/run/{token_id}/")
-async def read_nextflow_run(token_id: str, push: dict):
+def read_nextflow_run(token_id: str, push: dict):
     z = []
     try:
         with open(f"trace-{token_id}.json", "r+") as current:        
@@ -427,7 +730,7 @@ async def read_nextflow_run(token_id: str, push: dict):
         json_file.close()
 
 @app.post("/test/tower/{token_id}/{whatever}")
-async def read_nextflow_tower_run(token_id: str, push: dict):
+def read_nextflow_tower_run(token_id: str, push: dict):
     z = []
     try:
         with open(f"trace-tower-{token_id}.json", "r+") as current:
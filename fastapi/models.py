@@ -1,9 +1,9 @@
 import datetime
 from typing import List
-from sqlalchemy import Column, String, DateTime, Integer, Float, ForeignKey, Boolean, BigInteger
+from sqlalchemy import Column, String, DateTime, Integer, Float, ForeignKey, Boolean, BigInteger, UniqueConstraint, Index, func, select, case, cast, and_, or_
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.mutable import MutableList
-from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship
+from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship, column_property
 
 from pydantic import BaseModel
 
@@ -29,6 +29,9 @@ Database models
 """
 class User(Base):
     __tablename__ = "user"
+    __table_args__ = (
+        Index("ix_user_run_tokens", "run_tokens", postgresql_using="gin"),
+    )
 
     id = Column(String, primary_key=True)
     name = Column(String)
@@ -40,13 +43,27 @@ class RunToken(Base):
     id = Column(String, primary_key=True)
 
 
+class TaskScript(Base):
+    __tablename__ = "task_script"
+    # content-addressed task scripts, stored once and referenced by RunTrace.script_hash
+    hash = Column(String, primary_key=True) # sha256 hex digest of the script, see helpers.get_script_hash
+    script = Column(String, nullable=False)
+
+
 class RunTrace(Base):
     __tablename__ = "run_metric"
+    # one row per task, holding its newest state - see crud.trace_upsert_statement
+    # TimescaleDB hypertable partitioned on submit (and token), so submit is part of every unique key and the primary
+    # key in the database is (id, token, submit) - see alembic revision c5e8a3f1b604
+    __table_args__ = (
+        UniqueConstraint("token", "run_id", "task_id", "submit", name="uq_run_metric_task", postgresql_nulls_not_distinct=True),
+        Index("ix_run_metric_token_run_name_process", "token", "run_name", "process"),
+    )
     id = Column(Integer, primary_key=True)
     run_id = Column(String, nullable=True) # runId
     token = Column(String, nullable=False)
     run_name = Column(String)
-    submit = Column(DateTime, nullable=True)
+    submit = Column(DateTime, nullable=False)
     start = Column(DateTime, nullable=True)
     complete = Column(DateTime, nullable=True)
     # hash = Column(String, nullable=True)
@@ -60,7 +77,11 @@ class RunTrace(Base):
     duration = Column(BigInteger, nullable=True)
     name = Column(String, nullable=True)
     attempt = Column(Integer, nullable=True) # trace:attempt
-    script = Column(String, nullable=True) # trace:script
+    script_hash = Column(String, nullable=True) # hash of trace:script, see TaskScript
+    # deferred, so loading traces does not resolve the script unless it is accessed or selected explicitly
+    script = column_property(
+        select(TaskScript.script).where(TaskScript.hash == script_hash).scalar_subquery(), deferred=True,
+    )
     time = Column(BigInteger, nullable=True) #trace:time
     realtime = Column(BigInteger, nullable=True) # trace:realtime
     cpu_percentage = Column(Float(4), nullable=True) # trace:%cpu
@@ -81,16 +102,48 @@ class RunTrace(Base):
     scratch = Column(String, nullable=True) # scratch
 
 
+# keyset pagination order of traces, see crud.get_trace_page
+Index(
+    "ix_run_metric_token_run_name_task",
+    RunTrace.token, func.coalesce(RunTrace.run_name, ""), func.coalesce(RunTrace.task_id, -1), RunTrace.id,
+)
+
+# tasks not in a terminal state yet, added to the process aggregates by crud.get_process_aggregates_by_token
+UNFINISHED_TASK_CONDITION = or_(RunTrace.status.is_(None), RunTrace.status.not_in(["ABORTED", "FAILED", "COMPLETED"]))
+Index("ix_run_metric_token_run_name_unfinished", RunTrace.token, RunTrace.run_name, postgresql_where=UNFINISHED_TASK_CONDITION)
+
+# sort keys of the worst task lists of the analysis (the task values of helpers.calculate_raw_scores_per_task, -1 if
+# missing or zero), indexed per run so crud.get_top_task_rows_by_token reads only the top rows
+TOP_TASK_KEYS = {
+    "realtime": func.coalesce(func.nullif(RunTrace.realtime, 0), -1),
+    "raw_cpu_penalty": func.coalesce(func.nullif(case(
+        (and_(RunTrace.status.is_distinct_from("FAILED"), RunTrace.cpus > 0, RunTrace.cpu_percentage != 0),
+         func.abs(1 - cast(RunTrace.cpu_percentage, Float(53)) / cast(RunTrace.cpus, Float(53)) / 100.0)),
+    ), 0), -1),
+    "raw_memory_penalty": func.coalesce(func.nullif(case(
+        (and_(RunTrace.status.is_distinct_from("FAILED"), RunTrace.memory > 0, RunTrace.rss != 0),
+         func.abs(1 - cast(RunTrace.rss, Float(53)) / cast(RunTrace.memory, Float(53)))),
+    ), 0), -1),
+}
+for key, sort_key in TOP_TASK_KEYS.items():
+    Index(f"ix_run_metric_token_run_name_top_{key}", RunTrace.token, RunTrace.run_name, sort_key)
+
 
 # metadata:workflow:stats
 class Stat(Base):
     __tablename__ = "stat"
+    # current snapshot of a run, updated in place by every newer metadata event - see crud.persist_run_snapshot
+    __table_args__ = (
+        UniqueConstraint("token", "run_id", name="uq_stat_run", postgresql_nulls_not_distinct=True),
+    )
+    token = Column(String, nullable=True)
+    run_id = Column(String, nullable=True) # runId
     succeeded_count = Column(Integer, nullable=True) # succeededCount
     compute_time_fmt = Column(String, nullable=True) #computeTimeFmt
     cached_count = Column(Integer, nullable=True) # cachedCount
     id: Mapped[int] = mapped_column(primary_key=True)
     processes: Mapped[List["Process"]] = relationship() #processes
-    parent_id: Mapped[int] = mapped_column(ForeignKey("run_metadata.id"))
+    parent_id: Mapped[int] = mapped_column(ForeignKey("run_metadata.id"), index=True)
     peak_running = Column(Integer, nullable=True) #peakRunning
     succeeded_duration = Column(BigInteger, nullable=True) # succeededDuration
     cached_pct = Column(Float(4), nullable=True) # cachedPct
@@ -121,8 +174,11 @@ class Stat(Base):
 # metadata:workflow:stats:processes
 class Process(Base):
     __tablename__ = "process"
+    __table_args__ = (
+        UniqueConstraint("parent_id", "name", name="uq_process_stat_name", postgresql_nulls_not_distinct=True),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
-    parent_id: Mapped[int] = mapped_column(ForeignKey("stat.id"))
+    parent_id: Mapped[int] = mapped_column(ForeignKey("stat.id"), index=True)
     index = Column(Integer, nullable=True) #index
     pending = Column(Integer, nullable=True) #pending
     ignored = Column(Integer, nullable=True) #ignored
@@ -148,8 +204,37 @@ class Process(Base):
     submitted = Column(Integer, nullable=True) # submitted
 
 
+# downsampled history of the run stats, e.g. for throughput plots - see crud.stat_history_insert_statement
+class StatHistory(Base):
+    __tablename__ = "stat_history"
+    __table_args__ = (
+        Index("ix_stat_history_token_run_id_recorded_at", "token", "run_id", "recorded_at"),
+    )
+    id = Column(Integer, primary_key=True)
+    token = Column(String, nullable=False)
+    run_id = Column(String, nullable=True)
+    run_name = Column(String, nullable=True)
+    event = Column(String, nullable=True)
+    recorded_at = Column(DateTime, nullable=False) # timestamp of the metadata event
+    submitted_count = Column(Integer, nullable=True)
+    pending_count = Column(Integer, nullable=True)
+    running_count = Column(Integer, nullable=True)
+    succeeded_count = Column(Integer, nullable=True)
+    failed_count = Column(Integer, nullable=True)
+    cached_count = Column(Integer, nullable=True)
+    aborted_count = Column(Integer, nullable=True)
+    ignored_count = Column(Integer, nullable=True)
+    retries_count = Column(Integer, nullable=True)
+    load_cpus = Column(Integer, nullable=True)
+    load_memory = Column(BigInteger, nullable=True)
+    peak_running = Column(Integer, nullable=True)
+
+
 class RunMetadata(Base):
     __tablename__ = "run_metadata"
+    __table_args__ = (
+        Index("ix_run_metadata_token_run_id", "token", "run_id"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     run_id = Column(String, nullable=True) # runId
     stats: Mapped[List["Stat"]] = relationship()
@@ -169,4 +254,82 @@ class RunMetadata(Base):
     revision = Column(String, nullable=True) #metadata:workflow:revision
     work_dir = Column(String, nullable=True) #metadata:workflow:workDir
     user_name = Column(String, nullable=True) #metadata:workflow:userName
- 
\ No newline at end of file
+ 
+
+# incrementally maintained per process aggregates of the tasks in a terminal state, see helpers.get_process_aggregate_deltas
+class ProcessAggregate(Base):
+    __tablename__ = "process_aggregate"
+    __table_args__ = (
+        UniqueConstraint("token", "run_name", "process", name="uq_process_aggregate_process", postgresql_nulls_not_distinct=True),
+    )
+    id = Column(Integer, primary_key=True)
+    token = Column(String, nullable=False)
+    run_name = Column(String, nullable=True)
+    process = Column(String, nullable=True)
+    task_count = Column(Integer, default=0) # all tasks seen
+    terminal_count = Column(Integer, default=0) # tasks in a terminal state, the metrics below are summed over those
+    realtime_sum = Column(BigInteger, default=0)
+    realtime_count = Column(Integer, default=0)
+    cpu_penalty_sum = Column(Float, default=0)
+    cpu_penalty_count = Column(Integer, default=0) # tasks with a cpu allocation
+    memory_penalty_sum = Column(Float, default=0)
+    memory_penalty_count = Column(Integer, default=0) # tasks with a memory allocation
+    scored_cpu_allocation_sum = Column(Float, default=0) # over the cpu_penalty_count tasks
+    scored_memory_allocation_sum = Column(Float, default=0) # over the memory_penalty_count tasks
+    rss_ratio_sum = Column(Float, default=0) # rss / vmem
+    rss_ratio_count = Column(Integer, default=0)
+    relation_count = Column(Integer, default=0) # tasks with both cpu and memory allocation
+    cpu_allocation_sum = Column(Float, default=0)
+    cpu_allocation_min = Column(Float, nullable=True)
+    cpu_allocation_max = Column(Float, nullable=True)
+    memory_allocation_sum = Column(Float, default=0)
+    memory_allocation_min = Column(Float, nullable=True)
+    memory_allocation_max = Column(Float, nullable=True)
+    cpus_requested_sum = Column(BigInteger, default=0)
+    cpus_requested_count = Column(Integer, default=0)
+    memory_requested_sum = Column(BigInteger, default=0)
+    memory_requested_count = Column(Integer, default=0)
+    cpus_used_sum = Column(Float, default=0) # %cpu / 100
+    cpus_used_count = Column(Integer, default=0)
+    rss_sum = Column(BigInteger, default=0)
+    rss_count = Column(Integer, default=0)
+    score_count = Column(Integer, default=0) # tasks contributing to the weighted score, see helpers.get_aggregated_score
+    cpu_score_sum = Column(Float, default=0)
+    memory_score_sum = Column(Float, default=0)
+    cpu_score_weight_sum = Column(Float, default=0)
+    memory_score_weight_sum = Column(Float, default=0)
+    max_cpus = Column(Integer, nullable=True) # cpu limit of the process problems
+    max_available_memory = Column(Float, nullable=True) # memory limit of the process problems, estimated from rss and %mem
+
+
+# change counter of a run, bumped in the transaction of every trace upsert of the run - see crud.run_version_upsert_statement
+class RunVersion(Base):
+    __tablename__ = "run_version"
+    __table_args__ = (
+        UniqueConstraint("token", "run_name", name="uq_run_version_run", postgresql_nulls_not_distinct=True),
+    )
+    id = Column(Integer, primary_key=True)
+    token = Column(String, nullable=False)
+    run_name = Column(String, nullable=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    summarized_version = Column(BigInteger, nullable=True) # version the process summaries were last computed at
+
+
+# per process boxplot values of a run, computed once the run completed - see crud.refresh_process_summaries
+class ProcessSummary(Base):
+    __tablename__ = "process_summary"
+    __table_args__ = (
+        UniqueConstraint("token", "run_name", "metric", "process", name="uq_process_summary_process", postgresql_nulls_not_distinct=True),
+    )
+    id = Column(Integer, primary_key=True)
+    token = Column(String, nullable=False)
+    run_name = Column(String, nullable=True)
+    metric = Column(String, nullable=False) # see crud.BOXPLOT_METRICS
+    process = Column(String, nullable=True)
+    count = Column(Integer, default=0)
+    sum = Column(Float, nullable=True)
+    min = Column(Float, nullable=True)
+    quartiles = Column(ARRAY(Float), nullable=True) # q1, median, q3
+    max = Column(Float, nullable=True)
+    source_version = Column(BigInteger, nullable=False) # run version the values were computed at, see RunVersion
+    refreshed_at = Column(DateTime, nullable=True)
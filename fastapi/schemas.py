@@ -1,5 +1,11 @@
+from dataclasses import make_dataclass
+from functools import lru_cache
+from typing import Any
+
 from pydantic import ConfigDict, BaseModel
 
+import models
+
 class RunToken(BaseModel):
     id: str
 
@@ -9,6 +15,33 @@ class User(BaseModel):
     name: str
     run_tokens: list[RunToken] = []
     model_config = ConfigDict(from_attributes=True)
+
+"""
+Row projections for read endpoints
+Plain slotted dataclasses with one field per table column, which orjson serializes natively (including datetimes),
+instead of passing ORM instances through jsonable_encoder.
+"""
+
+def row_dataclass(name, model):
+    return make_dataclass(name, [(column.name, Any) for column in model.__table__.columns], slots=True)
+
+
+RunTraceRow = row_dataclass("RunTraceRow", models.RunTrace)
+RunMetadataRow = row_dataclass("RunMetadataRow", models.RunMetadata)
+StatRow = row_dataclass("StatRow", models.Stat)
+ProcessRow = row_dataclass("ProcessRow", models.Process)
+StatHistoryRow = row_dataclass("StatHistoryRow", models.StatHistory)
+
+
+@lru_cache(maxsize=64)
+def trace_projection_dataclass(field_names: tuple):
+    """
+    Row dataclass for a subset of the trace columns, as selected by the fields parameter of /run/info
+    """
+    if list(field_names) == [column.name for column in models.RunTrace.__table__.columns]:
+        return RunTraceRow
+    return make_dataclass("RunTraceProjection", [(name, Any) for name in field_names], slots=True)
+
 """
  TODO SCHEMAS: adjust so all classes are used correcty - this might speed up the parsing process
 
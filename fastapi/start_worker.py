@@ -1,6 +1,6 @@
 from redis import Redis
 import os
-from rq import Worker, Queue, Connection
+from rq import SimpleWorker, Queue, Connection
 import logging
 import models, crud, main
 
@@ -43,7 +43,9 @@ if __name__ == '__main__':
         logger.addHandler(console_handler)
 
 
-        worker = Worker(map(Queue, ['request_queue']), exception_handlers=[logger])
+        # SimpleWorker executes jobs in this process instead of forking a work horse per job,
+        # so the database engines (and their connection pools) are reused over all jobs
+        worker = SimpleWorker(map(Queue, ['request_queue']), exception_handlers=[logger])
         worker.work()
 
 
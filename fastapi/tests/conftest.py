@@ -0,0 +1,45 @@
+import os
+import sys
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+# the modules of the api are imported top-level, like in the containers
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import models
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+TOKEN_TABLES = ["run_metric", "process_aggregate", "run_version", "process_summary", "run_metadata", "stat_history", "stat"]
+
+
+@pytest.fixture(scope="session")
+def db_engine():
+    """
+    Engine of the Postgres database given by DATABASE_URL (postgresql://...), with the tables of the models created.
+    The tests using it are skipped without DATABASE_URL.
+    """
+    if not DATABASE_URL:
+        pytest.skip("DATABASE_URL is not set")
+    database.SQLALCHEMY_DATABASE_URL = DATABASE_URL
+    database.SQLALCHEMY_ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+    database._sync_engines.clear()
+    database._async_engines.clear()
+    engine = database.get_engine()
+    models.Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def token(db_engine):
+    """
+    A token of its own for the test, its rows are deleted afterwards
+    """
+    token_id = f"test-{uuid.uuid4()}"
+    yield token_id
+    with db_engine.begin() as connection:
+        connection.execute(text("DELETE FROM process WHERE parent_id IN (SELECT id FROM stat WHERE token = :token)"), {"token": token_id})
+        for table in TOKEN_TABLES:
+            connection.execute(text(f"DELETE FROM {table} WHERE token = :token"), {"token": token_id})
@@ -0,0 +1,165 @@
+import math
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import helpers
+from test_scoring import THRESHOLDS, maybe
+
+"""
+The analysis read from the process aggregates (helpers.analyze_process_aggregates) has to match the analysis of all
+traces (helpers.analyze), for runs still in progress as well: the events of randomly generated tasks are applied
+like the trace upsert does, the aggregates are built from the increments of the ingest plus the unfinished tasks,
+like crud.get_process_aggregates_by_token does.
+"""
+
+TOP_TASK_LIMIT = 10
+TOP_TASK_LISTS = {"bad_duration_tasks": "realtime", "bad_cpu_allocation_tasks": "raw_cpu_penalty", "bad_memory_allocation_tasks": "raw_memory_penalty"}
+
+
+def random_metrics(rng):
+    return {
+        "cpus": maybe(rng, rng.randint(1, 16)),
+        "memory": maybe(rng, rng.randint(1, 64) * 2 ** 30),
+        "duration": maybe(rng, rng.randint(1, 10 ** 6)),
+        "vmem": maybe(rng, rng.randint(1, 2 ** 36)),
+        "realtime": maybe(rng, rng.randint(1, 10 ** 6)),
+        "cpu_percentage": maybe(rng, round(rng.uniform(0.1, 2000), 1)),
+        "rss": maybe(rng, rng.randint(1, 2 ** 37)),
+        "memory_percentage": maybe(rng, round(rng.uniform(0.01, 100), 2)),
+    }
+
+
+def random_events(rng, task_id, run_name, process):
+    """
+    Events of a task: optionally submitted, optionally running with partial metrics, then finished or still running,
+    sometimes followed by a late duplicate of an earlier event
+    """
+    base = {"token": "token", "run_id": run_name, "task_id": task_id, "run_name": run_name, "process": process, "tag": None}
+    empty = {key: None for key in random_metrics(rng)}
+    events = []
+    if rng.random() < 0.5:
+        events.append({**base, **empty, "status": "SUBMITTED"})
+    if rng.random() < 0.7:
+        metrics = {key: value if rng.random() < 0.5 else None for key, value in random_metrics(rng).items()}
+        events.append({**base, **metrics, "status": "RUNNING"})
+    if rng.random() < 0.75 or len(events) == 0:
+        events.append({**base, **random_metrics(rng), "status": rng.choice(helpers.TERMINAL_STATES)})
+    if len(events) > 1 and rng.random() < 0.1:
+        events.append(rng.choice(events[:-1]))
+    return events
+
+
+def ingest(rng, run_names):
+    """
+    Applies the events in random interleaving like crud.trace_upsert_statement and sums up the aggregate increments
+    :return: the task rows in order of insertion, the aggregates by process in order of creation
+    """
+    pending = []
+    for run_name in run_names:
+        processes = [f"PROCESS_{index}" for index in range(rng.randint(1, 6))]
+        pending += [random_events(rng, task_id, run_name, rng.choice(processes)) for task_id in range(rng.randint(1, 120))]
+    rows = {}
+    aggregates = {}
+    while len(pending) > 0:
+        events = rng.choice(pending)
+        event = events.pop(0)
+        if len(events) == 0:
+            pending.remove(events)
+        key = (event["run_id"], event["task_id"])
+        previous = rows.get(key)
+        if previous is not None and helpers.get_status_rank(event["status"]) <= helpers.get_status_rank(previous.status):
+            continue
+        rows[key] = SimpleNamespace(**event)
+        changed = SimpleNamespace(**event, previous_status=None if previous is None else previous.status)
+        for delta in helpers.get_process_aggregate_deltas([changed]):
+            aggregate_key = (delta["run_name"], delta["process"])
+            if aggregate_key not in aggregates:
+                aggregates[aggregate_key] = helpers.new_process_aggregate(delta["token"], delta["run_name"], delta["process"])
+            helpers.merge_process_aggregate(aggregates[aggregate_key], delta)
+    return list(rows.values()), aggregates
+
+
+def read_process_aggregates(rows, aggregates):
+    process_aggregates = {}
+    for aggregate in aggregates.values():
+        process_aggregates.setdefault(aggregate["run_name"], []).append(dict(aggregate))
+    by_process = {(aggregate["run_name"], aggregate["process"]): aggregate for run in process_aggregates.values() for aggregate in run}
+    for row in rows:
+        if row.status not in helpers.TERMINAL_STATES:
+            helpers.add_task_to_process_aggregate(by_process[(row.run_name, row.process)], row)
+    return process_aggregates
+
+
+def top_task_key(row, key):
+    if key == "realtime":
+        return row.realtime or -1
+    scored = helpers.calculate_raw_scores_per_task({"status": row.status, "cpus": row.cpus, "cpu_percentage": row.cpu_percentage, "memory": row.memory, "rss": row.rss}, None, None)
+    return scored[key] or -1
+
+
+def read_top_tasks(rows, run_names):
+    # same selection as the indexed queries of crud.get_top_task_rows_by_token
+    top_tasks = {}
+    for run_name in run_names:
+        run_rows = [row for row in rows if row.run_name == run_name]
+        candidates = {}
+        for key in TOP_TASK_LISTS.values():
+            for row in sorted(run_rows, key=lambda row: top_task_key(row, key), reverse=True)[:TOP_TASK_LIMIT]:
+                candidates[row.task_id] = row
+        top_tasks[run_name] = list(candidates.values())
+    return top_tasks
+
+
+def assert_close(actual, expected):
+    if isinstance(expected, dict):
+        assert set(actual) == set(expected)
+        for key in expected:
+            assert_close(actual[key], expected[key])
+    elif isinstance(expected, (list, tuple)):
+        assert len(actual) == len(expected)
+        for actual_value, expected_value in zip(actual, expected):
+            assert_close(actual_value, expected_value)
+    elif isinstance(expected, float) or isinstance(actual, float):
+        assert expected is not None and actual is not None
+        assert math.isclose(actual, expected, rel_tol=1e-9, abs_tol=1e-12)
+    else:
+        assert actual == expected
+
+
+def by_process(entries, key):
+    return {entry[key]: entry for entry in entries}
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_aggregate_analysis_equals_task_analysis(seed):
+    rng = random.Random(seed)
+    run_names = ["run"] if seed % 4 else ["run", "other_run"]
+    rows, aggregates = ingest(rng, run_names)
+    threshold_numbers = rng.choice(THRESHOLDS)
+
+    expected = helpers.analyze(None, helpers.group_by_run_name(rows), threshold_numbers)
+    process_aggregates = read_process_aggregates(rows, aggregates)
+    actual = helpers.analyze_process_aggregates(process_aggregates, read_top_tasks(rows, run_names), threshold_numbers)
+
+    expected_scores = expected["workflow_scores"]
+    actual_scores = actual["workflow_scores"]
+    assert_close(actual_scores["full_scores"], expected_scores["full_scores"])
+    for run_name in run_names:
+        assert_close(by_process(actual_scores["process_scores"][run_name], "process"), by_process(expected_scores["process_scores"][run_name], "process"))
+
+        # the processes are listed in another order, so the per process results are compared per name
+        expected_results = helpers.get_per_process_results_from_tasks(helpers.group_tasks_by_process(expected_scores["task_information"][run_name]))
+        actual_results = helpers.get_per_process_results_from_aggregates(process_aggregates[run_name])
+        assert sorted(actual_results["process_names"]) == sorted(expected_results["process_names"])
+        for section, key in [("duration_sum", "process"), ("duration_average", "process"), ("cpu_allocation", "process_name"), ("memory_allocation", "process_name"), ("rss_ratio", "process_name")]:
+            assert_close(by_process(actual_results[section], key), by_process(expected_results[section], key))
+        assert_close(
+            dict(zip(actual_results["process_names"], actual_results["relation_data"])),
+            dict(zip(expected_results["process_names"], expected_results["relation_data"])),
+        )
+
+        # equal keys may be ordered differently, the worst tasks have to have the same values
+        for top_list, key in TOP_TASK_LISTS.items():
+            assert_close([task[key] for task in actual[top_list][run_name]], [task[key] for task in expected[top_list][run_name]])
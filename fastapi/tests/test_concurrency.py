@@ -0,0 +1,82 @@
+import random
+import asyncio
+import threading
+
+from sqlalchemy import select
+
+import crud
+import database
+import helpers
+import models
+
+"""
+Concurrent ingest of the events of the same tasks has to converge to one row per task holding the newest state,
+whatever the order the transactions commit in (crud.trace_upsert_statement), and has to count every task once in
+the process aggregates. Needs Postgres, see the db_engine fixture.
+"""
+
+TASKS = 5
+WORKERS = 8
+SUBMIT = 1_700_000_000_000
+
+
+def event(task_id, status):
+    trace = {"task_id": task_id, "status": status, "process": "PROCESS", "submit": SUBMIT + task_id, "realtime": 1000, "cpus": 2, "%cpu": 150.0}
+    return {"runId": "run", "runName": "run", "event": "process_" + status.lower(), "trace": trace}
+
+
+def worker_events(seed):
+    rng = random.Random(seed)
+    events = [event(task_id, status) for task_id in range(TASKS) for status in helpers.STATUS_SORTING]
+    rng.shuffle(events)
+    return events
+
+
+def assert_converged(db_engine, token):
+    with db_engine.connect() as connection:
+        rows = connection.execute(select(models.RunTrace.task_id, models.RunTrace.status).where(models.RunTrace.token == token)).all()
+        aggregate = connection.execute(
+            select(models.ProcessAggregate.task_count, models.ProcessAggregate.terminal_count).where(models.ProcessAggregate.token == token)
+        ).one()
+    assert sorted(rows) == [(task_id, "COMPLETED") for task_id in range(TASKS)]
+    assert tuple(aggregate) == (TASKS, TASKS)
+
+
+def test_concurrent_batches_converge_to_one_row_per_task(db_engine, token):
+    barrier = threading.Barrier(WORKERS)
+    errors = []
+
+    def work(seed):
+        barrier.wait()
+        try:
+            for json_ob in worker_events(seed):
+                crud.persist_trace_batch([(json_ob, token)])
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=work, args=(seed,)) for seed in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert_converged(db_engine, token)
+
+
+def test_concurrent_jobs_converge_to_one_row_per_task(db_engine, token):
+    async def work(seed):
+        for json_ob in worker_events(seed):
+            session = database.get_async_session()
+            try:
+                await crud.persist_singleton_trace_data(session, crud.get_trace_data(json_ob, token))
+            finally:
+                await session.close()
+
+    async def run():
+        try:
+            await asyncio.gather(*[work(seed) for seed in range(WORKERS)])
+        finally:
+            await database.get_async_engine().dispose()
+
+    asyncio.run(run())
+    assert_converged(db_engine, token)
@@ -0,0 +1,145 @@
+from datetime import datetime
+
+import orjson
+import pytest
+
+import crud
+import helpers
+import ingest
+
+"""
+Merging of the events of a batch (helpers.coalesce_trace_data, helpers.get_status_rank) and the list handling of
+the batching consumer: draining, acknowledging, requeueing after a crash and dead-lettering. Redis is replaced by
+an in memory implementation of the list commands the consumer uses.
+"""
+
+
+class ListRedis:
+    def __init__(self):
+        self.lists = {}
+
+    def _list(self, name):
+        return self.lists.setdefault(name, [])
+
+    def rpush(self, name, *values):
+        self._list(name).extend(values)
+        return len(self._list(name))
+
+    def lrange(self, name, start, end):
+        values = self._list(name)
+        return values[start:] if end == -1 else values[start:end + 1]
+
+    def ltrim(self, name, start, end):
+        self.lists[name] = self.lrange(name, start, end)
+
+    def lmove(self, source, destination, wherefrom, whereto):
+        if len(self._list(source)) == 0:
+            return None
+        value = self._list(source).pop(0 if wherefrom == "LEFT" else -1)
+        if whereto == "LEFT":
+            self._list(destination).insert(0, value)
+        else:
+            self._list(destination).append(value)
+        return value
+
+    def blmove(self, source, destination, timeout, wherefrom, whereto):
+        # nothing arrives while the test waits, an empty list times out right away
+        return self.lmove(source, destination, wherefrom, whereto)
+
+    def evalsha(self, sha, numkeys, *args):
+        assert sha == ingest.move_events.sha
+        source, destination, count = *args[:numkeys], int(args[numkeys])
+        events = self._list(source)[:count]
+        self.ltrim(source, len(events), -1)
+        self._list(destination).extend(events)
+        return events
+
+
+def trace(task_id, status, submit=None, token="token"):
+    return {"token": token, "run_id": "run", "task_id": task_id, "status": status, "submit": submit}
+
+
+def test_status_rank_follows_status_sorting():
+    ranks = [helpers.get_status_rank(status) for status in helpers.STATUS_SORTING]
+    assert ranks == sorted(ranks) and ranks[0] == 1
+    assert helpers.get_status_rank(None) == 0
+    assert helpers.get_status_rank("UNKNOWN") == 0
+
+
+def test_coalesce_keeps_the_newest_state_per_task():
+    submit = datetime(2026, 1, 1)
+    newest = helpers.coalesce_trace_data([
+        trace(1, "SUBMITTED", submit), trace(1, "COMPLETED"), trace(1, "RUNNING"),
+        trace(2, "RUNNING"), trace(2, "UNKNOWN"), trace(2, "RUNNING", token="other"),
+    ])
+    assert list(newest) == [("token", "run", 1), ("token", "run", 2), ("other", "run", 2)]
+    # the completed event wins, the submit time of the first event is kept for the conflict key
+    assert newest[("token", "run", 1)] == trace(1, "COMPLETED", submit)
+    assert newest[("token", "run", 2)]["status"] == "RUNNING"
+
+
+def test_coalesce_keeps_the_first_event_on_equal_states():
+    first, second = {**trace(1, "RUNNING"), "realtime": 1}, {**trace(1, "RUNNING"), "realtime": 2}
+    assert helpers.coalesce_trace_data([first, second])[("token", "run", 1)]["realtime"] == 1
+
+
+@pytest.fixture
+def r_con():
+    return ListRedis()
+
+
+def push(r_con, count):
+    for index in range(count):
+        ingest.push_event(r_con, {"trace": {"task_id": index}}, "token")
+
+
+def test_drain_moves_a_batch_to_the_processing_list(r_con):
+    push(r_con, 7)
+    processing_list = ingest.get_processing_list("consumer")
+    batch = ingest.drain_batch(r_con, processing_list, max_events=5, max_wait_ms=0)
+    assert [orjson.loads(event)["event"]["trace"]["task_id"] for event in batch] == [0, 1, 2, 3, 4]
+    assert r_con.lrange(processing_list, 0, -1) == batch
+    assert len(r_con.lrange(ingest.TRACE_EVENT_BUFFER, 0, -1)) == 2
+    assert ingest.drain_batch(r_con, processing_list, max_events=5, max_wait_ms=0) == r_con.lrange(processing_list, 5, -1)
+    assert ingest.drain_batch(r_con, processing_list, max_events=5, max_wait_ms=0) == []
+
+
+def test_acknowledged_events_leave_the_processing_list(r_con):
+    push(r_con, 4)
+    processing_list = ingest.get_processing_list("consumer")
+    batch = ingest.drain_batch(r_con, processing_list, max_events=4, max_wait_ms=0)
+    ingest.acknowledge(r_con, processing_list, 3)
+    assert r_con.lrange(processing_list, 0, -1) == batch[3:]
+
+
+def test_unacknowledged_events_are_requeued_in_order(r_con):
+    push(r_con, 6)
+    processing_list = ingest.get_processing_list("consumer")
+    batch = ingest.drain_batch(r_con, processing_list, max_events=4, max_wait_ms=0)
+    # the consumer crashed before acknowledging, its restart puts the batch back in front of the newer events
+    buffered = r_con.lrange(ingest.TRACE_EVENT_BUFFER, 0, -1)
+    assert ingest.requeue_unacknowledged(r_con, processing_list) == 4
+    assert r_con.lrange(processing_list, 0, -1) == []
+    assert r_con.lrange(ingest.TRACE_EVENT_BUFFER, 0, -1) == batch + buffered
+
+
+def test_failing_events_are_dead_lettered_one_by_one(r_con, monkeypatch):
+    push(r_con, 3)
+    processing_list = ingest.get_processing_list("consumer")
+    batch = ingest.drain_batch(r_con, processing_list, max_events=3, max_wait_ms=0)
+    events = [(orjson.loads(event)["event"], "token") for event in batch]
+    persisted, published = [], []
+
+    def persist_trace_batch(batch_events):
+        if batch_events[0][0]["trace"]["task_id"] == 1:
+            raise ValueError("malformed event")
+        persisted.extend(batch_events)
+        return [], []
+
+    monkeypatch.setattr(crud, "persist_trace_batch", persist_trace_batch)
+    monkeypatch.setattr(crud, "publish_trace_batch", lambda batch_events, changed_tasks, metadata_data_list: published.extend(batch_events))
+    ingest.persist_one_by_one(r_con, processing_list, batch, events)
+
+    assert persisted == published == [events[0], events[2]]
+    assert r_con.lrange(ingest.TRACE_EVENT_DEAD_LETTER, 0, -1) == [batch[1]]
+    assert r_con.lrange(processing_list, 0, -1) == []
@@ -0,0 +1,68 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+import crud
+import database
+import models
+
+"""
+A task first seen without a submit time is filed under its start time (crud.resolve_submits). Its later events,
+which carry the real submit, have to update that row instead of inserting a second one. Needs Postgres, see the
+db_engine fixture.
+"""
+
+SUBMIT = 1_700_000_000_000
+START = SUBMIT + 5000
+
+
+def event(status, submit=None):
+    trace = {"task_id": 1, "status": status, "process": "PROCESS", "start": START, "realtime": 1000, "cpus": 1, "%cpu": 90.0}
+    if submit is not None:
+        trace["submit"] = submit
+    return {"runId": "run", "runName": "run", "event": "process_" + status.lower(), "trace": trace}
+
+
+def persist_singleton(json_ob, token):
+    async def persist():
+        session = database.get_async_session()
+        try:
+            await crud.persist_singleton_trace_data(session, crud.get_trace_data(json_ob, token))
+        finally:
+            await session.close()
+            await database.get_async_engine().dispose()
+
+    asyncio.run(persist())
+
+
+PERSIST = {
+    "batch": lambda json_ob, token: crud.persist_trace_batch([(json_ob, token)]),
+    "job": persist_singleton,
+}
+
+
+@pytest.mark.parametrize("path", list(PERSIST))
+def test_late_submit_updates_the_persisted_row(db_engine, token, path):
+    PERSIST[path](event("RUNNING"), token)
+    PERSIST[path](event("COMPLETED", SUBMIT), token)
+
+    with db_engine.connect() as connection:
+        rows = connection.execute(select(models.RunTrace.status, models.RunTrace.submit).where(models.RunTrace.token == token)).all()
+        aggregate = connection.execute(
+            select(models.ProcessAggregate.task_count, models.ProcessAggregate.terminal_count).where(models.ProcessAggregate.token == token)
+        ).one()
+    # the row keeps the submit it was filed under, the partitioning column is never updated
+    assert [tuple(row) for row in rows] == [("COMPLETED", datetime.fromtimestamp(START / 1000))]
+    assert tuple(aggregate) == (1, 1)
+
+
+def test_late_submit_within_a_batch(db_engine, token):
+    crud.persist_trace_batch([(event("RUNNING"), token), (event("COMPLETED", SUBMIT), token)])
+    crud.persist_trace_batch([(event("COMPLETED", SUBMIT), token)])
+
+    with db_engine.connect() as connection:
+        rows = connection.execute(select(models.RunTrace.status, models.RunTrace.submit).where(models.RunTrace.token == token)).all()
+    # merged before the upsert, the submit of any event of the task is used
+    assert [tuple(row) for row in rows] == [("COMPLETED", datetime.fromtimestamp(SUBMIT / 1000))]
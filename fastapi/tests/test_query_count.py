@@ -0,0 +1,56 @@
+import pytest
+from sqlalchemy import event
+
+import crud
+import database
+
+"""
+The stats and processes of a token are loaded with one joined query each, however many runs and metadata events
+the token has. The statements are counted with a before_cursor_execute listener. Needs Postgres, see the db_engine
+fixture.
+"""
+
+PROCESSES = 4
+
+
+def metadata_event(run_index, event_index):
+    processes = [{"name": f"PROCESS_{index}", "index": index, "succeeded": event_index} for index in range(PROCESSES)]
+    return {
+        "runId": f"run_{run_index}", "runName": f"run_{run_index}", "event": "started" if event_index == 0 else "completed",
+        "utcTime": f"2026-01-01T00:00:{event_index:02d}Z",
+        "metadata": {"workflow": {"stats": {"succeededCount": event_index, "processes": processes}}},
+    }
+
+
+def persist_runs(token, runs, events_per_run=2):
+    crud.persist_trace_batch([(metadata_event(run_index, event_index), token) for event_index in range(events_per_run) for run_index in range(runs)])
+
+
+def count_queries(db_engine, function):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", record)
+    db = database.get_session()
+    try:
+        result = function(db)
+    finally:
+        event.remove(db_engine, "before_cursor_execute", record)
+        db.close()
+    return len(statements), result
+
+
+@pytest.mark.parametrize("runs", [1, 8])
+def test_stats_and_processes_take_one_query_each(db_engine, token, runs):
+    persist_runs(token, runs)
+
+    stat_queries, stats = count_queries(db_engine, lambda db: crud.get_stat_rows_by_token(db, token))
+    process_queries, processes = count_queries(db_engine, lambda db: crud.get_process_rows_by_token(db, token))
+    filtered_queries, filtered = count_queries(db_engine, lambda db: crud.get_process_rows_by_token(db, token, "run_0", ["PROCESS_0"]))
+
+    # one snapshot per run, holding the processes of its newest event
+    assert (stat_queries, len(stats)) == (1, runs)
+    assert (process_queries, len(processes)) == (1, runs * PROCESSES)
+    assert (filtered_queries, [process.name for process in filtered]) == (1, ["PROCESS_0"])
@@ -0,0 +1,84 @@
+import orjson
+import pytest
+from sqlalchemy import event, select
+
+import crud
+import database
+import models
+
+"""
+The keyset pagination and the per token queries have to be served by their indexes. The statements a crud function
+sends are recorded and explained with the same parameters, sequential scans and the join strategies which read
+whole tables are disabled, as the planner prefers them on the small tables of the tests anyway. Needs Postgres, see
+the db_engine fixture.
+"""
+
+PLANNER_SETTINGS = ["SET LOCAL enable_seqscan = off", "SET LOCAL enable_hashjoin = off", "SET LOCAL enable_mergejoin = off"]
+
+
+def index_names(plan):
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= index_names(child)
+    return names
+
+
+def used_indexes(db_engine, function):
+    """
+    Runs function with a session and returns the indexes the plans of its statements use, as one set per statement
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(db_engine, "before_cursor_execute", record)
+    db = database.get_session()
+    try:
+        function(db)
+    finally:
+        event.remove(db_engine, "before_cursor_execute", record)
+        db.close()
+    plans = []
+    with db_engine.begin() as connection:
+        for setting in PLANNER_SETTINGS:
+            connection.exec_driver_sql(setting)
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+            if isinstance(plan, str):
+                plan = orjson.loads(plan)
+            plans.append(index_names(plan[0]["Plan"]))
+    return plans
+
+
+@pytest.fixture
+def run_token(token):
+    # a running task keeps the unfinished tasks query of the analysis in use
+    trace = {"task_id": 1, "status": "RUNNING", "process": "PROCESS", "submit": 1_700_000_000_000, "realtime": 1000}
+    crud.persist_trace_batch([({"runId": "run", "runName": "run", "event": "process_started", "trace": trace}, token)])
+    return token
+
+
+def test_trace_pages_use_the_keyset_index(db_engine, run_token):
+    def read_pages(db):
+        page = crud.get_trace_page(db, run_token, 1)
+        crud.get_trace_page(db, run_token, 1, page["next"] or crud.encode_cursor(["run", 1, 0]))
+
+    plans = used_indexes(db_engine, read_pages)
+    # the estimate of every page is explained as well
+    assert all("ix_run_metric_token_run_name_task" in indexes for indexes in plans)
+
+
+@pytest.mark.parametrize("function, expected", [
+    (lambda db, token: crud.get_task_rows_by_run_name(db, token, "run", processes=["PROCESS"]), ["ix_run_metric_token_run_name_process"]),
+    (lambda db, token: crud.get_meta_rows_by_token(db, token, "run"), ["ix_run_metadata_token_run_id"]),
+    (lambda db, token: crud.get_stat_rows_by_token(db, token), ["ix_stat_parent_id"]),
+    (lambda db, token: crud.get_process_rows_by_token(db, token), ["ix_process_parent_id"]),
+    (lambda db, token: db.execute(select(models.User).where(models.User.run_tokens.contains([token]))).all(), ["ix_user_run_tokens"]),
+    (lambda db, token: crud.get_process_aggregates_by_token(db, token), ["ix_run_metric_token_run_name_unfinished"]),
+    (lambda db, token: crud.get_top_task_rows_by_token(db, token, ["run"]), [f"ix_run_metric_token_run_name_top_{key}" for key in models.TOP_TASK_KEYS]),
+])
+def test_per_token_queries_use_their_indexes(db_engine, run_token, function, expected):
+    indexes = set().union(*used_indexes(db_engine, lambda db: function(db, run_token)))
+    assert set(expected) <= indexes
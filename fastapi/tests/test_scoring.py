@@ -0,0 +1,69 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import helpers
+
+"""
+The columnar scoring (helpers.calculate_scores_columnar) has to produce exactly the results of the dict based
+reference implementation (helpers.calculate_scores), on randomly generated runs including missing, zero and
+failed values.
+"""
+
+THRESHOLDS = [
+    {'valid_cpu_allocation_deviation': None, 'valid_memory_allocation_deviation': None, 'cpu_weight': None, 'ram_weight': None},
+    {'valid_cpu_allocation_deviation': 10, 'valid_memory_allocation_deviation': 40, 'cpu_weight': 2, 'ram_weight': 1},
+    {'valid_cpu_allocation_deviation': 10, 'valid_memory_allocation_deviation': 40, 'cpu_weight': 0.0001, 'ram_weight': 3},
+]
+
+
+def maybe(rng, value, missing=0.15):
+    draw = rng.random()
+    if draw < missing:
+        return None
+    if draw < missing * 1.5:
+        return 0
+    return value
+
+
+def random_tasks(rng, count, run_name="run"):
+    processes = [f"PROCESS_{index}" for index in range(rng.randint(1, 6))]
+    return [
+        SimpleNamespace(
+            task_id=task_id, process=rng.choice(processes), run_name=run_name, tag=None,
+            cpus=maybe(rng, rng.randint(1, 16)),
+            memory=maybe(rng, rng.randint(1, 64) * 2 ** 30),
+            duration=maybe(rng, rng.randint(1, 10 ** 6)),
+            vmem=maybe(rng, rng.randint(1, 2 ** 36)),
+            realtime=maybe(rng, rng.randint(1, 10 ** 6)),
+            cpu_percentage=maybe(rng, round(rng.uniform(0.1, 2000), 1)),
+            rss=maybe(rng, rng.randint(1, 2 ** 37)),
+            memory_percentage=maybe(rng, round(rng.uniform(0.01, 100), 2)),
+            status=rng.choice(["COMPLETED", "FAILED", "RUNNING", "COMPLETED"]),
+        )
+        for task_id in range(count)
+    ]
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_columnar_scores_equal_dict_scores(seed):
+    rng = random.Random(seed)
+    grouped_processes = {"run": random_tasks(rng, rng.randint(1, 200))}
+    if seed % 5 == 0:
+        grouped_processes["other_run"] = random_tasks(rng, rng.randint(1, 50), "other_run")
+    threshold_numbers = rng.choice(THRESHOLDS)
+
+    expected = helpers.calculate_scores(grouped_processes, threshold_numbers)
+    actual = helpers.calculate_scores_columnar(grouped_processes, threshold_numbers)
+
+    assert actual["full_scores"] == expected["full_scores"]
+    assert actual["task_information"] == expected["task_information"]
+    for run_name in grouped_processes:
+        for expected_task, actual_task in zip(expected["task_information"][run_name], actual["task_information"][run_name]):
+            assert list(actual_task) == list(expected_task)
+            assert {key: type(value) for key, value in actual_task.items()} == {key: type(value) for key, value in expected_task.items()}
+        # the dict based implementation lists the processes in set order
+        assert {score["process"]: score for score in actual["process_scores"][run_name]} == {
+            score["process"]: score for score in expected["process_scores"][run_name]
+        }
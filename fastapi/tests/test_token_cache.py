@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import cache
+
+"""
+Token validity cache: a token removed by any process is dropped from the LRU of every process once the
+invalidation is received, and a lookup running while an invalidation arrives does not cache its result. Redis is
+replaced by an in memory set which delivers the published invalidations to this process right away.
+"""
+
+
+class TokenRedis:
+    def __init__(self, tokens=()):
+        self.tokens = set(tokens)
+        self.published = []
+
+    def sismember(self, name, token_id):
+        return token_id in self.tokens
+
+    def sadd(self, name, token_id):
+        self.tokens.add(token_id)
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def srem(self, name, token_id):
+        self.tokens.discard(token_id)
+
+    def publish(self, channel, token_id):
+        self.published.append((channel, token_id))
+
+    def execute(self):
+        for channel, token_id in self.published:
+            cache.handle_invalidation_message({"type": "message", "channel": channel.encode(), "data": token_id.encode()})
+        self.published = []
+
+
+@pytest.fixture
+def r_con(monkeypatch):
+    r_con = TokenRedis(["token"])
+    monkeypatch.setattr(cache, "r_con", r_con)
+    # the listener thread is not started, the invalidations are delivered by TokenRedis
+    monkeypatch.setattr(cache, "token_invalidation_listener_pid", os.getpid())
+    cache.forget_tokens()
+    yield r_con
+    cache.forget_tokens()
+
+
+def test_known_tokens_are_served_from_the_lru(r_con):
+    assert cache.is_valid_token("token", lambda: pytest.fail("the database is not asked for known tokens"))
+    r_con.tokens.clear()
+    assert cache.is_valid_token("token", lambda: False)
+
+
+def test_invalidated_tokens_are_dropped_from_the_lru(r_con):
+    assert cache.is_valid_token("token", lambda: True)
+    cache.handle_invalidation_message({"type": "message", "channel": cache.TOKEN_INVALIDATION_CHANNEL.encode(), "data": b"token"})
+    assert "token" not in cache.token_cache
+
+
+def test_invalidate_token_reaches_all_processes(r_con):
+    assert cache.is_valid_token("token", lambda: True)
+    cache.invalidate_token("token")
+    assert not cache.is_valid_token("token", lambda: False)
+
+
+def test_a_new_subscription_clears_the_lru(r_con):
+    assert cache.is_valid_token("token", lambda: True)
+    cache.handle_invalidation_message({"type": "subscribe", "channel": cache.TOKEN_INVALIDATION_CHANNEL.encode(), "data": 1})
+    assert len(cache.token_cache) == 0
+
+
+def test_lookups_racing_an_invalidation_are_not_cached(r_con):
+    def lookup():
+        # the token is removed by another process while this one asks the database
+        cache.handle_invalidation_message({"type": "message", "channel": cache.TOKEN_INVALIDATION_CHANNEL.encode(), "data": b"other"})
+        return True
+
+    assert cache.is_valid_token("other", lookup)
+    assert "other" not in cache.token_cache